@@ -1,13 +1,18 @@
 import asyncio
+import hmac
 import logging
+import os
+import signal
+import sys
 import uuid
-from contextlib import asynccontextmanager
-from aiogram import Bot, Dispatcher
-from aiogram.enums import ParseMode
-from aiogram.client.default import DefaultBotProperties
-from fastapi import FastAPI, HTTPException, Request
+from contextlib import asynccontextmanager, suppress
+
+# Первым: от этого момента считается время старта
+from services.startup import profile
+
+from fastapi import FastAPI, HTTPException, Request, Header
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import HTMLResponse, FileResponse, JSONResponse
+from fastapi.responses import HTMLResponse, FileResponse, JSONResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
 from typing import Optional
@@ -16,20 +21,21 @@ import uvicorn
 
 from config import (
     BOT_TOKEN, BOT_USERNAME,
-    YOOKASSA_SHOP_ID, YOOKASSA_SECRET_KEY, SUPPORT_PRICE
+    YOOKASSA_SHOP_ID, YOOKASSA_SECRET_KEY, SUPPORT_PRICE, ADMIN_TOKEN,
+    ALL_ROLES, ROLES, parse_roles
 )
 import database as db
-from services.notifications import setup_scheduler
-from handlers import start, subscriptions, trials, analytics, achievements, settings
-
-# ЮКасса
-try:
-    from yookassa import Configuration, Payment
-    Configuration.account_id = YOOKASSA_SHOP_ID
-    Configuration.secret_key = YOOKASSA_SECRET_KEY
-    YOOKASSA_ENABLED = bool(YOOKASSA_SHOP_ID and YOOKASSA_SECRET_KEY)
-except ImportError:
-    YOOKASSA_ENABLED = False
+from services.search import search_services
+from services.population import get_population, get_user_insight
+from services.export import FORMATS, ExportError, stream_export
+from services.importer import import_subscriptions
+from services.achievements import dispatch as dispatch_achievement
+from services.payments import POLL_INTERVAL, REMOTE_POLL_INTERVAL, receive_event, run_payment_worker
+from services.entitlements import get_entitlement, can_add_subscription
+
+profile.record("import bot.py", profile.started)
+
+YOOKASSA_ENABLED = bool(YOOKASSA_SHOP_ID and YOOKASSA_SECRET_KEY)
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -78,42 +84,158 @@ class PaymentCreate(BaseModel):
 
 # ========== FASTAPI ==========
 
-bot_instance: Bot = None
+bot_instance = None
 
-@asynccontextmanager
-async def lifespan(app: FastAPI):
+# Фоновые задачи и планировщик, поднятые в boot()
+runtime = {}
+
+# Роли этого процесса; python bot.py <роли> переопределяет ROLES из окружения
+roles = set(ROLES)
+
+VERSION_SYNC_INTERVAL = 2
+
+
+async def sync_versions_forever():
+    """Сброс кэшей по изменениям, сделанным другими процессами"""
+    while True:
+        await asyncio.sleep(VERSION_SYNC_INTERVAL)
+        try:
+            await db.sync_data_versions()
+        except Exception as e:
+            logger.error(f"❌ Version sync failed: {e}")
+
+# Сколько запрос к API ждёт окончания старта, прежде чем получить 503
+READY_TIMEOUT = 30
+
+
+async def boot():
+    """Тяжёлая часть старта: идёт в фоне, пока HTTP-сервер уже отвечает"""
     global bot_instance
     
-    await db.init_db()
-    logger.info("✅ Database initialized")
-    
-    if YOOKASSA_ENABLED:
-        logger.info("✅ YooKassa configured")
-    else:
-        logger.warning("⚠️ YooKassa not configured")
-    
-    bot_instance = Bot(token=BOT_TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
-    dp = Dispatcher()
-    
-    dp.include_router(start.router)
-    dp.include_router(subscriptions.router)
-    dp.include_router(trials.router)
-    dp.include_router(analytics.router)
-    dp.include_router(achievements.router)
-    dp.include_router(settings.router)
+    try:
+        logger.info(f"🧩 Roles: {', '.join(sorted(roles))}")
+        
+        with profile.step("init_db"):
+            await db.init_db()
+        logger.info("✅ Database initialized")
+        
+        if YOOKASSA_ENABLED:
+            logger.info("✅ YooKassa configured")
+        else:
+            logger.warning("⚠️ YooKassa not configured")
+        
+        # Боту (апдейты) и планировщику (рассылки) нужен клиент Telegram
+        if roles & {"bot", "scheduler"}:
+            with profile.step("import aiogram"):
+                from aiogram import Bot, Dispatcher
+                from aiogram.enums import ParseMode
+                from aiogram.client.default import DefaultBotProperties
+            bot_instance = Bot(token=BOT_TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
+        
+        if "bot" in roles:
+            with profile.step("import handlers"):
+                from handlers import start, subscriptions, trials, analytics, achievements, settings, search
+                from handlers.middleware import UnitOfWorkMiddleware
+            
+            with profile.step("bot + routers"):
+                dp = Dispatcher()
+                dp.update.outer_middleware(UnitOfWorkMiddleware())
+                
+                dp.include_router(start.router)
+                dp.include_router(subscriptions.router)
+                dp.include_router(trials.router)
+                dp.include_router(analytics.router)
+                dp.include_router(achievements.router)
+                dp.include_router(settings.router)
+                dp.include_router(search.router)
+        
+        with profile.step("import scheduler"):
+            from services.notifications import setup_scheduler, drain_notifications
+        
+        # Роли в разных процессах: кэши сбрасываются по ленте изменений в базе
+        if roles != ALL_ROLES:
+            await db.sync_data_versions()
+            runtime['sync'] = asyncio.create_task(sync_versions_forever())
+        
+        with profile.step("scheduler"):
+            runtime['scheduler'] = setup_scheduler(
+                bot_instance,
+                shared="scheduler" in roles,
+                stats=bool(roles & {"api", "bot"})
+            )
+            runtime['drain'] = drain_notifications
+            runtime['scheduler'].start()
+        
+        if "bot" in roles:
+            # Сигналы обрабатывает uvicorn / run_without_http, а не aiogram
+            runtime['polling'] = asyncio.create_task(dp.start_polling(bot_instance, handle_signals=False))
+            logger.info("🚀 Bot started")
+        if "scheduler" in roles:
+            # Вебхуки приходят в процесс с ролью api и будят обработчик, только если он здесь же
+            runtime['payments'] = asyncio.create_task(run_payment_worker(
+                POLL_INTERVAL if "api" in roles else REMOTE_POLL_INTERVAL
+            ))
+        if "api" in roles:
+            logger.info(f"📱 Mini App ready at /")
+        
+        profile.mark_ready()
+    except Exception as e:
+        profile.fail(e)
+        logger.exception("❌ Startup failed")
+        raise
+
+
+async def shutdown(boot_task: asyncio.Task):
+    # Старт мог не закончиться: дожидаемся отмены, чтобы не оборвать запись в базу
+    boot_task.cancel()
+    with suppress(BaseException):
+        await boot_task
     
-    scheduler = setup_scheduler(bot_instance)
-    scheduler.start()
+    tasks = [runtime[name] for name in ('polling', 'payments', 'sync') if name in runtime]
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
     
-    polling_task = asyncio.create_task(dp.start_polling(bot_instance))
-    logger.info("🚀 Bot started")
-    logger.info(f"📱 Mini App ready at /")
+    # Рассылка дописывает текущее сообщение и сохраняет курсор до закрытия сессии бота
+    if 'drain' in runtime:
+        await runtime['drain']()
+    if 'scheduler' in runtime:
+        runtime['scheduler'].shutdown()
     
+    # ЮКасса загружается при первом платеже
+    yookassa = sys.modules.get("services.yookassa")
+    if yookassa:
+        await yookassa.close_client()
+    if bot_instance:
+        await bot_instance.session.close()
+    await db.close_writer()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    boot_task = asyncio.create_task(boot())
     yield
+    await shutdown(boot_task)
+
+
+async def run_without_http():
+    """Роли bot и scheduler без HTTP-сервера: до SIGTERM / SIGINT"""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+    
+    boot_task = asyncio.create_task(boot())
+    stop_task = asyncio.create_task(stop.wait())
+    await asyncio.wait({boot_task, stop_task}, return_when=asyncio.FIRST_COMPLETED)
     
-    polling_task.cancel()
-    scheduler.shutdown()
-    await bot_instance.session.close()
+    failed = boot_task.done() and boot_task.exception() is not None
+    if not failed:
+        await stop_task
+    await shutdown(boot_task)
+    if failed:
+        raise SystemExit(1)
+
 
 app = FastAPI(lifespan=lifespan)
 
@@ -125,6 +247,19 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+
+@app.middleware("http")
+async def wait_until_ready(request: Request, call_next):
+    """Пока идёт старт, запросы к API ждут его окончания; после сбоя — сразу 503"""
+    if request.url.path.startswith("/api/") and not profile.ready.is_set():
+        try:
+            await asyncio.wait_for(profile.finished.wait(), timeout=READY_TIMEOUT)
+        except asyncio.TimeoutError:
+            return JSONResponse({"detail": "Starting up"}, status_code=503)
+        if profile.error is not None:
+            return JSONResponse({"detail": "Startup failed"}, status_code=503)
+    return await call_next(request)
+
 # ========== MINI APP ==========
 
 @app.get("/", response_class=HTMLResponse)
@@ -145,6 +280,13 @@ async def mini_app():
 async def health():
     return {"status": "ok", "app": "SubTracker", "yookassa": YOOKASSA_ENABLED}
 
+
+@app.get("/ready")
+async def ready():
+    """Готовность: база, бот и планировщик подняты"""
+    report = profile.report()
+    return JSONResponse(report, status_code=200 if report['ready'] else 503)
+
 # ========== PAYMENT API ==========
 
 class PaymentCreate(BaseModel):
@@ -159,44 +301,28 @@ async def create_payment_endpoint(data: PaymentCreate):
     """Создать платёж"""
     
     # Сначала создаём пользователя если его нет
-    user = await db.get_user(data.user_id)
-    if not user:
-        user = await db.create_user(data.user_id, None, "Пользователь")
+    await db.ensure_user(data.user_id, None, "Пользователь")
     
     # Проверяем настроена ли ЮКасса
-    from config import YOOKASSA_SHOP_ID, YOOKASSA_SECRET_KEY, BOT_USERNAME
+    from services.yookassa import YooKassaError, get_client
+    client = get_client()
     
-    if YOOKASSA_SHOP_ID and YOOKASSA_SECRET_KEY:
+    if client:
         try:
-            from yookassa import Configuration, Payment
-            import uuid
-            
-            Configuration.account_id = YOOKASSA_SHOP_ID
-            Configuration.secret_key = YOOKASSA_SECRET_KEY
-            
-            idempotence_key = str(uuid.uuid4())
-            
-            payment = Payment.create({
-                "amount": {
-                    "value": str(data.amount),
-                    "currency": "RUB"
-                },
-                "confirmation": {
-                    "type": "redirect",
-                    "return_url": f"https://t.me/{BOT_USERNAME}?start=payment_success"
-                },
-                "capture": True,
-                "description": data.description,
-                "metadata": {
+            payment = await client.create_payment(
+                amount=data.amount,
+                description=data.description,
+                return_url=f"https://t.me/{BOT_USERNAME}?start=payment_success",
+                metadata={
                     "user_id": data.user_id,
                     "payment_type": data.payment_type
                 }
-            }, idempotence_key)
+            )
             
             # Сохраняем платёж
             await db.create_payment(
                 user_id=data.user_id,
-                payment_id=payment.id,
+                payment_id=payment['id'],
                 amount=data.amount,
                 payment_type=data.payment_type,
                 status="pending"
@@ -204,12 +330,12 @@ async def create_payment_endpoint(data: PaymentCreate):
             
             return {
                 "success": True,
-                "payment_id": payment.id,
-                "payment_url": payment.confirmation.confirmation_url,
+                "payment_id": payment['id'],
+                "payment_url": payment['confirmation']['confirmation_url'],
                 "method": "yookassa"
             }
             
-        except Exception as e:
+        except YooKassaError as e:
             # Если ошибка — fallback на бота
             return {
                 "success": True,
@@ -219,7 +345,6 @@ async def create_payment_endpoint(data: PaymentCreate):
             }
     else:
         # ЮКасса не настроена — открываем бота
-        BOT_USERNAME = "ssubby_bot"  # Замените на username вашего бота
         return {
             "success": True,
             "payment_url": f"https://t.me/{BOT_USERNAME}?start=donate_{int(data.amount)}",
@@ -229,24 +354,15 @@ async def create_payment_endpoint(data: PaymentCreate):
 
 @app.post("/api/payment/webhook")
 async def payment_webhook(request: Request):
-    """Webhook от ЮКассы"""
+    """Webhook от ЮКассы: событие сохраняется в инбокс, обработка — в фоне"""
     try:
         body = await request.json()
-        event = body.get("event")
-        payment_data = body.get("object", {})
-        
-        if event == "payment.succeeded":
-            payment_id = payment_data.get("id")
-            metadata = payment_data.get("metadata", {})
-            user_id = metadata.get("user_id")
-            
-            if user_id:
-                await db.update_payment_status(payment_id, "succeeded")
-                await db.set_premium(int(user_id), days=30)
-        
-        return {"status": "ok"}
-    except Exception as e:
-        return {"status": "error", "message": str(e)}
+        await receive_event(body)
+    except (ValueError, AttributeError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    # Ошибка записи в базу уходит 500-м ответом, и ЮКасса повторит доставку
+    return {"status": "ok"}
 
 
 # ========== USER API ==========
@@ -255,16 +371,16 @@ async def payment_webhook(request: Request):
 async def auth(data: UserAuth):
     """Авторизация/регистрация пользователя"""
     user = await db.get_or_create_user(data.user_id, data.username, data.first_name)
+    await dispatch_achievement(data.user_id, "visit")
     return user
 
 
 @app.get("/api/user/{user_id}")
 async def get_user(user_id: int):
     """Получить пользователя"""
+    await db.ensure_user(user_id)
     user = await db.get_user(user_id)
-    if not user:
-        user = await db.create_user(user_id)
-    return user
+    return {**user, "entitlement": await get_entitlement(user_id)}
 
 
 @app.put("/api/user/{user_id}/settings")
@@ -279,10 +395,7 @@ async def update_settings(user_id: int, data: SettingsUpdate):
 
 @app.get("/api/subscriptions/{user_id}")
 async def get_subscriptions(user_id: int):
-    # Убедимся что пользователь существует
-    user = await db.get_user(user_id)
-    if not user:
-        await db.create_user(user_id)
+    await db.ensure_user(user_id)
     
     subs = await db.get_subscriptions(user_id)
     stats = await db.get_stats(user_id)
@@ -291,10 +404,9 @@ async def get_subscriptions(user_id: int):
 
 @app.post("/api/subscriptions/{user_id}")
 async def create_subscription(user_id: int, data: SubscriptionCreate):
-    # Убедимся что пользователь существует
-    user = await db.get_user(user_id)
-    if not user:
-        await db.create_user(user_id)
+    await db.ensure_user(user_id)
+    if not await can_add_subscription(user_id):
+        raise HTTPException(status_code=403, detail="Free subscriptions limit reached")
     
     sub_id = await db.add_subscription(
         user_id=user_id,
@@ -308,6 +420,18 @@ async def create_subscription(user_id: int, data: SubscriptionCreate):
     return {"id": sub_id, "status": "created"}
 
 
+@app.post("/api/subscriptions/{user_id}/import")
+async def import_subscriptions_endpoint(user_id: int, request: Request):
+    """Импорт CSV (тело запроса — содержимое файла)"""
+    await db.ensure_user(user_id)
+    
+    data = await request.body()
+    if len(data) > 2 * 1024 * 1024:
+        raise HTTPException(status_code=413, detail="File too large")
+    
+    return await import_subscriptions(user_id, data)
+
+
 @app.put("/api/subscriptions/{sub_id}")
 async def update_subscription(sub_id: int, data: SubscriptionUpdate):
     await db.update_subscription(sub_id, **data.model_dump(exclude_none=True))
@@ -326,10 +450,7 @@ async def delete_subscription(sub_id: int):
 
 @app.get("/api/trials/{user_id}")
 async def get_trials(user_id: int):
-    # Убедимся что пользователь существует
-    user = await db.get_user(user_id)
-    if not user:
-        await db.create_user(user_id)
+    await db.ensure_user(user_id)
     
     trials_list = await db.get_trials(user_id)
     return {"trials": trials_list}
@@ -337,9 +458,7 @@ async def get_trials(user_id: int):
 
 @app.post("/api/trials/{user_id}")
 async def create_trial(user_id: int, data: TrialCreate):
-    user = await db.get_user(user_id)
-    if not user:
-        await db.create_user(user_id)
+    await db.ensure_user(user_id)
     
     trial_id = await db.add_trial(
         user_id=user_id,
@@ -361,21 +480,35 @@ async def delete_trial(trial_id: int):
 
 @app.get("/api/stats/{user_id}")
 async def get_stats(user_id: int):
-    user = await db.get_user(user_id)
-    if not user:
-        await db.create_user(user_id)
+    await db.ensure_user(user_id)
     
     stats = await db.get_stats(user_id)
     subs = await db.get_subscriptions(user_id)
     upcoming = await db.get_upcoming(user_id, days=30)
-    return {**stats, "subscriptions": subs, "upcoming": upcoming}
+    forecast = await db.get_forecast(user_id, months=12)
+    return {
+        **stats,
+        "subscriptions": subs,
+        "upcoming": upcoming,
+        "forecast": forecast,
+        "population": get_user_insight(user_id),
+    }
+
+
+@app.get("/api/history/{user_id}")
+async def get_history(user_id: int, months: int = 12):
+    months = max(1, min(months, 60))
+    return {
+        "months": await db.get_monthly_history(user_id, months=months),
+        "by_category": await db.get_category_history(user_id),
+        "spent_this_month": await db.get_month_spent(user_id),
+    }
 
 
 @app.get("/api/achievements/{user_id}")
 async def get_achievements(user_id: int):
+    await db.ensure_user(user_id)
     user = await db.get_user(user_id)
-    if not user:
-        user = await db.create_user(user_id)
     
     achievements = await db.get_achievements(user_id)
     return {
@@ -389,9 +522,7 @@ async def get_achievements(user_id: int):
 async def check_duplicates(user_id: int):
     from config import OVERLAPS
     
-    user = await db.get_user(user_id)
-    if not user:
-        await db.create_user(user_id)
+    await db.ensure_user(user_id)
     
     subs = await db.get_subscriptions(user_id)
     sub_names = [s['name'].lower() for s in subs]
@@ -415,6 +546,57 @@ async def check_duplicates(user_id: int):
     return {"issues": issues, "total_saving": sum(i['saving'] for i in issues)}
 
 
+# ========== SERVICES CATALOG ==========
+
+@app.get("/api/services/search")
+async def services_search(q: str = "", limit: int = 10):
+    return {"services": search_services(q, limit=max(1, min(limit, 50)))}
+
+
+# ========== EXPORT ==========
+
+def export_response(rows, fmt: str, filename: str, admin: bool = False) -> StreamingResponse:
+    try:
+        body = stream_export(rows, fmt, admin=admin)
+    except ExportError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    return StreamingResponse(
+        body,
+        media_type=FORMATS[fmt]['media_type'],
+        headers={"Content-Disposition": f'attachment; filename="{filename}.{FORMATS[fmt]["ext"]}"'}
+    )
+
+
+@app.get("/api/export/{user_id}")
+async def export_subscriptions(user_id: int, format: str = "csv"):
+    return export_response(db.iter_subscriptions(user_id), format, f"subscriptions_{user_id}")
+
+
+# ========== ADMIN API ==========
+
+def check_admin(token: Optional[str]):
+    # Сравнение за постоянное время: по задержке токен не подобрать
+    if not ADMIN_TOKEN or not hmac.compare_digest((token or "").encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="Forbidden")
+
+
+@app.get("/api/admin/overview")
+async def admin_overview(x_admin_token: Optional[str] = Header(None)):
+    check_admin(x_admin_token)
+    population = get_population()
+    return {
+        **(population.overview() if population else {"users": 0}),
+        "activity": await db.get_visit_stats(),
+    }
+
+
+@app.get("/api/admin/export")
+async def admin_export(format: str = "csv", x_admin_token: Optional[str] = Header(None)):
+    check_admin(x_admin_token)
+    return export_response(db.iter_subscriptions(), format, "subscriptions_all", admin=True)
+
+
 # ========== CANCEL GUIDES ==========
 
 CANCEL_GUIDES = {
@@ -467,8 +649,22 @@ async def get_cancel_guide(service: str):
 # ========== RUN ==========
 
 if __name__ == "__main__":
-    import os
-    port = int(os.getenv("PORT", 8080))
-    uvicorn.run(app, host="0.0.0.0", port=port)
+    # python bot.py backup | restore [имя копии|latest] — обслуживание базы
+    if len(sys.argv) > 1 and sys.argv[1] in ("backup", "restore"):
+        from services.backup import run_command
+        sys.exit(run_command(sys.argv[1], sys.argv[2:]))
+    
+    # python bot.py [api|bot|scheduler|all|bot,scheduler]
+    if len(sys.argv) > 1:
+        try:
+            roles = parse_roles(sys.argv[1])
+        except ValueError as e:
+            sys.exit(str(e))
+    
+    if "api" in roles:
+        port = int(os.getenv("PORT", 8080))
+        uvicorn.run(app, host="0.0.0.0", port=port)
+    else:
+        asyncio.run(run_without_http())
 
 
@@ -6,9 +6,50 @@ load_dotenv()
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 BOT_USERNAME = os.getenv("BOT_USERNAME", "ssubby_bot")
 
+# Администраторы: Telegram ID через запятую и токен для /api/admin
+ADMIN_IDS = {int(x) for x in os.getenv("ADMIN_IDS", "").split(",") if x.strip().isdigit()}
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
 # ЮКасса
 YOOKASSA_SHOP_ID = os.getenv("YOOKASSA_SHOP_ID")
 YOOKASSA_SECRET_KEY = os.getenv("YOOKASSA_SECRET_KEY")
+YOOKASSA_API_URL = os.getenv("YOOKASSA_API_URL", "https://api.yookassa.ru/v3")
+
+# Роли процесса через запятую: api (HTTP), bot (апдейты Telegram), scheduler (фоновые задачи).
+# По умолчанию все три в одном процессе
+ALL_ROLES = {"api", "bot", "scheduler"}
+
+
+def parse_roles(value: str) -> set:
+    """all или роли через запятую; опечатка — ошибка, а не процесс без ролей"""
+    if value.strip() == "all":
+        return set(ALL_ROLES)
+    roles = {role.strip() for role in value.split(",") if role.strip()}
+    if not roles or roles - ALL_ROLES:
+        raise ValueError(
+            f"Unknown roles {value!r}: expected all or a comma-separated subset of {', '.join(sorted(ALL_ROLES))}"
+        )
+    return roles
+
+
+ROLES = parse_roles(os.getenv("ROLES", "all"))
+
+# Бюджет холодного старта в секундах: превышение попадает в лог
+STARTUP_BUDGET = float(os.getenv("STARTUP_BUDGET", "5"))
+
+# Число файлов БД, между которыми делятся пользователи (по user_id).
+# Число записано в базе: с другим значением на непустой базе бот не стартует
+DB_SHARDS = max(1, int(os.getenv("DB_SHARDS", "1")))
+
+# Каталог данных: в контейнере это persistenceMount /app/data
+DATA_DIR = os.getenv("DATA_DIR", "data")
+
+# Онлайн-копии базы раз в сутки; хранятся BACKUP_KEEP последних, 0 — без копий
+BACKUP_DIR = os.getenv("BACKUP_DIR", os.path.join(DATA_DIR, "backups"))
+BACKUP_KEEP = int(os.getenv("BACKUP_KEEP", "7"))
+
+# Снимок базы для тяжёлых чтений (аналитика, админка) обновляется раз в столько секунд; 0 — без снимка
+REPLICA_INTERVAL = int(os.getenv("REPLICA_INTERVAL", "300"))
 
 # Цены
 SUPPORT_PRICE = 399
@@ -1,12 +1,758 @@
+import asyncio
+import logging
+import os
+import time
 import aiosqlite
-from datetime import datetime, timedelta
+from contextlib import asynccontextmanager, suppress
+from contextvars import ContextVar
+from datetime import date, datetime, timedelta
+from itertools import count
+from pathlib import Path
 from typing import List, Optional
 
-DB_PATH = "subtracker.db"
+from config import DATA_DIR, DB_SHARDS, REPLICA_INTERVAL
+from services.schedule import advance, parse_date, project, upcoming_charges, forecast_months
+from services import visits
+from services.cache import LRUCache
+
+DB_PATH = os.path.join(DATA_DIR, "subtracker.db")
+
+# Раньше база лежала в рабочем каталоге, вне тома с данными
+LEGACY_DB_PATH = "subtracker.db"
+
+logger = logging.getLogger(__name__)
+
+# Шардирование по user_id: данные пользователя лежат в одном из SHARDS файлов.
+# Шард 0 — сам DB_PATH, в нём же платежи; остальные — subtracker.1.db и т. д.
+SHARDS = DB_SHARDS
+HOME_SHARD = 0
+
+# Строки шарда s нумеруются с s * SHARD_ID_SPAN, поэтому по id подписки,
+# триала или строки очереди сразу виден шард
+SHARD_ID_SPAN = 1 << 40
+ID_TABLES = [
+    "payments", "subscriptions", "trials", "achievements", "notification_log",
+    "due_notifications", "notification_runs", "payment_ledger", "payment_events",
+]
+
+
+def shard_path(shard: int, base: str = None) -> str:
+    base = base or DB_PATH
+    if shard == HOME_SHARD:
+        return base
+    stem, ext = os.path.splitext(base)
+    return f"{stem}.{shard}{ext}"
+
+
+# Сколько соединение ждёт блокировку другого процесса (роли api, bot и
+# scheduler пишут в те же файлы), прежде чем получить "database is locked"
+BUSY_TIMEOUT = 30
+
+
+def connect(path: str, **kwargs) -> aiosqlite.Connection:
+    """aiosqlite.connect с явным busy_timeout: так открываются все соединения"""
+    return aiosqlite.connect(path, timeout=BUSY_TIMEOUT, **kwargs)
+
+
+def shard_for(user_id: int) -> int:
+    return user_id % SHARDS
+
+
+def shard_of_id(row_id: int) -> int:
+    return row_id // SHARD_ID_SPAN
+
+
+def all_shards() -> range:
+    return range(SHARDS)
+
+# Версия данных пользователя: меняется при любом изменении подписок,
+# по ней инвалидируются закэшированные экраны
+_version_counter = count(1)
+_data_versions = {}
+
+
+def get_data_version(user_id: int) -> int:
+    return _data_versions.get(user_id, 0)
+
+
+def bump_data_version(user_id: int):
+    if user_id is not None:
+        _data_versions[user_id] = next(_version_counter)
+        uow = current_session()
+        if uow is not None and uow.writing is not None:
+            uow.versions.add(user_id)
+
+
+# Лента изменений: таблицы, запись в которые меняет данные пользователя.
+# Триггеры пишут в user_changes, другие процессы по ней сбрасывают свои кэши
+CHANGE_FEED_TABLES = ["users", "subscriptions", "trials", "achievements", "payment_ledger"]
+
+# Последний прочитанный seq ленты в каждом шарде
+_change_seq = {}
+
+
+async def sync_data_versions() -> int:
+    """Подхватить изменения, сделанные другими процессами"""
+    changed = 0
+    for shard in all_shards():
+        async with reader(shard) as db:
+            if shard not in _change_seq:
+                cursor = await db.execute("SELECT IFNULL(MAX(seq), 0) FROM user_changes")
+                _change_seq[shard] = (await cursor.fetchone())[0]
+                continue
+            
+            cursor = await db.execute(
+                "SELECT user_id, seq FROM user_changes WHERE seq > ? ORDER BY seq", (_change_seq[shard],)
+            )
+            rows = await cursor.fetchall()
+        
+        for user_id, seq in rows:
+            bump_data_version(user_id)
+            _change_seq[shard] = seq
+        changed += len(rows)
+    return changed
+
+
+# ========== WRITER ==========
+
+# Больше записей в одном коммите не копим, даже если очередь не пуста
+MAX_GROUP_SIZE = 100
+
+
+class Writer:
+    """Единственное пишущее соединение процесса к шарду.
+    
+    Записи выполняются строго по одной, каждая в своей точке сохранения,
+    а коммитятся группой: транзакцию фиксирует последний из тех, кто
+    стоял в очереди. Вызов возвращается только после коммита. Читатели
+    открывают свои соединения и писателя не ждут (WAL).
+    """
+    
+    def __init__(self, shard: int = HOME_SHARD):
+        self.shard = shard
+        self.conn = None
+        self.lock = asyncio.Lock()
+        self.queued = 0
+        self.pending = []
+        self.commits = 0
+    
+    async def connect(self):
+        if self.conn is None:
+            conn = connect(shard_path(self.shard))
+            # Поток соединения не держит процесс при выходе: всё, что
+            # вернулось вызывающему, уже закоммичено
+            conn.daemon = True
+            self.conn = await conn
+            self.conn.row_factory = aiosqlite.Row
+        return self.conn
+    
+    async def begin(self, savepoint: str = "write") -> aiosqlite.Connection:
+        """Дождаться своей очереди и открыть точку сохранения"""
+        self.queued += 1
+        try:
+            await self.lock.acquire()
+        except BaseException:
+            # Отменённый в очереди мог быть тем, кого ждала группа
+            if not self.lock.locked() and self.pending:
+                asyncio.ensure_future(self.flush())
+            raise
+        finally:
+            self.queued -= 1
+        
+        try:
+            db = await self.connect()
+            if not db.in_transaction:
+                await db.execute("BEGIN IMMEDIATE")
+            await db.execute(f"SAVEPOINT {savepoint}")
+        except BaseException:
+            self.lock.release()
+            raise
+        return db
+    
+    async def end(self, savepoint: str = "write", ok: bool = True, on_commit=None) -> asyncio.Future:
+        """Закрыть точку сохранения и уступить очередь; возвращает future коммита.
+        
+        on_commit вызывается сразу после коммита, до того как проснутся
+        другие задачи: между ними никто не увидит закоммиченное и старое
+        состояние памяти одновременно.
+        """
+        done = asyncio.get_running_loop().create_future()
+        try:
+            if ok:
+                await self.conn.execute(f"RELEASE {savepoint}")
+                self.pending.append((done, on_commit))
+            else:
+                # Откатываем только свою запись, чужие в группе остаются
+                await self.conn.execute(f"ROLLBACK TO {savepoint}")
+                await self.conn.execute(f"RELEASE {savepoint}")
+                done.set_result(None)
+        finally:
+            try:
+                if not self.queued or len(self.pending) >= MAX_GROUP_SIZE:
+                    await self.commit()
+            finally:
+                self.lock.release()
+        return done
+    
+    @asynccontextmanager
+    async def transaction(self):
+        uow = current_session()
+        if uow is not None:
+            async with uow.transaction(self.shard) as db:
+                yield db
+            return
+        
+        db = await self.begin()
+        try:
+            yield db
+        except BaseException:
+            await self.end(ok=False)
+            raise
+        await (await self.end())
+    
+    async def commit(self):
+        pending, self.pending = self.pending, []
+        if not self.conn.in_transaction:
+            return
+        try:
+            await self.conn.commit()
+        except Exception as e:
+            await self.conn.rollback()
+            for future, _ in pending:
+                future.set_exception(e)
+        else:
+            self.commits += 1
+            for _, on_commit in pending:
+                if on_commit is not None:
+                    on_commit()
+            for future, _ in pending:
+                future.set_result(None)
+    
+    async def flush(self):
+        async with self.lock:
+            if self.conn is not None:
+                await self.commit()
+    
+    async def close(self):
+        await self.flush()
+        if self.conn is not None:
+            await self.conn.close()
+            self.conn = None
+
+
+_writers = {}
+
+
+def get_writer(shard: int = HOME_SHARD) -> Writer:
+    if shard not in _writers:
+        _writers[shard] = Writer(shard)
+    return _writers[shard]
+
+
+def transaction(shard: int = HOME_SHARD):
+    """Запись в шард через его писателя"""
+    return get_writer(shard).transaction()
+
+
+# ========== UNIT OF WORK ==========
+
+_session = ContextVar("db_session", default=None)
+
+
+class CrossShardWrite(RuntimeError):
+    pass
+
+
+class ShardCountMismatch(RuntimeError):
+    pass
+
+
+class Session:
+    """Единица работы: все обращения к базе одного апдейта.
+    
+    Чтения идут через одно соединение на шард, записи — в одну
+    транзакцию писателя шарда, которая фиксируется commit() или в конце
+    блока session(); при ошибке откатывается всё незафиксированное.
+    Писатель занят с первой записи до коммита. Писать можно только в
+    один шард: запись в другой до commit() — CrossShardWrite. Двух
+    писателей сразу единица работы не держит (апдейты с обратным порядком
+    шардов ждали бы друг друга), а молча фиксировать начатое нельзя.
+    Приращения счётчиков копятся в WriteBehind сразу (их видят чтения
+    апдейта), а при откате снимаются обратными приращениями из undo.
+    """
+    
+    def __init__(self):
+        self.task = asyncio.current_task()
+        self.conns = {}
+        self.writing = None  # шард открытой транзакции
+        self.versions = set()
+        self.undo = []
+    
+    async def reader(self, shard: int) -> aiosqlite.Connection:
+        if shard == self.writing:
+            # Своё незафиксированное видно только через соединение писателя
+            return get_writer(shard).conn
+        if shard not in self.conns:
+            self.conns[shard] = await connect(shard_path(shard))
+            self.conns[shard].row_factory = aiosqlite.Row
+        return self.conns[shard]
+    
+    @asynccontextmanager
+    async def transaction(self, shard: int):
+        if self.writing is not None and shard != self.writing:
+            raise CrossShardWrite(
+                f"Unit of work writes to shard {self.writing}, commit it before writing to shard {shard}"
+            )
+        if self.writing is None:
+            await get_writer(shard).begin("session")
+            self.writing = shard
+        
+        db = get_writer(shard).conn
+        await db.execute("SAVEPOINT write")
+        try:
+            yield db
+        except BaseException:
+            await db.execute("ROLLBACK TO write")
+            await db.execute("RELEASE write")
+            raise
+        await db.execute("RELEASE write")
+    
+    async def commit(self):
+        await self.finish(ok=True)
+    
+    async def rollback(self):
+        await self.finish(ok=False)
+    
+    async def finish(self, ok: bool):
+        shard, self.writing = self.writing, None
+        versions, self.versions = self.versions, set()
+        undo, self.undo = self.undo, []
+        
+        try:
+            done = await get_writer(shard).end("session", ok) if shard is not None else None
+            if not ok:
+                for action in reversed(undo):
+                    action()
+            if done is not None:
+                await done
+        finally:
+            # Кэши, собранные до коммита по старым данным, не должны его пережить
+            for user_id in versions:
+                bump_data_version(user_id)
+    
+    async def close(self):
+        conns, self.conns = self.conns, {}
+        for conn in conns.values():
+            await conn.close()
+
+
+def current_session() -> Optional[Session]:
+    uow = _session.get()
+    # Задачи, запущенные из апдейта, наследуют контекст, но не его транзакцию
+    if uow is not None and uow.task is asyncio.current_task():
+        return uow
+    return None
+
+
+@asynccontextmanager
+async def session():
+    """Открыть единицу работы на время блока"""
+    uow = Session()
+    token = _session.set(uow)
+    try:
+        yield uow
+    except BaseException:
+        await uow.rollback()
+        raise
+    else:
+        await uow.commit()
+    finally:
+        _session.reset(token)
+        await uow.close()
+
+
+async def commit_session():
+    """Зафиксировать записи текущей единицы работы, если она есть"""
+    uow = current_session()
+    if uow is not None:
+        await uow.commit()
+
+
+@asynccontextmanager
+async def reader(shard: int = HOME_SHARD):
+    """Соединение для чтения шарда: в единице работы — общее, иначе своё"""
+    uow = current_session()
+    if uow is not None:
+        yield await uow.reader(shard)
+        return
+    
+    async with connect(shard_path(shard)) as db:
+        yield db
+
+
+async def gather_parallel(coros) -> list:
+    """Выполнить корутины параллельно.
+    
+    В единице работы — по очереди в текущей задаче: дочерние задачи её
+    транзакцию не видят и ждали бы писателя, которого она держит.
+    """
+    if current_session() is not None:
+        return [await coro for coro in coros]
+    return await asyncio.gather(*coros)
+
+
+async def gather_shards(func, *args) -> list:
+    """Выполнить func(shard, *args) во всех шардах параллельно"""
+    return await gather_parallel([func(shard, *args) for shard in all_shards()])
+
+
+# ========== REPLICA ==========
+
+# Снимок старше этого считаем брошенным (задача обновления не работает)
+# и читаем основную базу
+REPLICA_MAX_AGE = 3 * REPLICA_INTERVAL
+
+
+def replica_path(shard: int) -> str:
+    stem, ext = os.path.splitext(shard_path(shard))
+    return f"{stem}.replica{ext}"
+
+
+def replica_fresh(shard: int) -> bool:
+    try:
+        return time.time() - os.path.getmtime(replica_path(shard)) < REPLICA_MAX_AGE
+    except OSError:
+        return False
+
+
+async def refresh_replica(shard: int):
+    """Снять согласованную копию шарда через backup API и подменить ею снимок.
+    
+    Копия пишется рядом и переименовывается: уже открытые чтения
+    дочитывают старый файл, новые открывают свежий.
+    """
+    path = replica_path(shard)
+    tmp = f"{path}.tmp"
+    with suppress(FileNotFoundError):
+        os.remove(tmp)
+    
+    async with connect(shard_path(shard)) as source, connect(tmp) as target:
+        # Всё за один шаг — одна читающая транзакция; в WAL писатели её не ждут
+        await source.backup(target)
+        # Снимок читается без -wal и -shm
+        await target.execute("PRAGMA journal_mode = DELETE")
+    os.replace(tmp, path)
+
+
+async def refresh_replicas():
+    started = time.perf_counter()
+    await gather_shards(refresh_replica)
+    logger.info(f"📸 Replica refreshed in {time.perf_counter() - started:.2f}s")
+
+
+@asynccontextmanager
+async def snapshot_reader(shard: int = HOME_SHARD):
+    """Соединение к снимку для тяжёлых чтений; без свежего снимка — к шарду.
+    
+    Данные отстают от базы на интервал обновления.
+    """
+    if not replica_fresh(shard):
+        async with reader(shard) as db:
+            yield db
+        return
+    
+    # Файл снимка не меняется после подмены: immutable снимает блокировки
+    uri = f"{Path(replica_path(shard)).absolute().as_uri()}?immutable=1"
+    async with connect(uri, uri=True) as db:
+        yield db
+
+
+# ========== WRITE-BEHIND ==========
+
+# Отложенные записи сбрасываются раз в FLUSH_INTERVAL секунд
+# или сразу, как только их набралось FLUSH_MAX_ITEMS
+FLUSH_INTERVAL = 0.5
+FLUSH_MAX_ITEMS = 1000
+
+# Счётчики пользователя, которые можно копить приращениями
+COUNTERS = ("xp", "total_saved")
+
+
+class WriteBehind:
+    """Буфер частых мелких записей: приращения счётчиков, дни посещений
+    и строки журналов.
+    
+    Записи копятся в памяти и уходят одной транзакцией на шард. Несброшенные
+    значения накладываются на результаты чтения (overlay_*), так что
+    процесс видит свои изменения сразу. При падении теряется не больше
+    одного интервала; при остановке буфер сбрасывается.
+    """
+    
+    def __init__(self):
+        self.counters = {}  # user_id -> {счётчик: приращение}
+        self.visits = {}    # user_id -> (дни, username, first_name)
+        self.rows = []      # (sql, параметры, шард)
+        self.size = 0
+        # Пачки, которые сейчас пишутся: до коммита их тоже накладываем.
+        # Ключ — id пачки; снимается в момент коммита её шарда
+        self.flushing = {}
+        self.timer = None
+        self.tasks = set()
+        self.flushes = 0
+    
+    def add(self, user_id: int, column: str, amount):
+        deltas = self.counters.setdefault(user_id, {})
+        deltas[column] = deltas.get(column, 0) + amount
+        self.added()
+    
+    def visit(self, user_id: int, day: date, username: str = None, first_name: str = None):
+        days, old_username, old_first_name = self.visits.get(user_id, (set(), None, None))
+        self.visits[user_id] = (days | {day}, username or old_username, first_name or old_first_name)
+        self.added()
+    
+    def append(self, sql: str, params: tuple, shard: int = HOME_SHARD):
+        self.rows.append((sql, params, shard))
+        self.added()
+    
+    def added(self):
+        self.size += 1
+        if self.size >= FLUSH_MAX_ITEMS:
+            self.schedule(0)
+        elif self.timer is None:
+            self.schedule(FLUSH_INTERVAL)
+    
+    def schedule(self, delay: float):
+        if self.timer is not None:
+            self.timer.cancel()
+        self.timer = asyncio.get_running_loop().call_later(delay, self.start_flush)
+    
+    def start_flush(self):
+        self.timer = None
+        task = asyncio.ensure_future(self.background_flush())
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+    
+    async def background_flush(self):
+        # Ошибка уже залогирована, а пачка возвращена в буфер
+        with suppress(Exception):
+            await self.flush()
+    
+    def pending_counters(self, user_id: int) -> dict:
+        deltas = {}
+        for counters in [batch[0] for batch in self.flushing.values()] + [self.counters]:
+            for column, amount in counters.get(user_id, {}).items():
+                deltas[column] = deltas.get(column, 0) + amount
+        return deltas
+    
+    def pending_visit(self, user_id: int) -> tuple:
+        days, username, first_name = set(), None, None
+        for pending in [batch[1] for batch in self.flushing.values()] + [self.visits]:
+            if user_id in pending:
+                newer_days, newer_username, newer_first_name = pending[user_id]
+                days |= newer_days
+                username = newer_username or username
+                first_name = newer_first_name or first_name
+        return days, username, first_name
+    
+    def overlay_user(self, user: dict) -> dict:
+        for column, amount in self.pending_counters(user['user_id']).items():
+            user[column] = (user[column] or 0) + amount
+        days, username, first_name = self.pending_visit(user['user_id'])
+        if days and 'last_visit' in user:
+            user['last_visit'] = max(max(days).strftime("%Y-%m-%d"), user['last_visit'] or "")
+            user['username'] = username or user['username']
+            user['first_name'] = first_name or user['first_name']
+        return user
+    
+    def overlay_visits(self, user_id: int, blob: Optional[bytes]) -> Optional[bytes]:
+        for day in self.pending_visit(user_id)[0]:
+            blob = visits.mark_visit(blob, day)
+        return blob
+    
+    async def flush(self) -> int:
+        """Записать накопленное, шарды параллельно; возвращает число записей"""
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if not self.size:
+            return 0
+        
+        counters, user_visits, rows, size = self.counters, self.visits, self.rows, self.size
+        self.counters, self.visits, self.rows, self.size = {}, {}, [], 0
+        
+        batches = {}
+        for user_id, deltas in counters.items():
+            batches.setdefault(shard_for(user_id), ({}, {}, []))[0][user_id] = deltas
+        for user_id, visit in user_visits.items():
+            batches.setdefault(shard_for(user_id), ({}, {}, []))[1][user_id] = visit
+        for row in rows:
+            batches.setdefault(row[2], ({}, {}, []))[2].append(row)
+        
+        for batch in batches.values():
+            self.flushing[id(batch)] = batch
+        
+        try:
+            results = await asyncio.gather(
+                *(self.write_shard(shard, batch) for shard, batch in batches.items()),
+                return_exceptions=True
+            )
+        finally:
+            # Несохранённые пачки снимаем и возвращаем в буфер одним шагом
+            for batch in batches.values():
+                self.flushing.pop(id(batch), None)
+        
+        failed = [(batch, result) for batch, result in zip(batches.values(), results) if isinstance(result, Exception)]
+        for batch, error in failed:
+            logger.error(f"Write-behind flush failed, will retry: {error!r}")
+            self.restore(*batch)
+        if failed:
+            raise failed[0][1]
+        
+        self.flushes += 1
+        return size
+    
+    async def write_shard(self, shard: int, batch: tuple):
+        counters, user_visits, rows = batch
+        writer = get_writer(shard)
+        db = await writer.begin()
+        try:
+            await db.executemany(
+                f"UPDATE users SET {', '.join(f'{c} = {c} + ?' for c in COUNTERS)} WHERE user_id = ?",
+                [(*(deltas.get(c, 0) for c in COUNTERS), user_id) for user_id, deltas in counters.items()]
+            )
+            for user_id, (days, username, first_name) in user_visits.items():
+                cursor = await db.execute("SELECT visits FROM users WHERE user_id = ?", (user_id,))
+                row = await cursor.fetchone()
+                if not row:
+                    continue
+                blob = row[0]
+                for day in days:
+                    blob = visits.mark_visit(blob, day)
+                await db.execute("""
+                    UPDATE users SET
+                        username = COALESCE(?, username),
+                        first_name = COALESCE(?, first_name),
+                        last_visit = MAX(IFNULL(last_visit, ''), ?),
+                        visits = ?
+                    WHERE user_id = ?
+                """, (username, first_name, max(days).strftime("%Y-%m-%d"), blob, user_id))
+            
+            by_sql = {}
+            for sql, params, _ in rows:
+                by_sql.setdefault(sql, []).append(params)
+            for sql, params in by_sql.items():
+                await db.executemany(sql, params)
+        except BaseException:
+            await writer.end(ok=False)
+            raise
+        await (await writer.end(on_commit=lambda: self.flushing.pop(id(batch), None)))
+    
+    def restore(self, counters: dict, user_visits: dict, rows: list):
+        """Вернуть несохранённую пачку в буфер перед более новыми записями"""
+        for user_id, deltas in counters.items():
+            for column, amount in deltas.items():
+                self.counters.setdefault(user_id, {})
+                self.counters[user_id][column] = self.counters[user_id].get(column, 0) + amount
+        for user_id, (days, username, first_name) in user_visits.items():
+            newer_days, newer_username, newer_first_name = self.visits.get(user_id, (set(), None, None))
+            self.visits[user_id] = (days | newer_days, newer_username or username, newer_first_name or first_name)
+        self.rows[:0] = rows
+        self.size += len(counters) + len(user_visits) + len(rows)
+        if self.timer is None:
+            self.schedule(FLUSH_INTERVAL)
+
+
+pending = WriteBehind()
+
+
+async def flush_pending() -> int:
+    if current_session() is not None:
+        # Отложенные записи пишутся мимо единицы работы: фиксируем её
+        # и сбрасываем буфер из отдельной задачи
+        await commit_session()
+        return await asyncio.ensure_future(pending.flush())
+    return await pending.flush()
+
+
+async def close_writer():
+    """Сбросить отложенные записи и закрыть соединение писателя"""
+    if pending.tasks:
+        await asyncio.gather(*pending.tasks, return_exceptions=True)
+    with suppress(Exception):
+        await pending.flush()
+    for writer in _writers.values():
+        await writer.close()
 
 
 async def init_db():
-    async with aiosqlite.connect(DB_PATH) as db:
+    os.makedirs(os.path.dirname(DB_PATH) or ".", exist_ok=True)
+    move_legacy_db()
+    await check_shard_count()
+    await gather_shards(init_shard)
+
+
+async def recorded_shard_count(db) -> Optional[int]:
+    cursor = await db.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'shard_meta'")
+    if not await cursor.fetchone():
+        return None
+    cursor = await db.execute("SELECT value FROM shard_meta WHERE key = 'shards'")
+    row = await cursor.fetchone()
+    return row[0] if row else None
+
+
+async def check_shard_count():
+    """Не стартовать, если DB_SHARDS не совпадает с числом шардов, записанным в базе.
+    
+    Иначе shard_for молча отправил бы большинство пользователей в пустые
+    шарды, а ensure_user завёл бы их заново. Проверка идёт до создания
+    файлов новых шардов.
+    """
+    recorded = {}
+    for shard in range(SHARDS + 1):
+        if os.path.exists(shard_path(shard)):
+            async with connect(shard_path(shard)) as db:
+                recorded[shard] = await recorded_shard_count(db)
+    
+    if HOME_SHARD not in recorded:
+        return
+    if recorded[HOME_SHARD] is None:
+        # База старше записи числа шардов: считаем по файлам подряд
+        count = 1
+        while os.path.exists(shard_path(count)):
+            count += 1
+        recorded[HOME_SHARD] = count
+    
+    for shard, count in recorded.items():
+        if count is not None and count != SHARDS:
+            raise ShardCountMismatch(
+                f"{shard_path(shard)} belongs to {count} shards, but DB_SHARDS={SHARDS}: "
+                f"users would be routed to the wrong shard"
+            )
+
+
+def move_legacy_db():
+    """Перенести базу (все шарды) из рабочего каталога в DATA_DIR (один раз, до открытия)"""
+    for shard in all_shards():
+        legacy, path = shard_path(shard, LEGACY_DB_PATH), shard_path(shard)
+        if os.path.exists(path) or not os.path.exists(legacy):
+            continue
+        # Незачекпойнченные коммиты лежат в -wal: переносим его вместе с базой
+        for suffix in ("-wal", ""):
+            with suppress(FileNotFoundError):
+                os.replace(legacy + suffix, path + suffix)
+        with suppress(FileNotFoundError):
+            os.remove(legacy + "-shm")
+        logger.info(f"📦 Moved {legacy} to {path}")
+
+
+async def init_shard(shard: int):
+    async with connect(shard_path(shard)) as db:
+        # WAL: читатели из других процессов не блокируют запись
+        await db.execute("PRAGMA journal_mode = WAL")
+        
+        # Схема и миграции — одной транзакцией: процессы разных ролей стартуют одновременно
+        await db.execute("BEGIN IMMEDIATE")
+        
         await db.execute("""
             CREATE TABLE IF NOT EXISTS users (
                 user_id INTEGER PRIMARY KEY,
@@ -86,43 +832,259 @@ async def init_db():
             )
         """)
         
+        # Очередь напоминаний: одна строка на (подписка/триал, дата срабатывания)
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS due_notifications (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                kind TEXT NOT NULL,
+                ref_id INTEGER NOT NULL,
+                fire_date DATE NOT NULL,
+                due_date DATE NOT NULL,
+                UNIQUE(kind, ref_id, due_date)
+            )
+        """)
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_due_fire_date ON due_notifications(fire_date)")
+        
+        # Прогоны рассылки: курсор по id очереди, чтобы продолжить после рестарта
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS notification_runs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                kind TEXT NOT NULL,
+                run_date DATE NOT NULL,
+                cursor INTEGER DEFAULT 0,
+                status TEXT DEFAULT 'running',
+                sent INTEGER DEFAULT 0,
+                failed INTEGER DEFAULT 0,
+                started_at TEXT,
+                finished_at TEXT
+            )
+        """)
+        
+        # История списаний и помесячные агрегаты (ведутся триггером)
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS payment_ledger (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                sub_id INTEGER,
+                name TEXT,
+                category TEXT DEFAULT 'other',
+                amount REAL NOT NULL,
+                charged_on DATE NOT NULL,
+                UNIQUE(sub_id, charged_on)
+            )
+        """)
+        
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS monthly_rollup (
+                user_id INTEGER NOT NULL,
+                month TEXT NOT NULL,
+                category TEXT NOT NULL,
+                total REAL DEFAULT 0,
+                charges INTEGER DEFAULT 0,
+                PRIMARY KEY (user_id, month, category)
+            ) WITHOUT ROWID
+        """)
+        
+        await db.execute("""
+            CREATE TRIGGER IF NOT EXISTS trg_ledger_rollup AFTER INSERT ON payment_ledger
+            BEGIN
+                INSERT INTO monthly_rollup (user_id, month, category, total, charges)
+                VALUES (NEW.user_id, strftime('%Y-%m', NEW.charged_on), NEW.category, NEW.amount, 1)
+                ON CONFLICT(user_id, month, category)
+                DO UPDATE SET total = total + excluded.total, charges = charges + 1;
+            END
+        """)
+        
+        # Входящие события ЮКассы: сохраняются до обработки, каждое ровно один раз
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS payment_events (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                payment_id TEXT NOT NULL,
+                event TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                status TEXT DEFAULT 'pending',
+                attempts INTEGER DEFAULT 0,
+                last_error TEXT,
+                received_at TEXT,
+                next_attempt_at TEXT,
+                processed_at TEXT,
+                UNIQUE(payment_id, event)
+            )
+        """)
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_payment_events_pending ON payment_events(status, next_attempt_at)")
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_users_premium_until ON users(premium_until) WHERE is_premium = 1")
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_subscriptions_user ON subscriptions(user_id, is_active, next_payment)")
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_trials_user ON trials(user_id, end_date)")
+        
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS user_changes (
+                user_id INTEGER PRIMARY KEY,
+                seq INTEGER NOT NULL
+            )
+        """)
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_user_changes_seq ON user_changes(seq)")
+        
+        for table in CHANGE_FEED_TABLES:
+            for op, row in (("INSERT", "NEW"), ("UPDATE", "NEW"), ("DELETE", "OLD")):
+                await db.execute(f"""
+                    CREATE TRIGGER IF NOT EXISTS trg_{table}_{op.lower()}_changes AFTER {op} ON {table}
+                    BEGIN
+                        INSERT INTO user_changes (user_id, seq)
+                        VALUES ({row}.user_id, (SELECT IFNULL(MAX(seq), 0) + 1 FROM user_changes))
+                        ON CONFLICT(user_id) DO UPDATE SET seq = excluded.seq;
+                    END
+                """)
+        
+        # Число шардов, под которое разложены пользователи (см. check_shard_count)
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS shard_meta (
+                key TEXT PRIMARY KEY,
+                value INTEGER NOT NULL
+            )
+        """)
+        await db.execute("INSERT OR IGNORE INTO shard_meta (key, value) VALUES ('shards', ?)", (SHARDS,))
+        
+        # Миграции существующих баз
+        await ensure_column(db, "subscriptions", "billing_day", "INTEGER")
+        await ensure_column(db, "users", "visits", "BLOB")
+        
+        cursor = await db.execute("PRAGMA user_version")
+        version = (await cursor.fetchone())[0]
+        if version < 1:
+            await backfill_notification_queue(db)
+            await db.execute("PRAGMA user_version = 1")
+        if version < 2:
+            # День списания для подписок, добавленных до колонки billing_day
+            await db.execute("""
+                UPDATE subscriptions SET billing_day = CAST(strftime('%d', next_payment) AS INTEGER)
+                WHERE billing_day IS NULL AND next_payment IS NOT NULL
+            """)
+            await db.execute("PRAGMA user_version = 2")
+        
+        if shard != HOME_SHARD:
+            await seed_id_range(db, shard)
+        
         await db.commit()
 
 
+async def seed_id_range(db, shard: int):
+    """Сдвинуть счётчики AUTOINCREMENT в диапазон шарда"""
+    start = shard * SHARD_ID_SPAN
+    for table in ID_TABLES:
+        await db.execute(
+            "INSERT INTO sqlite_sequence (name, seq) SELECT ?, 0 "
+            "WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = ?)",
+            (table, table)
+        )
+        await db.execute("UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = ?", (start, table))
+
+
+async def ensure_column(db, table: str, column: str, decl: str):
+    cursor = await db.execute(f"PRAGMA table_info({table})")
+    columns = [row[1] for row in await cursor.fetchall()]
+    if column not in columns:
+        await db.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
+
 # ========== USERS ==========
 
+# Без истории посещений: она бинарная и наружу не отдаётся
+USER_COLUMNS = """
+    user_id, username, first_name, created_at, notify_enabled, notify_days,
+    xp, total_saved, last_visit, is_premium, premium_until
+"""
+
+
 async def get_user(user_id: int) -> Optional[dict]:
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with reader(shard_for(user_id)) as db:
         db.row_factory = aiosqlite.Row
-        cursor = await db.execute("SELECT * FROM users WHERE user_id = ?", (user_id,))
+        cursor = await db.execute(f"SELECT {USER_COLUMNS} FROM users WHERE user_id = ?", (user_id,))
         row = await cursor.fetchone()
-        return dict(row) if row else None
+        return pending.overlay_user(dict(row)) if row else None
 
 
-async def create_user(user_id: int, username: str = None, first_name: str = None) -> dict:
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute("""
-            INSERT OR IGNORE INTO users (user_id, username, first_name, last_visit)
-            VALUES (?, ?, ?, ?)
-        """, (user_id, username, first_name, datetime.now().strftime("%Y-%m-%d")))
-        await db.commit()
-    return await get_user(user_id) or {"user_id": user_id, "first_name": first_name or "Пользователь"}
+# Пользователи, которые точно есть в базе: user_id -> день последнего записанного визита.
+# Пользователи не удаляются, поэтому устаревать кэш не может.
+_known_users = LRUCache(maxsize=100000)
+
+
+async def ensure_user(user_id: int, username: str = None, first_name: str = None, visit: bool = False):
+    """Гарантировать, что пользователь есть в базе.
+    
+    Известных пользователей пропускаем без обращения к базе; визит
+    (last_visit и история посещений) пишется не чаще раза в день.
+    """
+    today = date.today()
+    last_visit = _known_users.get(user_id)
+    if last_visit is not None and (not visit or last_visit == today):
+        return
+    
+    if last_visit is not None:
+        # Пользователь уже в базе: новый день посещения пишется отложенно
+        pending.visit(user_id, today, username, first_name)
+        _known_users.set(user_id, today)
+        bump_data_version(user_id)
+        return
+    
+    async with transaction(shard_for(user_id)) as db:
+        if visit:
+            cursor = await db.execute("""
+                INSERT INTO users (user_id, username, first_name, last_visit)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT(user_id) DO UPDATE SET
+                    username = COALESCE(excluded.username, username),
+                    first_name = COALESCE(excluded.first_name, first_name),
+                    last_visit = excluded.last_visit
+                RETURNING visits
+            """, (user_id, username, first_name, today.strftime("%Y-%m-%d")))
+            row = await cursor.fetchone()
+            await db.execute(
+                "UPDATE users SET visits = ? WHERE user_id = ?",
+                (visits.mark_visit(row[0], today), user_id)
+            )
+        else:
+            await db.execute("""
+                INSERT OR IGNORE INTO users (user_id, username, first_name, last_visit)
+                VALUES (?, ?, ?, ?)
+            """, (user_id, username, first_name, today.strftime("%Y-%m-%d")))
+    
+    _known_users.set(user_id, today if visit else last_visit or date.min)
+    uow = current_session()
+    if uow is not None and uow.writing is not None:
+        uow.undo.append(lambda: _known_users.pop(user_id))
+    if visit:
+        bump_data_version(user_id)
 
 
 async def get_or_create_user(user_id: int, username: str = None, first_name: str = None) -> dict:
-    user = await get_user(user_id)
-    if not user:
-        user = await create_user(user_id, username, first_name)
+    await ensure_user(user_id, username, first_name, visit=True)
+    return await get_user(user_id) or {"user_id": user_id, "first_name": first_name or "Пользователь"}
+
+
+async def get_visit_history(user_id: int) -> int:
+    async with reader(shard_for(user_id)) as db:
+        cursor = await db.execute("SELECT visits FROM users WHERE user_id = ?", (user_id,))
+        row = await cursor.fetchone()
+    return visits.to_bits(pending.overlay_visits(user_id, row[0])) if row else 0
+
+
+async def get_visit_stats() -> dict:
+    """Активность и удержание по битовым историям всех пользователей.
     
-    # Обновляем last_visit
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute(
-            "UPDATE users SET last_visit = ? WHERE user_id = ?",
-            (datetime.now().strftime("%Y-%m-%d"), user_id)
-        )
-        await db.commit()
+    Читается снимок: посещения отстают от базы на возраст снимка (до
+    REPLICA_MAX_AGE), а несброшенные из буфера в него не попадают вовсе.
+    """
+    blobs = []
+    for shard in all_shards():
+        async with snapshot_reader(shard) as db:
+            cursor = await db.execute("SELECT visits FROM users WHERE visits IS NOT NULL")
+            blobs += [row[0] for row in await cursor.fetchall()]
     
-    return user
+    return {
+        **visits.activity(blobs),
+        "retention": visits.retention(blobs),
+    }
 
 
 async def update_user(user_id: int, **kwargs):
@@ -132,63 +1094,187 @@ async def update_user(user_id: int, **kwargs):
     if not updates:
         return
     
+    # Абсолютное значение счётчика не должно потом получить старое приращение
+    if any(k in COUNTERS for k in updates):
+        await flush_pending()
+    
     set_clause = ", ".join(f"{k} = ?" for k in updates.keys())
     values = list(updates.values()) + [user_id]
     
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with transaction(shard_for(user_id)) as db:
         await db.execute(f"UPDATE users SET {set_clause} WHERE user_id = ?", values)
-        await db.commit()
+        if 'notify_days' in updates:
+            await enqueue_user_subscriptions(db, user_id)
+
+
+async def get_entitlement_row(user_id: int) -> Optional[dict]:
+    async with reader(shard_for(user_id)) as db:
+        db.row_factory = aiosqlite.Row
+        cursor = await db.execute("""
+            SELECT u.is_premium, u.premium_until,
+                   (SELECT COUNT(*) FROM subscriptions s WHERE s.user_id = u.user_id AND s.is_active = 1) AS subs
+            FROM users u WHERE u.user_id = ?
+        """, (user_id,))
+        row = await cursor.fetchone()
+        return dict(row) if row else None
+
+
+async def expire_premium_batch(now: str, limit: int, shard: int = HOME_SHARD) -> List[int]:
+    """Снять премиум с истёкших в шарде; возвращает user_id обработанной пачки"""
+    async with transaction(shard) as db:
+        cursor = await db.execute("""
+            UPDATE users SET is_premium = 0
+            WHERE user_id IN (
+                SELECT user_id FROM users
+                WHERE is_premium = 1 AND premium_until < ?
+                LIMIT ?
+            )
+            RETURNING user_id
+        """, (now, limit))
+        user_ids = [row[0] for row in await cursor.fetchall()]
+    
+    for user_id in user_ids:
+        bump_data_version(user_id)
+    return user_ids
+
+
+def add_counter(user_id: int, column: str, amount):
+    pending.add(user_id, column, amount)
+    bump_data_version(user_id)
+    
+    # Откат апдейта снимает приращение, даже если буфер уже успели сбросить
+    uow = current_session()
+    if uow is not None:
+        uow.undo.append(lambda: (pending.add(user_id, column, -amount), bump_data_version(user_id)))
 
 
 async def add_xp(user_id: int, amount: int):
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute("UPDATE users SET xp = xp + ? WHERE user_id = ?", (amount, user_id))
-        await db.commit()
+    add_counter(user_id, "xp", amount)
 
 
 async def add_saved(user_id: int, amount: float):
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute("UPDATE users SET total_saved = total_saved + ? WHERE user_id = ?", (amount, user_id))
-        await db.commit()
+    add_counter(user_id, "total_saved", amount)
 
 
 async def set_premium(user_id: int, days: int = 30):
     """Установить премиум статус"""
-    async with aiosqlite.connect(DB_PATH) as db:
-        premium_until = (datetime.now() + timedelta(days=days)).strftime("%Y-%m-%d %H:%M:%S")
-        await db.execute("""
-            UPDATE users 
-            SET is_premium = 1, premium_until = ?
-            WHERE user_id = ?
-        """, (premium_until, user_id))
-        await db.commit()
+    async with transaction(shard_for(user_id)) as db:
+        await grant_premium(db, user_id, days)
+    bump_data_version(user_id)
+
+
+async def grant_premium(db, user_id: int, days: int):
+    premium_until = (datetime.now() + timedelta(days=days)).strftime("%Y-%m-%d %H:%M:%S")
+    await db.execute("""
+        UPDATE users 
+        SET is_premium = 1, premium_until = ?
+        WHERE user_id = ?
+    """, (premium_until, user_id))
 
 
 # ========== PAYMENTS ==========
 
 async def create_payment(user_id: int, payment_id: str, amount: float, payment_type: str, status: str = "pending"):
     """Создать запись о платеже"""
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with transaction() as db:
         await db.execute("""
             INSERT INTO payments (user_id, payment_id, amount, payment_type, status, created_at)
             VALUES (?, ?, ?, ?, ?, ?)
         """, (user_id, payment_id, amount, payment_type, status, datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
-        await db.commit()
 
 
 async def update_payment_status(payment_id: str, status: str):
     """Обновить статус платежа"""
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with transaction() as db:
         await db.execute("""
             UPDATE payments SET status = ?, updated_at = ?
             WHERE payment_id = ?
         """, (status, datetime.now().strftime("%Y-%m-%d %H:%M:%S"), payment_id))
-        await db.commit()
+
+
+async def store_payment_event(payment_id: str, event: str, payload: str) -> bool:
+    """Сохранить событие вебхука; повторная доставка того же события игнорируется"""
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    async with transaction() as db:
+        cursor = await db.execute("""
+            INSERT OR IGNORE INTO payment_events (payment_id, event, payload, received_at, next_attempt_at)
+            VALUES (?, ?, ?, ?, ?)
+        """, (payment_id, event, payload, now, now))
+        return cursor.rowcount > 0
+
+
+async def get_pending_payment_events(limit: int = 50) -> List[dict]:
+    async with reader() as db:
+        db.row_factory = aiosqlite.Row
+        cursor = await db.execute("""
+            SELECT * FROM payment_events
+            WHERE status = 'pending' AND next_attempt_at <= ?
+            ORDER BY id LIMIT ?
+        """, (datetime.now().strftime("%Y-%m-%d %H:%M:%S"), limit))
+        return [dict(row) for row in await cursor.fetchall()]
+
+
+async def apply_payment_event(event_id: int, payment_id: str, status: Optional[str],
+                              user_id: Optional[int] = None, premium_days: int = 0) -> bool:
+    """Применить событие одной транзакцией: статус платежа, премиум и отметка о обработке.
+    
+    Возвращает False, если событие уже было применено.
+    """
+    if premium_days and user_id is None:
+        payment = await get_payment(payment_id)
+        user_id = payment['user_id'] if payment else None
+    
+    if premium_days and user_id is not None and shard_for(user_id) != HOME_SHARD:
+        # Платежи живут в домашнем шарде, пользователь — в своём: премиум
+        # выдаём первым, событие отмечаем следом. Повтор после сбоя между
+        # ними лишь заново выставит срок премиума
+        async with reader() as db:
+            cursor = await db.execute("SELECT status FROM payment_events WHERE id = ?", (event_id,))
+            row = await cursor.fetchone()
+        if not row or row[0] != 'pending':
+            return False
+        await set_premium(user_id, premium_days)
+        # Шард пользователя фиксируем явно, до записи в домашний
+        await commit_session()
+        premium_days = 0
+    
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    async with transaction() as db:
+        cursor = await db.execute(
+            "UPDATE payment_events SET status = 'done', processed_at = ? WHERE id = ? AND status = 'pending'",
+            (now, event_id)
+        )
+        if not cursor.rowcount:
+            return False
+        
+        if status:
+            await db.execute(
+                "UPDATE payments SET status = ?, updated_at = ? WHERE payment_id = ?",
+                (status, now, payment_id)
+            )
+        
+        if premium_days and user_id is not None:
+            await grant_premium(db, user_id, premium_days)
+        
+    bump_data_version(user_id)
+    return True
+
+
+async def fail_payment_event(event_id: int, error: str, retry_in: Optional[int]):
+    """Отметить неудачную попытку; без retry_in событие больше не повторяется"""
+    next_attempt = (datetime.now() + timedelta(seconds=retry_in or 0)).strftime("%Y-%m-%d %H:%M:%S")
+    async with transaction() as db:
+        await db.execute("""
+            UPDATE payment_events
+            SET attempts = attempts + 1, last_error = ?, next_attempt_at = ?,
+                status = CASE WHEN ? THEN 'pending' ELSE 'failed' END
+            WHERE id = ?
+        """, (error[:500], next_attempt, retry_in is not None, event_id))
 
 
 async def get_payment(payment_id: str) -> Optional[dict]:
     """Получить платёж по ID"""
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with reader() as db:
         db.row_factory = aiosqlite.Row
         cursor = await db.execute("SELECT * FROM payments WHERE payment_id = ?", (payment_id,))
         row = await cursor.fetchone()
@@ -198,7 +1284,7 @@ async def get_payment(payment_id: str) -> Optional[dict]:
 # ========== SUBSCRIPTIONS ==========
 
 async def get_subscriptions(user_id: int, active_only: bool = True) -> List[dict]:
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with reader(shard_for(user_id)) as db:
         db.row_factory = aiosqlite.Row
         query = "SELECT * FROM subscriptions WHERE user_id = ?"
         if active_only:
@@ -210,8 +1296,28 @@ async def get_subscriptions(user_id: int, active_only: bool = True) -> List[dict
         return [dict(row) for row in rows]
 
 
+async def iter_subscriptions(user_id: int = None):
+    """Построчный обход подписок через курсор (для выгрузок любого размера).
+    
+    Без user_id шарды обходятся по очереди и читаются из снимка.
+    """
+    if user_id is None:
+        query, params = "SELECT * FROM subscriptions ORDER BY user_id, id", ()
+        shards, open_reader = all_shards(), snapshot_reader
+    else:
+        query, params = "SELECT * FROM subscriptions WHERE user_id = ? ORDER BY next_payment ASC", (user_id,)
+        shards, open_reader = [shard_for(user_id)], reader
+    
+    for shard in shards:
+        async with open_reader(shard) as db:
+            db.row_factory = aiosqlite.Row
+            async with db.execute(query, params) as cursor:
+                async for row in cursor:
+                    yield dict(row)
+
+
 async def get_subscription(sub_id: int) -> Optional[dict]:
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with reader(shard_of_id(sub_id)) as db:
         db.row_factory = aiosqlite.Row
         cursor = await db.execute("SELECT * FROM subscriptions WHERE id = ?", (sub_id,))
         row = await cursor.fetchone()
@@ -223,38 +1329,79 @@ async def add_subscription(user_id: int, name: str, price: float, cycle: str = "
     if not next_payment:
         next_payment = datetime.now().strftime("%Y-%m-%d")
     
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with transaction(shard_for(user_id)) as db:
         cursor = await db.execute("""
-            INSERT INTO subscriptions (user_id, name, price, cycle, next_payment, category, icon)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        """, (user_id, name, price, cycle, next_payment, category, icon))
-        await db.commit()
-        return cursor.lastrowid
+            INSERT INTO subscriptions (user_id, name, price, cycle, next_payment, category, icon, billing_day)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """, (user_id, name, price, cycle, next_payment, category, icon, billing_day(next_payment)))
+        await enqueue_subscription(db, cursor.lastrowid, force=True)
+    bump_data_version(user_id)
+    return cursor.lastrowid
+
+
+async def bulk_add_subscriptions(user_id: int, subs: List[dict]) -> int:
+    """Добавить много подписок одной транзакцией"""
+    async with transaction(shard_for(user_id)) as db:
+        cursor = await db.execute("SELECT IFNULL(MAX(id), 0) FROM subscriptions")
+        last_id = (await cursor.fetchone())[0]
+        
+        await db.executemany("""
+            INSERT INTO subscriptions (user_id, name, price, cycle, next_payment, category, icon, billing_day, is_active)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, [
+            (user_id, s['name'], s['price'], s['cycle'], s['next_payment'], s['category'],
+             s['icon'], billing_day(s['next_payment']), s.get('is_active', 1))
+            for s in subs
+        ])
+        await db.execute(ENQUEUE_SUBSCRIPTIONS_SQL + " AND s.user_id = ? AND s.id > ?", (user_id, last_id))
+    
+    bump_data_version(user_id)
+    return len(subs)
+
+
+def billing_day(next_payment: str) -> Optional[int]:
+    """День месяца, к которому привязаны списания"""
+    try:
+        return parse_date(next_payment).day
+    except (TypeError, ValueError):
+        return None
 
 
 async def update_subscription(sub_id: int, **kwargs):
-    allowed = ['name', 'price', 'cycle', 'next_payment', 'category', 'icon', 'is_active']
+    allowed = ['name', 'price', 'cycle', 'next_payment', 'category', 'icon', 'is_active', 'billing_day']
     updates = {k: v for k, v in kwargs.items() if k in allowed and v is not None}
     
     if not updates:
         return
     
+    # Пользователь сменил дату — меняется и день списания
+    if 'next_payment' in updates and 'billing_day' not in updates:
+        updates['billing_day'] = billing_day(updates['next_payment'])
+    
     set_clause = ", ".join(f"{k} = ?" for k in updates.keys())
     values = list(updates.values()) + [sub_id]
     
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute(f"UPDATE subscriptions SET {set_clause} WHERE id = ?", values)
-        await db.commit()
+    async with transaction(shard_of_id(sub_id)) as db:
+        cursor = await db.execute(f"UPDATE subscriptions SET {set_clause} WHERE id = ? RETURNING user_id", values)
+        row = await cursor.fetchone()
+        await enqueue_subscription(db, sub_id)
+    
+    if row:
+        bump_data_version(row[0])
 
 
 async def delete_subscription(sub_id: int):
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute("DELETE FROM subscriptions WHERE id = ?", (sub_id,))
-        await db.commit()
+    async with transaction(shard_of_id(sub_id)) as db:
+        cursor = await db.execute("DELETE FROM subscriptions WHERE id = ? RETURNING user_id", (sub_id,))
+        row = await cursor.fetchone()
+        await db.execute("DELETE FROM due_notifications WHERE kind = 'sub' AND ref_id = ?", (sub_id,))
+    
+    if row:
+        bump_data_version(row[0])
 
 
 async def count_subscriptions(user_id: int) -> int:
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with reader(shard_for(user_id)) as db:
         cursor = await db.execute(
             "SELECT COUNT(*) FROM subscriptions WHERE user_id = ? AND is_active = 1",
             (user_id,)
@@ -284,25 +1431,21 @@ async def get_monthly_total(user_id: int) -> float:
 
 
 async def get_upcoming(user_id: int, days: int = 7) -> List[dict]:
-    async with aiosqlite.connect(DB_PATH) as db:
-        db.row_factory = aiosqlite.Row
-        today = datetime.now().strftime("%Y-%m-%d")
-        future = (datetime.now() + timedelta(days=days)).strftime("%Y-%m-%d")
-        
-        cursor = await db.execute("""
-            SELECT * FROM subscriptions
-            WHERE user_id = ? AND is_active = 1 AND next_payment BETWEEN ? AND ?
-            ORDER BY next_payment ASC
-        """, (user_id, today, future))
-        
-        rows = await cursor.fetchall()
-        return [dict(row) for row in rows]
+    """Все списания за N дней, включая повторные (next_payment — дата списания)"""
+    subs = await get_subscriptions(user_id)
+    return upcoming_charges(subs, days)
+
+
+async def get_forecast(user_id: int, months: int = 12) -> List[dict]:
+    """Прогноз списаний по календарным месяцам"""
+    subs = await get_subscriptions(user_id)
+    return forecast_months(subs, months)
 
 
 # ========== TRIALS ==========
 
 async def get_trials(user_id: int) -> List[dict]:
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with reader(shard_for(user_id)) as db:
         db.row_factory = aiosqlite.Row
         cursor = await db.execute(
             "SELECT * FROM trials WHERE user_id = ? ORDER BY end_date ASC",
@@ -313,7 +1456,7 @@ async def get_trials(user_id: int) -> List[dict]:
 
 
 async def get_trial(trial_id: int) -> Optional[dict]:
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with reader(shard_of_id(trial_id)) as db:
         db.row_factory = aiosqlite.Row
         cursor = await db.execute("SELECT * FROM trials WHERE id = ?", (trial_id,))
         row = await cursor.fetchone()
@@ -321,25 +1464,25 @@ async def get_trial(trial_id: int) -> Optional[dict]:
 
 
 async def add_trial(user_id: int, name: str, end_date: str, price_after: float = 0, icon: str = "⏱") -> int:
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with transaction(shard_for(user_id)) as db:
         cursor = await db.execute("""
             INSERT INTO trials (user_id, name, end_date, price_after, icon)
             VALUES (?, ?, ?, ?, ?)
         """, (user_id, name, end_date, price_after, icon))
-        await db.commit()
+        await enqueue_trial(db, cursor.lastrowid)
         return cursor.lastrowid
 
 
 async def delete_trial(trial_id: int):
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with transaction(shard_of_id(trial_id)) as db:
         await db.execute("DELETE FROM trials WHERE id = ?", (trial_id,))
-        await db.commit()
+        await db.execute("DELETE FROM due_notifications WHERE kind = 'trial' AND ref_id = ?", (trial_id,))
 
 
 # ========== ACHIEVEMENTS ==========
 
 async def get_achievements(user_id: int) -> List[str]:
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with reader(shard_for(user_id)) as db:
         cursor = await db.execute(
             "SELECT achievement_id FROM achievements WHERE user_id = ?",
             (user_id,)
@@ -348,21 +1491,93 @@ async def get_achievements(user_id: int) -> List[str]:
         return [row[0] for row in rows]
 
 
-async def unlock_achievement(user_id: int, achievement_id: str) -> bool:
-    async with aiosqlite.connect(DB_PATH) as db:
-        try:
-            await db.execute(
-                "INSERT INTO achievements (user_id, achievement_id) VALUES (?, ?)",
+ACHIEVEMENT_SNAPSHOT_SQL = """
+    SELECT u.user_id, u.xp, u.total_saved,
+           (SELECT COUNT(*) FROM subscriptions s WHERE s.user_id = u.user_id AND s.is_active = 1) AS subs,
+           (SELECT GROUP_CONCAT(a.achievement_id) FROM achievements a WHERE a.user_id = u.user_id) AS unlocked,
+           u.visits
+    FROM users u
+"""
+
+
+def _snapshot(row) -> dict:
+    row = pending.overlay_user(dict(row))
+    row['visits'] = pending.overlay_visits(row['user_id'], row['visits'])
+    return {
+        "user_id": row['user_id'],
+        "xp": row['xp'] or 0,
+        "total_saved": row['total_saved'] or 0,
+        "subs": row['subs'],
+        "unlocked": set(row['unlocked'].split(",")) if row['unlocked'] else set(),
+        "streak": visits.streak(visits.to_bits(row['visits'])),
+    }
+
+
+async def get_achievement_snapshot(user_id: int) -> dict:
+    """Всё, что нужно правилам достижений, одним запросом"""
+    async with reader(shard_for(user_id)) as db:
+        db.row_factory = aiosqlite.Row
+        cursor = await db.execute(ACHIEVEMENT_SNAPSHOT_SQL + " WHERE u.user_id = ?", (user_id,))
+        row = await cursor.fetchone()
+    
+    if not row:
+        return {"user_id": user_id, "xp": 0, "total_saved": 0, "subs": 0, "unlocked": set(), "streak": 0}
+    return _snapshot(row)
+
+
+async def get_all_achievement_snapshots() -> List[dict]:
+    """Состояние всех пользователей для ночного досчёта — из снимка.
+    
+    Отстаёт от базы до REPLICA_MAX_AGE: пропущенное выдаст проверка
+    при действии пользователя или следующий досчёт.
+    """
+    snapshots = []
+    for shard in all_shards():
+        async with snapshot_reader(shard) as db:
+            db.row_factory = aiosqlite.Row
+            cursor = await db.execute(ACHIEVEMENT_SNAPSHOT_SQL)
+            snapshots += [_snapshot(row) for row in await cursor.fetchall()]
+    return snapshots
+
+
+async def grant_achievements(grants: List[tuple]) -> List[tuple]:
+    """Выдать достижения и XP одной транзакцией на шард.
+    
+    grants — список (user_id, achievement_id, xp); возвращает реально
+    выданные (user_id, achievement_id), уже имеющиеся пропускаются.
+    """
+    by_shard = {}
+    for grant in grants:
+        by_shard.setdefault(shard_for(grant[0]), []).append(grant)
+    
+    results = await gather_parallel([grant_shard_achievements(shard, items) for shard, items in by_shard.items()])
+    return [item for granted in results for item in granted]
+
+
+async def grant_shard_achievements(shard: int, grants: List[tuple]) -> List[tuple]:
+    granted = []
+    xp = {}
+    
+    async with transaction(shard) as db:
+        for user_id, achievement_id, amount in grants:
+            cursor = await db.execute(
+                "INSERT OR IGNORE INTO achievements (user_id, achievement_id) VALUES (?, ?)",
                 (user_id, achievement_id)
             )
-            await db.commit()
-            return True
-        except:
-            return False
+            if cursor.rowcount:
+                granted.append((user_id, achievement_id))
+                xp[user_id] = xp.get(user_id, 0) + amount
+        
+        await db.executemany(
+            "UPDATE users SET xp = xp + ? WHERE user_id = ?",
+            [(amount, user_id) for user_id, amount in xp.items()]
+        )
+    
+    return granted
 
 
 async def has_achievement(user_id: int, achievement_id: str) -> bool:
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with reader(shard_for(user_id)) as db:
         cursor = await db.execute(
             "SELECT 1 FROM achievements WHERE user_id = ? AND achievement_id = ?",
             (user_id, achievement_id)
@@ -405,58 +1620,272 @@ async def get_stats(user_id: int) -> dict:
     }
 
 
-# ========== NOTIFICATIONS ==========
+# Цена в пересчёте на месяц, как в get_monthly_total
+MONTHLY_PRICE_SQL = """
+    CASE cycle
+        WHEN 'yearly' THEN price / 12.0
+        WHEN 'weekly' THEN price * 4.33
+        WHEN 'quarterly' THEN price / 3.0
+        ELSE price
+    END
+"""
 
-async def get_users_for_notification(days: int) -> List[dict]:
-    async with aiosqlite.connect(DB_PATH) as db:
+
+async def get_home_summary(user_id: int, days: int = 3, limit: int = 3) -> dict:
+    """Главный экран: итоги, ближайшие списания и истекающие триалы за один заход в базу"""
+    today = date.today()
+    horizon = (today + timedelta(days=days)).strftime("%Y-%m-%d")
+    
+    async with reader(shard_for(user_id)) as db:
         db.row_factory = aiosqlite.Row
-        target = (datetime.now() + timedelta(days=days)).strftime("%Y-%m-%d")
-        today = datetime.now().strftime("%Y-%m-%d")
+        cursor = await db.execute(f"""
+            SELECT COUNT(*) AS count, IFNULL(SUM({MONTHLY_PRICE_SQL}), 0) AS monthly
+            FROM subscriptions
+            WHERE user_id = ? AND is_active = 1
+        """, (user_id,))
+        totals = await cursor.fetchone()
         
+        # Списание в окне возможно, только если ближайшее не позже его конца
         cursor = await db.execute("""
-            SELECT s.*, u.notify_enabled, u.notify_days
-            FROM subscriptions s
-            JOIN users u ON s.user_id = u.user_id
-            WHERE s.is_active = 1 AND s.next_payment = ? AND u.notify_enabled = 1
-            AND NOT EXISTS (
-                SELECT 1 FROM notification_log n
-                WHERE n.sub_id = s.id AND n.sent_at = ?
-            )
-        """, (target, today))
+            SELECT * FROM subscriptions
+            WHERE user_id = ? AND is_active = 1 AND next_payment <= ?
+        """, (user_id, horizon))
+        due = [dict(row) for row in await cursor.fetchall()]
         
-        rows = await cursor.fetchall()
-        return [dict(row) for row in rows]
+        cursor = await db.execute("""
+            SELECT id, name, icon, end_date, price_after,
+                   CAST(julianday(end_date) - julianday(?) AS INTEGER) AS days_left
+            FROM trials
+            WHERE user_id = ? AND end_date <= ?
+            ORDER BY end_date
+            LIMIT ?
+        """, (today.strftime("%Y-%m-%d"), user_id, horizon, limit))
+        trials = [dict(row) for row in await cursor.fetchall()]
+    
+    upcoming = upcoming_charges(due, days, today)[:limit]
+    for charge in upcoming:
+        charge['days_left'] = (parse_date(charge['next_payment']) - today).days
+    
+    monthly = round(totals['monthly'], 2)
+    return {
+        "count": totals['count'],
+        "monthly": monthly,
+        "yearly": round(monthly * 12, 2),
+        "upcoming": upcoming,
+        "expiring_trials": trials,
+    }
+
+
+async def get_active_subscription_rows() -> List[tuple]:
+    """Все активные подписки для популяционной аналитики"""
+    return [row for rows in await gather_shards(get_shard_subscription_rows) for row in rows]
+
+
+async def get_shard_subscription_rows(shard: int) -> List[tuple]:
+    async with snapshot_reader(shard) as db:
+        cursor = await db.execute("""
+            SELECT user_id, price, cycle, category
+            FROM subscriptions
+            WHERE is_active = 1
+        """)
+        return await cursor.fetchall()
+
+
+# ========== HISTORY ==========
+
+def month_key(months_back: int = 0) -> str:
+    today = date.today()
+    year, month = divmod(today.year * 12 + today.month - 1 - months_back, 12)
+    return f"{year:04d}-{month + 1:02d}"
+
+
+async def get_monthly_history(user_id: int, months: int = 12) -> List[dict]:
+    """Списания по месяцам из агрегатов, от старых к новым"""
+    async with reader(shard_for(user_id)) as db:
+        cursor = await db.execute("""
+            SELECT month, SUM(total), SUM(charges)
+            FROM monthly_rollup
+            WHERE user_id = ? AND month >= ?
+            GROUP BY month
+        """, (user_id, month_key(months - 1)))
+        rows = {month: (total, charges) for month, total, charges in await cursor.fetchall()}
+    
+    history = []
+    for i in range(months - 1, -1, -1):
+        month = month_key(i)
+        total, charges = rows.get(month, (0, 0))
+        history.append({"month": month, "total": round(total, 2), "charges": charges})
+    return history
+
+
+async def get_category_history(user_id: int, month: str = None) -> dict:
+    async with reader(shard_for(user_id)) as db:
+        cursor = await db.execute(
+            "SELECT category, total FROM monthly_rollup WHERE user_id = ? AND month = ?",
+            (user_id, month or month_key())
+        )
+        return {cat: round(total, 2) for cat, total in await cursor.fetchall()}
+
+
+async def get_month_spent(user_id: int, month: str = None) -> float:
+    return round(sum((await get_category_history(user_id, month)).values()), 2)
+
+
+# ========== NOTIFICATIONS ==========
+
+TRIAL_NOTIFY_DAYS = 2
+
+SUB_FIRE_DATE_SQL = "date(s.next_payment, printf('-%d days', IFNULL(u.notify_days, 1)))"
+
+ENQUEUE_SUBSCRIPTIONS_SQL = f"""
+    INSERT OR IGNORE INTO due_notifications (user_id, kind, ref_id, fire_date, due_date)
+    SELECT s.user_id, 'sub', s.id, {SUB_FIRE_DATE_SQL}, s.next_payment
+    FROM subscriptions s
+    LEFT JOIN users u ON u.user_id = s.user_id
+    WHERE s.is_active = 1
+"""
 
+ENQUEUE_TRIALS_SQL = f"""
+    INSERT OR IGNORE INTO due_notifications (user_id, kind, ref_id, fire_date, due_date)
+    SELECT t.user_id, 'trial', t.id, date(t.end_date, '-{TRIAL_NOTIFY_DAYS} days'), t.end_date
+    FROM trials t
+    WHERE t.notified = 0
+"""
 
-async def get_expiring_trials(days: int = 2) -> List[dict]:
-    async with aiosqlite.connect(DB_PATH) as db:
+
+async def enqueue_subscription(db, sub_id: int, force: bool = False):
+    """Пересобрать напоминание для подписки (в транзакции вызывающего).
+    
+    Уже отправленное напоминание повторно не ставится: сегодняшняя или
+    прошедшая дата срабатывания допустима только для нового списания или
+    ещё не отправленной строки — иначе вечерний прогон повторил бы
+    утреннее напоминание.
+    """
+    cursor = await db.execute(
+        "DELETE FROM due_notifications WHERE kind = 'sub' AND ref_id = ? RETURNING id", (sub_id,)
+    )
+    pending = await cursor.fetchall()
+    
+    if force or pending:
+        await db.execute(ENQUEUE_SUBSCRIPTIONS_SQL + " AND s.id = ?", (sub_id,))
+    else:
+        await db.execute(ENQUEUE_SUBSCRIPTIONS_SQL + f" AND s.id = ? AND {SUB_FIRE_DATE_SQL} > ?",
+                         (sub_id, date.today().strftime("%Y-%m-%d")))
+
+
+async def enqueue_user_subscriptions(db, user_id: int):
+    cursor = await db.execute(
+        "DELETE FROM due_notifications WHERE kind = 'sub' AND user_id = ? RETURNING ref_id", (user_id,)
+    )
+    pending = await cursor.fetchall()
+    
+    # Неотправленные строки возвращаем как были, остальные — только на будущие даты
+    await db.execute(ENQUEUE_SUBSCRIPTIONS_SQL + f" AND s.user_id = ? AND {SUB_FIRE_DATE_SQL} > ?",
+                     (user_id, date.today().strftime("%Y-%m-%d")))
+    await db.executemany(ENQUEUE_SUBSCRIPTIONS_SQL + " AND s.id = ?", pending)
+
+
+async def enqueue_trial(db, trial_id: int):
+    await db.execute(ENQUEUE_TRIALS_SQL + " AND t.id = ?", (trial_id,))
+
+
+async def backfill_notification_queue(db):
+    """Заполнить очередь для баз, созданных до её появления"""
+    today = date.today().strftime("%Y-%m-%d")
+    await db.execute(ENQUEUE_SUBSCRIPTIONS_SQL + f" AND {SUB_FIRE_DATE_SQL} >= ?", (today,))
+    await db.execute(ENQUEUE_TRIALS_SQL + " AND t.end_date >= ?", (today,))
+
+
+async def get_due_notifications(kind: str, after_id: int = 0, limit: int = -1,
+                                shard: int = HOME_SHARD) -> List[dict]:
+    """Напоминания шарда, срок которых наступил, после курсора прогона; просроченные удаляются"""
+    today = date.today().strftime("%Y-%m-%d")
+    
+    async with transaction(shard) as db:
+        await db.execute("DELETE FROM due_notifications WHERE due_date < ?", (today,))
+    
+    async with reader(shard) as db:
         db.row_factory = aiosqlite.Row
-        target = (datetime.now() + timedelta(days=days)).strftime("%Y-%m-%d")
-        
         cursor = await db.execute("""
-            SELECT t.*, u.notify_enabled
-            FROM trials t
-            JOIN users u ON t.user_id = u.user_id
-            WHERE t.end_date = ? AND t.notified = 0 AND u.notify_enabled = 1
-        """, (target,))
+            SELECT d.id AS queue_id, d.kind, d.ref_id AS id, d.user_id, d.due_date,
+                   COALESCE(s.name, t.name) AS name,
+                   COALESCE(s.icon, t.icon) AS icon,
+                   COALESCE(s.price, t.price_after) AS price
+            FROM due_notifications d
+            JOIN users u ON u.user_id = d.user_id
+            LEFT JOIN subscriptions s ON d.kind = 'sub' AND s.id = d.ref_id
+            LEFT JOIN trials t ON d.kind = 'trial' AND t.id = d.ref_id
+            WHERE d.fire_date <= ? AND d.kind = ? AND u.notify_enabled = 1 AND d.id > ?
+            ORDER BY d.id
+            LIMIT ?
+        """, (today, kind, after_id, limit))
         
         rows = await cursor.fetchall()
         return [dict(row) for row in rows]
 
 
-async def log_notification(sub_id: int, user_id: int):
-    async with aiosqlite.connect(DB_PATH) as db:
+async def start_notification_run(kind: str, shard: int = HOME_SHARD) -> dict:
+    now = datetime.now()
+    async with transaction(shard) as db:
+        cursor = await db.execute("""
+            INSERT INTO notification_runs (kind, run_date, started_at)
+            VALUES (?, ?, ?)
+            RETURNING *
+        """, (kind, now.strftime("%Y-%m-%d"), now.strftime("%Y-%m-%d %H:%M:%S")))
+        run = dict(await cursor.fetchone())
+        return run
+
+
+async def get_unfinished_notification_runs() -> List[dict]:
+    runs = []
+    for shard in all_shards():
+        async with reader(shard) as db:
+            db.row_factory = aiosqlite.Row
+            cursor = await db.execute(
+                "SELECT * FROM notification_runs WHERE status IN ('running', 'interrupted') ORDER BY id"
+            )
+            runs += [dict(row) for row in await cursor.fetchall()]
+    return runs
+
+
+async def complete_notification(run_id: int, notif: dict):
+    """Отправлено: снять из очереди, записать в журнал и сдвинуть курсор прогона одной транзакцией"""
+    async with transaction(shard_of_id(run_id)) as db:
+        await db.execute("DELETE FROM due_notifications WHERE id = ?", (notif['queue_id'],))
+        if notif['kind'] == 'trial':
+            await db.execute("UPDATE trials SET notified = 1 WHERE id = ?", (notif['id'],))
         await db.execute(
-            "INSERT INTO notification_log (user_id, sub_id) VALUES (?, ?)",
-            (user_id, sub_id)
+            "UPDATE notification_runs SET cursor = ?, sent = sent + 1 WHERE id = ?",
+            (notif['queue_id'], run_id)
         )
-        await db.commit()
+    
+    # Журнал только дописывается: его строки уходят с отложенными записями
+    if notif['kind'] != 'trial':
+        pending.append("INSERT INTO notification_log (user_id, sub_id) VALUES (?, ?)",
+                       (notif['user_id'], notif['id']), shard_for(notif['user_id']))
 
 
-async def mark_trial_notified(trial_id: int):
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute("UPDATE trials SET notified = 1 WHERE id = ?", (trial_id,))
-        await db.commit()
+async def skip_notification(run_id: int, queue_id: int):
+    """Не отправлено: остаётся в очереди до следующего прогона"""
+    async with transaction(shard_of_id(run_id)) as db:
+        await db.execute(
+            "UPDATE notification_runs SET cursor = ?, failed = failed + 1 WHERE id = ?",
+            (queue_id, run_id)
+        )
+
+
+async def finish_notification_run(run_id: int, status: str):
+    async with transaction(shard_of_id(run_id)) as db:
+        await db.execute(
+            "UPDATE notification_runs SET status = ?, finished_at = ? WHERE id = ?",
+            (status, datetime.now().strftime("%Y-%m-%d %H:%M:%S"), run_id)
+        )
+
+
+def next_payment_after(sub: dict, today: date) -> str:
+    anchor = sub['billing_day'] or billing_day(sub['next_payment'])
+    next_date = advance(parse_date(sub['next_payment']), sub['cycle'], today, anchor)
+    return next_date.strftime("%Y-%m-%d")
 
 
 async def update_next_payment(sub_id: int):
@@ -464,14 +1893,54 @@ async def update_next_payment(sub_id: int):
     if not sub:
         return
     
-    current = datetime.strptime(sub['next_payment'], "%Y-%m-%d")
-    cycle = sub['cycle']
+    await update_subscription(
+        sub_id,
+        next_payment=next_payment_after(sub, date.today()),
+        billing_day=sub['billing_day'] or billing_day(sub['next_payment'])
+    )
+
+
+async def roll_payment_dates() -> int:
+    """Перенести прошедшие даты списаний на следующий период, шарды параллельно"""
+    return sum(await gather_shards(roll_shard_payment_dates))
+
+
+async def roll_shard_payment_dates(shard: int) -> int:
+    today = date.today()
     
-    deltas = {'weekly': 7, 'monthly': 30, 'quarterly': 90, 'yearly': 365}
-    next_date = current + timedelta(days=deltas.get(cycle, 30))
+    async with transaction(shard) as db:
+        cursor = await db.execute("""
+            SELECT * FROM subscriptions
+            WHERE is_active = 1 AND next_payment < ?
+        """, (today.strftime("%Y-%m-%d"),))
+        rows = await cursor.fetchall()
+        
+        updates = []
+        charges = []
+        for row in rows:
+            try:
+                sub = dict(row)
+                start = parse_date(sub['next_payment'])
+                anchor = sub['billing_day'] or start.day
+                next_payment = next_payment_after(sub, today)
+            except ValueError:
+                continue
+            
+            updates.append((next_payment, anchor, sub['id']))
+            for day in project(start, sub['cycle'], start, today - timedelta(days=1), anchor):
+                charges.append((sub['user_id'], sub['id'], sub['name'], sub['category'],
+                                sub['price'], day.strftime("%Y-%m-%d")))
+        
+        await db.executemany("""
+            INSERT OR IGNORE INTO payment_ledger (user_id, sub_id, name, category, amount, charged_on)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, charges)
+        await db.executemany("UPDATE subscriptions SET next_payment = ?, billing_day = ? WHERE id = ?", updates)
+        await db.executemany("DELETE FROM due_notifications WHERE kind = 'sub' AND ref_id = ?",
+                             [(sub_id,) for _, _, sub_id in updates])
+        await db.executemany(ENQUEUE_SUBSCRIPTIONS_SQL + " AND s.id = ?", [(sub_id,) for _, _, sub_id in updates])
     
-    today = datetime.now()
-    while next_date < today:
-        next_date += timedelta(days=deltas.get(cycle, 30))
+    for user_id in {row['user_id'] for row in rows}:
+        bump_data_version(user_id)
     
-    await update_subscription(sub_id, next_payment=next_date.strftime("%Y-%m-%d"))
+    return len(updates)
@@ -5,6 +5,7 @@ from aiogram.filters import Command
 import database as db
 from config import ACHIEVEMENTS, get_level
 from keyboards.inline import main_menu
+from services import visits
 
 router = Router()
 
@@ -14,6 +15,7 @@ async def show_achievements(callback: CallbackQuery):
     user_id = callback.from_user.id
     user = await db.get_user(user_id)
     unlocked = await db.get_achievements(user_id)
+    history = await db.get_visit_history(user_id)
     
     xp = user.get('xp', 0) if user else 0
     level = get_level(xp)
@@ -21,6 +23,7 @@ async def show_achievements(callback: CallbackQuery):
     text = f"🏆 <b>Достижения</b>\n\n"
     text += f"Уровень: <b>{level['name']}</b>\n"
     text += f"Опыт: {xp} XP\n"
+    text += f"🔥 Серия: {visits.streak(history)} дн. · за 30 дней: {visits.active_days(history, 30)}\n"
     
     if level['next']:
         progress = int(level['progress'] / 5)
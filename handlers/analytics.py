@@ -1,26 +1,39 @@
 from aiogram import Router, F
-from aiogram.types import CallbackQuery, BufferedInputFile
+from aiogram.types import Message, CallbackQuery, BufferedInputFile
 from aiogram.filters import Command
 from datetime import datetime
 
 import database as db
-from config import CATEGORIES
+from config import CATEGORIES, ADMIN_IDS
 from keyboards.inline import analytics_menu, main_menu, back_button
+from services.cache import LRUCache
+from services.population import get_population, get_user_insight
 
 router = Router()
 
+# Готовые экраны: (user_id, экран, дата) -> (версия данных, текст, клавиатура)
+screen_cache = LRUCache(maxsize=5000, ttl=600)
 
-@router.callback_query(F.data == "analytics")
-async def show_analytics(callback: CallbackQuery):
-    stats = await db.get_stats(callback.from_user.id)
+
+async def render_cached(user_id: int, screen: str, render):
+    """Отдать экран из кэша, если данные пользователя не менялись"""
+    key = (user_id, screen, datetime.now().strftime("%Y-%m-%d"))
+    version = db.get_data_version(user_id)
+    
+    cached = screen_cache.get(key)
+    if cached and cached[0] == version:
+        return cached[1]
+    
+    result = await render(user_id)
+    screen_cache.set(key, (version, result))
+    return result
+
+
+async def render_analytics(user_id: int):
+    stats = await db.get_stats(user_id)
     
     if stats['count'] == 0:
-        await callback.message.edit_text(
-            "📊 <b>Аналитика</b>\n\nДобавьте подписки для анализа!",
-            reply_markup=main_menu(),
-            parse_mode="HTML"
-        )
-        return
+        return "📊 <b>Аналитика</b>\n\nДобавьте подписки для анализа!", main_menu()
     
     text = (
         f"📊 <b>Аналитика</b>\n\n"
@@ -35,16 +48,27 @@ async def show_analytics(callback: CallbackQuery):
         s = stats['most_expensive']
         text += f"\n💎 Самая дорогая: {s['icon']} {s['name']} ({int(s['price'])}₽)"
     
-    await callback.message.edit_text(text, reply_markup=analytics_menu(), parse_mode="HTML")
+    insight = get_user_insight(user_id)
+    if insight:
+        text += f"\n\n👥 Ваши расходы выше, чем у {insight['percentile']}% пользователей"
+        top = insight['top_category']
+        if top and top['percentile'] > 0:
+            text += f"\n🔥 На {top['name']} вы тратите больше, чем {top['percentile']}% пользователей"
+    
+    return text, analytics_menu()
 
 
-@router.callback_query(F.data == "analytics:cats")
-async def show_categories(callback: CallbackQuery):
-    stats = await db.get_stats(callback.from_user.id)
+@router.callback_query(F.data == "analytics")
+async def show_analytics(callback: CallbackQuery):
+    text, markup = await render_cached(callback.from_user.id, "analytics", render_analytics)
+    await callback.message.edit_text(text, reply_markup=markup, parse_mode="HTML")
+
+
+async def render_categories(user_id: int):
+    stats = await db.get_stats(user_id)
     
     if not stats['by_category']:
-        await callback.answer("Нет данных")
-        return
+        return None
     
     text = "📊 <b>Расходы по категориям</b>\n\n"
     total = stats['monthly']
@@ -59,13 +83,23 @@ async def show_categories(callback: CallbackQuery):
         
         text += f"<b>{cat_name}</b>\n{bar}\n{int(amount)}₽ ({int(percent)}%)\n\n"
     
+    return text
+
+
+@router.callback_query(F.data == "analytics:cats")
+async def show_categories(callback: CallbackQuery):
+    text = await render_cached(callback.from_user.id, "cats", render_categories)
+    
+    if not text:
+        await callback.answer("Нет данных")
+        return
+    
     await callback.message.edit_text(text, reply_markup=back_button("analytics"), parse_mode="HTML")
 
 
-@router.callback_query(F.data == "analytics:tips")
-async def show_tips(callback: CallbackQuery):
-    subs = await db.get_subscriptions(callback.from_user.id)
-    stats = await db.get_stats(callback.from_user.id)
+async def render_tips(user_id: int):
+    subs = await db.get_subscriptions(user_id)
+    stats = await db.get_stats(user_id)
     
     tips = []
     
@@ -110,16 +144,21 @@ async def show_tips(callback: CallbackQuery):
     if not tips:
         tips.append("✅ <b>Отлично!</b>\nВаши подписки выглядят оптимально!")
     
-    text = "💡 <b>Советы по экономии</b>\n\n" + "\n\n".join(tips)
-    
+    return "💡 <b>Советы по экономии</b>\n\n" + "\n\n".join(tips)
+
+
+@router.callback_query(F.data == "analytics:tips")
+async def show_tips(callback: CallbackQuery):
+    text = await render_cached(callback.from_user.id, "tips", render_tips)
     await callback.message.edit_text(text, reply_markup=back_button("analytics"), parse_mode="HTML")
 
 
-@router.callback_query(F.data == "analytics:report")
-async def monthly_report(callback: CallbackQuery):
-    subs = await db.get_subscriptions(callback.from_user.id)
-    stats = await db.get_stats(callback.from_user.id)
-    user = await db.get_user(callback.from_user.id)
+async def render_report(user_id: int):
+    subs = await db.get_subscriptions(user_id)
+    stats = await db.get_stats(user_id)
+    user = await db.get_user(user_id)
+    forecast = await db.get_forecast(user_id, months=12)
+    history = await db.get_monthly_history(user_id, months=13)
     
     text = f"📋 <b>Месячный отчёт</b>\n"
     text += f"📅 {datetime.now().strftime('%B %Y')}\n\n"
@@ -142,15 +181,81 @@ async def monthly_report(callback: CallbackQuery):
             cat_name = CATEGORIES.get(cat, cat)
             text += f"• {cat_name}: {int(amount)}₽\n"
     
+    # История списаний
+    spent = history[-1]['total']
+    if spent > 0:
+        text += f"\n💳 <b>Списано в этом месяце:</b> {int(spent)}₽\n"
+    
+    recent = [m for m in history[-6:] if m['total'] > 0]
+    if len(recent) > 1:
+        peak = max(m['total'] for m in recent)
+        text += "\n📈 <b>По месяцам:</b>\n"
+        for m in history[-6:]:
+            bar = "█" * int(m['total'] / peak * 10) if peak else ""
+            text += f"<code>{m['month']}</code> {bar} {int(m['total'])}₽\n"
+    
+    last_year = history[0]['total']
+    if last_year > 0 and spent > 0:
+        change = (spent - last_year) / last_year * 100
+        text += f"\n📆 К прошлому году: {'+' if change >= 0 else ''}{int(change)}%\n"
+    
     # Сэкономлено
     if user and user.get('total_saved', 0) > 0:
         text += f"\n💚 <b>Сэкономлено:</b> {int(user['total_saved'])}₽"
     
-    text += f"\n\n📅 <b>Прогноз на год:</b> {int(stats['yearly'])}₽"
+    text += f"\n\n📅 <b>Прогноз на 12 месяцев:</b> {int(sum(m['total'] for m in forecast))}₽"
     
+    return text
+
+
+@router.callback_query(F.data == "analytics:report")
+async def monthly_report(callback: CallbackQuery):
+    text = await render_cached(callback.from_user.id, "report", render_report)
     await callback.message.edit_text(text, reply_markup=back_button("analytics"), parse_mode="HTML")
 
 
+@router.message(Command("admin"))
+async def admin_overview(message: Message):
+    if message.from_user.id not in ADMIN_IDS:
+        return
+    
+    activity = await db.get_visit_stats()
+    
+    text = "👥 <b>Активность</b>\n"
+    text += f"DAU: <b>{activity['dau']}</b> · WAU: <b>{activity['wau']}</b> · MAU: <b>{activity['mau']}</b>\n"
+    
+    if activity['retention']:
+        text += "\n<b>Удержание (D1 / D7 / D30):</b>\n"
+        for cohort in activity['retention'][-6:]:
+            days = " / ".join("—" if cohort[d] is None else f"{int(cohort[d])}%" for d in ("d1", "d7", "d30"))
+            text += f"• {cohort['cohort']} ({cohort['users']}): {days}\n"
+    
+    population = get_population()
+    if not population:
+        await message.answer(text + "\n📈 Статистика расходов ещё не посчитана", parse_mode="HTML")
+        return
+    
+    data = population.overview()
+    
+    text += f"\n📈 <b>Обзор</b> ({data['built_at']})\n\n"
+    text += f"👥 Пользователей с подписками: <b>{data['users']}</b>\n"
+    text += f"💰 Суммарно в месяц: <b>{int(data['monthly_total'])} ₽</b>\n\n"
+    
+    text += "<b>Расходы на пользователя:</b>\n"
+    for name, value in data['percentiles'].items():
+        text += f"• {name}: {int(value)} ₽\n"
+    
+    text += "\n<b>Распределение:</b>\n"
+    for label, users in data['histogram'].items():
+        text += f"• {label} ₽: {users}\n"
+    
+    text += "\n<b>Категории:</b>\n"
+    for cat in data['categories'][:5]:
+        text += f"• {cat['name']}: {int(cat['monthly'])} ₽ ({cat['payers']} польз.)\n"
+    
+    await message.answer(text, parse_mode="HTML")
+
+
 @router.callback_query(F.data == "back_analytics")
 async def back_to_analytics(callback: CallbackQuery):
 
@@ -3,4 +3,5 @@ from . import subscriptions
 from . import trials
 from . import analytics
 from . import achievements
-from . import settings
\ No newline at end of file
+from . import settings
+from . import search
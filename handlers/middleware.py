@@ -0,0 +1,26 @@
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+import database as db
+
+
+class UnitOfWorkMiddleware(BaseMiddleware):
+    """Одна единица работы с базой на апдейт; хендлер может принять её как db_session.
+
+    Записи фиксируются одним коммитом после хендлера. Первая запись
+    занимает писателя шарда до коммита, поэтому хендлер, который пишет,
+    вызывает db.commit_session() до запросов к Telegram: иначе все записи
+    процесса ждут сети, а пользователь видит успех до коммита.
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        async with db.session() as session:
+            data["db_session"] = session
+            return await handler(event, data)
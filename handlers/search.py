@@ -0,0 +1,21 @@
+from aiogram import Router
+from aiogram.types import InlineQuery, InlineQueryResultArticle, InputTextMessageContent
+
+from services.search import search_services
+
+router = Router()
+
+
+@router.inline_query()
+async def inline_search(query: InlineQuery):
+    results = []
+
+    for i, item in enumerate(search_services(query.query, limit=20)):
+        results.append(InlineQueryResultArticle(
+            id=str(i),
+            title=f"{item['icon']} {item['name']}",
+            description=f"~{item['price']}₽/мес · {item['category_name']}",
+            input_message_content=InputTextMessageContent(message_text=f"/add {item['name']}")
+        ))
+
+    await query.answer(results, cache_time=3600, is_personal=False)
@@ -1,10 +1,12 @@
 from aiogram import Router, F
-from aiogram.types import CallbackQuery, BufferedInputFile
+from aiogram.types import CallbackQuery, FSInputFile
 from aiogram.filters import Command
 from datetime import datetime
+import os
 
 import database as db
-from keyboards.inline import settings_keyboard, notify_days_keyboard, main_menu
+from keyboards.inline import settings_keyboard, notify_days_keyboard, export_keyboard, main_menu
+from services.export import FORMATS, available_formats, export_to_file
 
 router = Router()
 
@@ -29,6 +31,7 @@ async def toggle_notify(callback: CallbackQuery):
     new_value = 0 if user.get('notify_enabled', 1) else 1
     
     await db.update_user(callback.from_user.id, notify_enabled=new_value)
+    await db.commit_session()
     
     status = "включены ✅" if new_value else "отключены ❌"
     await callback.answer(f"Уведомления {status}")
@@ -50,32 +53,42 @@ async def set_days(callback: CallbackQuery):
     days = int(callback.data.split(":")[1])
     
     await db.update_user(callback.from_user.id, notify_days=days)
+    await db.commit_session()
     await callback.answer(f"Буду напоминать за {days} дн.")
     
     await show_settings(callback)
 
 
 @router.callback_query(F.data == "export")
+async def export_menu(callback: CallbackQuery):
+    await callback.message.edit_text(
+        "📤 <b>Экспорт подписок</b>\n\nВыберите формат:",
+        reply_markup=export_keyboard(tuple(available_formats())),
+        parse_mode="HTML"
+    )
+
+
+@router.callback_query(F.data.startswith("export:"))
 async def export_data(callback: CallbackQuery):
-    subs = await db.get_subscriptions(callback.from_user.id, active_only=False)
-    
-    if not subs:
-        await callback.answer("Нет данных для экспорта")
+    fmt = callback.data.split(":")[1]
+    if fmt not in available_formats():
+        await callback.answer("Формат недоступен")
         return
     
-    csv = "Название,Цена,Период,Следующий платёж,Категория,Статус\n"
+    path, rows = await export_to_file(db.iter_subscriptions(callback.from_user.id), fmt)
+    # Загрузка файла долгая: писатель не должен её ждать
+    await db.commit_session()
     
-    cycles = {"weekly": "Неделя", "monthly": "Месяц", "quarterly": "Квартал", "yearly": "Год"}
-    
-    for s in subs:
-        status = "Активна" if s['is_active'] else "Приостановлена"
-        csv += f'"{s["name"]}",{s["price"]},{cycles.get(s["cycle"], s["cycle"])},{s["next_payment"]},{s["category"]},{status}\n'
-    
-    file = BufferedInputFile(
-        csv.encode('utf-8-sig'),
-        filename=f"subscriptions_{datetime.now().strftime('%Y%m%d')}.csv"
-    )
-    
-    await callback.message.answer_document(file, caption="📤 Ваши подписки")
-
-    await callback.answer()
+    try:
+        if not rows:
+            await callback.answer("Нет данных для экспорта")
+            return
+        
+        file = FSInputFile(
+            path,
+            filename=f"subscriptions_{datetime.now().strftime('%Y%m%d')}.{FORMATS[fmt]['ext']}"
+        )
+        await callback.message.answer_document(file, caption="📤 Ваши подписки")
+        await callback.answer()
+    finally:
+        os.remove(path)
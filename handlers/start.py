@@ -5,6 +5,7 @@ from datetime import datetime
 
 import database as db
 from keyboards.inline import main_menu
+from services import achievements
 
 router = Router()
 
@@ -27,10 +28,10 @@ async def cmd_start(message: Message):
         message.from_user.username,
         message.from_user.first_name
     )
+    unlocked = await achievements.dispatch(message.from_user.id, "visit")
+    await db.commit_session()
     
-    stats = await db.get_stats(message.from_user.id)
-    upcoming = await db.get_upcoming(message.from_user.id, days=3)
-    trials = await db.get_trials(message.from_user.id)
+    summary = await db.get_home_summary(message.from_user.id)
     
     name = message.from_user.first_name or "друг"
     greeting = get_greeting()
@@ -39,24 +40,22 @@ async def cmd_start(message: Message):
     text += "Я <b>SUBBY</b> — помогу контролировать подписки.\n\n"
     
     text += f"📊 <b>Статистика:</b>\n"
-    text += f"├ Подписок: <b>{stats['count']}</b>\n"
-    text += f"├ В месяц: <b>{int(stats['monthly'])} ₽</b>\n"
-    text += f"└ В год: <b>{int(stats['yearly'])} ₽</b>\n"
+    text += f"├ Подписок: <b>{summary['count']}</b>\n"
+    text += f"├ В месяц: <b>{int(summary['monthly'])} ₽</b>\n"
+    text += f"└ В год: <b>{int(summary['yearly'])} ₽</b>\n"
     
-    if upcoming:
+    if summary['upcoming']:
         text += "\n🔔 <b>Скоро списание:</b>\n"
-        for s in upcoming[:3]:
-            days = (datetime.strptime(s['next_payment'], "%Y-%m-%d") - datetime.now()).days
-            days_text = "сегодня!" if days == 0 else f"через {days} дн."
+        for s in summary['upcoming']:
+            days_text = "сегодня!" if s['days_left'] == 0 else f"через {s['days_left']} дн."
             text += f"• {s['icon']} {s['name']} — {int(s['price'])}₽ ({days_text})\n"
     
-    expiring_trials = [t for t in trials if (datetime.strptime(t['end_date'], "%Y-%m-%d") - datetime.now()).days <= 3]
-    if expiring_trials:
+    if summary['expiring_trials']:
         text += "\n⏱ <b>Триалы заканчиваются:</b>\n"
-        for t in expiring_trials[:2]:
-            days = (datetime.strptime(t['end_date'], "%Y-%m-%d") - datetime.now()).days
-            text += f"• {t['name']} — {days} дн.\n"
+        for t in summary['expiring_trials'][:2]:
+            text += f"• {t['name']} — {t['days_left']} дн.\n"
     
+    text += achievements.format_unlocked(unlocked)
     text += "\n⬇️ Выберите действие:"
     
     await message.answer(text, reply_markup=main_menu(), parse_mode="HTML")
@@ -64,18 +63,17 @@ async def cmd_start(message: Message):
 
 @router.callback_query(F.data == "back_main")
 async def back_to_main(callback: CallbackQuery):
-    stats = await db.get_stats(callback.from_user.id)
-    upcoming = await db.get_upcoming(callback.from_user.id, days=3)
+    summary = await db.get_home_summary(callback.from_user.id)
     
     text = f"🏠 <b>Главное меню</b>\n\n"
     text += f"📊 <b>Статистика:</b>\n"
-    text += f"├ Подписок: <b>{stats['count']}</b>\n"
-    text += f"├ В месяц: <b>{int(stats['monthly'])} ₽</b>\n"
-    text += f"└ В год: <b>{int(stats['yearly'])} ₽</b>\n"
+    text += f"├ Подписок: <b>{summary['count']}</b>\n"
+    text += f"├ В месяц: <b>{int(summary['monthly'])} ₽</b>\n"
+    text += f"└ В год: <b>{int(summary['yearly'])} ₽</b>\n"
     
-    if upcoming:
+    if summary['upcoming']:
         text += "\n🔔 <b>Ближайшие:</b>\n"
-        for s in upcoming[:3]:
+        for s in summary['upcoming']:
             text += f"• {s['icon']} {s['name']} — {int(s['price'])}₽\n"
     
     await callback.message.edit_text(text, reply_markup=main_menu(), parse_mode="HTML")
@@ -101,6 +99,7 @@ async def cmd_help(message: Message):
 • ⏱ Трекер триалов
 • 📊 Аналитика расходов
 • 🏆 Достижения
+• 📥 Импорт — пришлите CSV-файл
 """
     await message.answer(text, reply_markup=main_menu(), parse_mode="HTML")
 
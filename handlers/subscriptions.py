@@ -1,12 +1,19 @@
+import html
+
 from aiogram import Router, F
 from aiogram.types import Message, CallbackQuery
-from aiogram.filters import Command
+from aiogram.filters import Command, CommandObject
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from datetime import datetime, timedelta
 
 import database as db
-from config import SERVICES, CATEGORIES, get_cancel_instruction, ACHIEVEMENTS
+from services.search import search_services
+from services.schedule import days_until
+from services.importer import import_subscriptions
+from services import achievements
+from services.entitlements import can_add_subscription
+from config import SERVICES, CATEGORIES, FREE_SUBS_LIMIT, get_cancel_instruction
 from keyboards.inline import (
     services_keyboard, categories_keyboard, cycle_keyboard,
     subscriptions_list, subscription_actions, confirm_delete,
@@ -30,8 +37,19 @@ class EditPrice(StatesGroup):
 
 # ========== ДОБАВЛЕНИЕ ==========
 
+LIMIT_TEXT = (
+    f"🔒 <b>Достигнут лимит</b>\n\n"
+    f"В бесплатной версии можно вести до {FREE_SUBS_LIMIT} активных подписок.\n"
+    f"Удалите или приостановите ненужные — или поддержите проект и снимите ограничение 💎"
+)
+
+
 @router.callback_query(F.data == "add_sub")
 async def start_add(callback: CallbackQuery, state: FSMContext):
+    if not await can_add_subscription(callback.from_user.id):
+        await callback.message.edit_text(LIMIT_TEXT, reply_markup=main_menu(), parse_mode="HTML")
+        return
+    
     await callback.message.edit_text(
         "➕ <b>Добавление подписки</b>\n\nВыберите сервис или введите свой:",
         reply_markup=services_keyboard(0),
@@ -39,6 +57,51 @@ async def start_add(callback: CallbackQuery, state: FSMContext):
     )
 
 
+@router.message(Command("add"))
+async def cmd_add(message: Message, command: CommandObject, state: FSMContext):
+    query = (command.args or "").strip()
+    
+    if not await can_add_subscription(message.from_user.id):
+        await message.answer(LIMIT_TEXT, reply_markup=main_menu(), parse_mode="HTML")
+        return
+    
+    if not query:
+        await message.answer(
+            "➕ <b>Добавление подписки</b>\n\nВыберите сервис или введите свой:",
+            reply_markup=services_keyboard(0),
+            parse_mode="HTML"
+        )
+        return
+    
+    found = search_services(query, limit=1)
+    if found and found[0]['name'].lower() == query.lower():
+        service_name = found[0]['name']
+        await ask_service_price(message, state, service_name)
+    else:
+        name = query[:50]
+        await state.update_data(name=name, icon="📦", category="other")
+        await state.set_state(AddSub.price)
+        await message.answer(f"💰 Введите стоимость <b>{name}</b> в рублях:", parse_mode="HTML")
+
+
+async def ask_service_price(message: Message, state: FSMContext, service_name: str, edit: bool = False):
+    service = SERVICES.get(service_name, {})
+    await state.update_data(
+        name=service_name,
+        icon=service.get("icon", "📦"),
+        category=service.get("cat", "other")
+    )
+    
+    hint = f"\n💡 Средняя цена: ~{service.get('price', 0)}₽" if service.get('price') else ""
+    text = f"💰 Введите стоимость <b>{service_name}</b> в рублях:{hint}"
+    
+    await state.set_state(AddSub.price)
+    if edit:
+        await message.edit_text(text, parse_mode="HTML")
+    else:
+        await message.answer(text, parse_mode="HTML")
+
+
 @router.callback_query(F.data.startswith("srv_page:"))
 async def services_page(callback: CallbackQuery):
     page = int(callback.data.split(":")[1])
@@ -56,20 +119,7 @@ async def select_service(callback: CallbackQuery, state: FSMContext):
             reply_markup=back_button("main")
         )
     else:
-        service = SERVICES.get(service_name, {})
-        await state.update_data(
-            name=service_name,
-            icon=service.get("icon", "📦"),
-            category=service.get("cat", "other")
-        )
-        
-        hint = f"\n💡 Средняя цена: ~{service.get('price', 0)}₽" if service.get('price') else ""
-        
-        await state.set_state(AddSub.price)
-        await callback.message.edit_text(
-            f"💰 Введите стоимость <b>{service_name}</b> в рублях:{hint}",
-            parse_mode="HTML"
-        )
+        await ask_service_price(callback.message, state, service_name, edit=True)
 
 
 @router.message(AddSub.name)
@@ -170,18 +220,8 @@ async def save_subscription(event, state: FSMContext, is_callback: bool = False)
     
     await state.clear()
     
-    # Проверяем достижения
-    count = await db.count_subscriptions(user_id)
-    
-    if count == 1:
-        if await db.unlock_achievement(user_id, "first_sub"):
-            await db.add_xp(user_id, ACHIEVEMENTS['first_sub']['xp'])
-    elif count == 5:
-        if await db.unlock_achievement(user_id, "five_subs"):
-            await db.add_xp(user_id, ACHIEVEMENTS['five_subs']['xp'])
-    elif count == 10:
-        if await db.unlock_achievement(user_id, "ten_subs"):
-            await db.add_xp(user_id, ACHIEVEMENTS['ten_subs']['xp'])
+    unlocked = await achievements.dispatch(user_id, "sub_added")
+    await db.commit_session()
     
     cycles_ru = {"weekly": "неделя", "monthly": "месяц", "quarterly": "квартал", "yearly": "год"}
     
@@ -191,6 +231,7 @@ async def save_subscription(event, state: FSMContext, is_callback: bool = False)
         f"├ 💰 {data['price']} ₽ / {cycles_ru.get(data['cycle'], data['cycle'])}\n"
         f"└ 📅 Следующий платёж: {data['next_payment']}\n\n"
         f"🔔 Напомню за день до списания!"
+        f"{achievements.format_unlocked(unlocked)}"
     )
     
     if is_callback:
@@ -199,6 +240,49 @@ async def save_subscription(event, state: FSMContext, is_callback: bool = False)
         await event.answer(text, reply_markup=main_menu(), parse_mode="HTML")
 
 
+# ========== ИМПОРТ ==========
+
+MAX_IMPORT_SIZE = 2 * 1024 * 1024
+
+
+@router.message(F.document)
+async def import_document(message: Message):
+    document = message.document
+    
+    if not (document.file_name or "").lower().endswith((".csv", ".txt")):
+        await message.answer("📥 Для импорта пришлите CSV-файл (экспорт SUBBY или выписку банка)")
+        return
+    
+    if document.file_size and document.file_size > MAX_IMPORT_SIZE:
+        await message.answer("❌ Файл слишком большой (максимум 2 МБ)")
+        return
+    
+    await db.ensure_user(message.from_user.id, message.from_user.username, message.from_user.first_name)
+    await db.commit_session()
+    
+    data = await message.bot.download(document)
+    result = await import_subscriptions(message.from_user.id, data.read())
+    if result['added']:
+        await achievements.dispatch(message.from_user.id, "sub_added")
+    await db.commit_session()
+    
+    text = (
+        f"📥 <b>Импорт завершён</b>\n\n"
+        f"✅ Добавлено: <b>{result['added']}</b>\n"
+        f"⏭ Пропущено дубликатов: {result['skipped']}\n"
+    )
+    
+    if result['over_limit']:
+        text += f"🔒 Не добавлено сверх лимита {FREE_SUBS_LIMIT}: {result['over_limit']}\n"
+    
+    if result['error_count']:
+        text += f"⚠️ Ошибок: {result['error_count']}\n"
+        # В ошибках — сырые ячейки файла
+        text += "\n".join(f"• {html.escape(e)}" for e in result['errors'][:5])
+    
+    await message.answer(text, reply_markup=main_menu(), parse_mode="HTML")
+
+
 # ========== ПРОСМОТР ==========
 
 @router.callback_query(F.data == "my_subs")
@@ -298,6 +382,7 @@ async def process_new_price(message: Message, state: FSMContext):
     
     data = await state.get_data()
     await db.update_subscription(data['sub_id'], price=price)
+    await db.commit_session()
     await state.clear()
     
     await message.answer(f"✅ Цена обновлена: <b>{int(price)} ₽</b>", reply_markup=main_menu(), parse_mode="HTML")
@@ -307,6 +392,7 @@ async def process_new_price(message: Message, state: FSMContext):
 async def pause_sub(callback: CallbackQuery):
     sub_id = int(callback.data.split(":")[1])
     await db.update_subscription(sub_id, is_active=0)
+    await db.commit_session()
     await callback.answer("⏸ Подписка приостановлена")
     
     sub = await db.get_subscription(sub_id)
@@ -317,6 +403,7 @@ async def pause_sub(callback: CallbackQuery):
 async def resume_sub(callback: CallbackQuery):
     sub_id = int(callback.data.split(":")[1])
     await db.update_subscription(sub_id, is_active=1)
+    await db.commit_session()
     await callback.answer("▶️ Подписка возобновлена")
     
     await callback.message.edit_reply_markup(reply_markup=subscription_actions(sub_id, True))
@@ -342,17 +429,20 @@ async def ask_delete(callback: CallbackQuery):
 async def confirm_delete_sub(callback: CallbackQuery):
     sub_id = int(callback.data.split(":")[1])
     sub = await db.get_subscription(sub_id)
+    unlocked = []
     
     if sub:
         await db.delete_subscription(sub_id)
         await db.add_saved(callback.from_user.id, sub['price'])
-        
-        # Достижение
-        if await db.unlock_achievement(callback.from_user.id, "first_delete"):
-            await db.add_xp(callback.from_user.id, ACHIEVEMENTS['first_delete']['xp'])
+        unlocked = await achievements.dispatch(callback.from_user.id, "sub_deleted")
+        await db.commit_session()
     
     await callback.answer("🗑 Подписка удалена!", show_alert=True)
-    await callback.message.edit_text("✅ Подписка удалена.", reply_markup=main_menu())
+    await callback.message.edit_text(
+        f"✅ Подписка удалена.{achievements.format_unlocked(unlocked)}",
+        reply_markup=main_menu(),
+        parse_mode="HTML"
+    )
 
 
 # ========== ИНСТРУКЦИЯ ПО ОТМЕНЕ ==========
@@ -397,7 +487,7 @@ async def show_upcoming(callback: CallbackQuery):
     
     for s in upcoming[:10]:
         try:
-            days = (datetime.strptime(s['next_payment'], "%Y-%m-%d") - datetime.now()).days
+            days = days_until(s['next_payment'])
             if days == 0:
                 days_text = "сегодня ⚠️"
             elif days == 1:
@@ -447,9 +537,8 @@ async def check_duplicates(callback: CallbackQuery):
         )
         return
     
-    # Достижение
-    if await db.unlock_achievement(callback.from_user.id, "duplicate_found"):
-        await db.add_xp(callback.from_user.id, ACHIEVEMENTS['duplicate_found']['xp'])
+    unlocked = await achievements.dispatch(callback.from_user.id, "duplicate_found")
+    await db.commit_session()
     
     total_saving = sum(i['price'] for i in issues)
     
@@ -461,6 +550,7 @@ async def check_duplicates(callback: CallbackQuery):
         text += f"💰 Можно сэкономить: {int(issue['price'])}₽/мес\n\n"
     
     text += f"\n<b>Потенциальная экономия: {int(total_saving)}₽/мес ({int(total_saving * 12)}₽/год)</b>"
+    text += achievements.format_unlocked(unlocked)
     
 
     await callback.message.edit_text(text, reply_markup=main_menu(), parse_mode="HTML")
@@ -6,8 +6,8 @@ from aiogram.fsm.state import State, StatesGroup
 from datetime import datetime, timedelta
 
 import database as db
-from config import ACHIEVEMENTS
 from keyboards.inline import trials_list, trial_actions, main_menu
+from services import achievements
 
 router = Router()
 
@@ -106,6 +106,7 @@ async def process_trial_price(message: Message, state: FSMContext):
         end_date=data['end_date'],
         price_after=max(0, price)
     )
+    await db.commit_session()
     
     await state.clear()
     
@@ -159,19 +160,18 @@ async def delete_trial(callback: CallbackQuery):
     trial_id = int(callback.data.split(":")[1])
     trial = await db.get_trial(trial_id)
     
+    unlocked = []
     if trial:
         await db.delete_trial(trial_id)
-        
-        # Достижение
-        if await db.unlock_achievement(callback.from_user.id, "trial_saved"):
-            await db.add_xp(callback.from_user.id, ACHIEVEMENTS['trial_saved']['xp'])
-            await db.add_saved(callback.from_user.id, trial.get('price_after', 0))
+        await db.add_saved(callback.from_user.id, trial.get('price_after', 0))
+        unlocked = await achievements.dispatch(callback.from_user.id, "trial_cancelled")
+        await db.commit_session()
     
     await callback.answer("✅ Триал удалён!", show_alert=True)
     
     trials = await db.get_trials(callback.from_user.id)
     await callback.message.edit_text(
-        "⏱ <b>Пробные периоды</b>",
+        f"⏱ <b>Пробные периоды</b>{achievements.format_unlocked(unlocked)}",
         reply_markup=trials_list(trials),
         parse_mode="HTML"
     )
@@ -196,6 +196,7 @@ async def trial_to_subscription(callback: CallbackQuery):
     )
     
     await db.delete_trial(trial_id)
+    await db.commit_session()
     
     await callback.answer("✅ Добавлено в подписки!", show_alert=True)
     await callback.message.edit_text(
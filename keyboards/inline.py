@@ -1,8 +1,57 @@
+from functools import lru_cache, wraps
+from typing import Tuple
+
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.utils.keyboard import InlineKeyboardBuilder
+from pydantic import ConfigDict, field_serializer
 from config import CATEGORIES, SERVICES
 
+# Статические клавиатуры собираются один раз, а параметризованные
+# кэшируются с ограничением размера. Разметка aiogram изменяема, поэтому
+# из кэша отдаётся замороженная копия: один объект на всех пользователей
+# нельзя случайно поправить под одного из них.
+SERVICES_LIST = list(SERVICES.items())
+SERVICES_PER_PAGE = 8
+SERVICES_PAGES = (len(SERVICES_LIST) + SERVICES_PER_PAGE - 1) // SERVICES_PER_PAGE
+
+
+class FrozenKeyboardButton(InlineKeyboardButton):
+    model_config = ConfigDict(frozen=True)
+
+
+class FrozenKeyboardMarkup(InlineKeyboardMarkup):
+    """Клавиатура только для чтения: присваивание полей — ValidationError,
+    ряды — кортежи. Изменяемая копия:
+    InlineKeyboardMarkup.model_validate(markup.model_dump())"""
+    model_config = ConfigDict(frozen=True)
+
+    inline_keyboard: Tuple[Tuple[FrozenKeyboardButton, ...], ...]
+
+    @field_serializer("inline_keyboard")
+    def _dump_rows(self, rows):
+        # aiogram при отправке обходит только списки и словари
+        return [list(row) for row in rows]
+
+
+def freeze(markup: InlineKeyboardMarkup) -> FrozenKeyboardMarkup:
+    return FrozenKeyboardMarkup(inline_keyboard=tuple(
+        tuple(FrozenKeyboardButton(**button.model_dump(exclude_none=True)) for button in row)
+        for row in markup.inline_keyboard
+    ))
+
 
+def cached_markup(maxsize):
+    """lru_cache для клавиатур: кэширует и отдаёт замороженную разметку"""
+    def decorator(func):
+        @lru_cache(maxsize=maxsize)
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            return freeze(func(*args, **kwargs))
+        return wrapper
+    return decorator
+
+
+@cached_markup(maxsize=None)
 def main_menu() -> InlineKeyboardMarkup:
     builder = InlineKeyboardBuilder()
     
@@ -24,20 +73,19 @@ def main_menu() -> InlineKeyboardMarkup:
     return builder.as_markup()
 
 
+@cached_markup(maxsize=32)
 def back_button(to: str = "main") -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text="◀️ Назад", callback_data=f"back_{to}")]
     ])
 
 
+@cached_markup(maxsize=SERVICES_PAGES + 1)
 def services_keyboard(page: int = 0) -> InlineKeyboardMarkup:
     builder = InlineKeyboardBuilder()
     
-    services = list(SERVICES.items())
-    per_page = 8
-    start = page * per_page
-    end = start + per_page
-    page_services = services[start:end]
+    start = page * SERVICES_PER_PAGE
+    page_services = SERVICES_LIST[start:start + SERVICES_PER_PAGE]
     
     for name, data in page_services:
         builder.button(
@@ -52,19 +100,20 @@ def services_keyboard(page: int = 0) -> InlineKeyboardMarkup:
     if page > 0:
         nav.append(InlineKeyboardButton(text="◀️", callback_data=f"srv_page:{page-1}"))
     
-    total_pages = (len(services) + per_page - 1) // per_page
-    if page < total_pages - 1:
+    if page < SERVICES_PAGES - 1:
         nav.append(InlineKeyboardButton(text="▶️", callback_data=f"srv_page:{page+1}"))
     
     if nav:
         builder.row(*nav)
     
+    builder.row(InlineKeyboardButton(text="🔎 Поиск", switch_inline_query_current_chat=""))
     builder.row(InlineKeyboardButton(text="✏️ Ввести своё", callback_data="srv:custom"))
     builder.row(InlineKeyboardButton(text="◀️ Назад", callback_data="back_main"))
     
     return builder.as_markup()
 
 
+@cached_markup(maxsize=None)
 def categories_keyboard() -> InlineKeyboardMarkup:
     builder = InlineKeyboardBuilder()
     
@@ -75,6 +124,7 @@ def categories_keyboard() -> InlineKeyboardMarkup:
     return builder.as_markup()
 
 
+@cached_markup(maxsize=None)
 def cycle_keyboard() -> InlineKeyboardMarkup:
     builder = InlineKeyboardBuilder()
     
@@ -107,6 +157,7 @@ def subscriptions_list(subs: list) -> InlineKeyboardMarkup:
     return builder.as_markup()
 
 
+@cached_markup(maxsize=1024)
 def subscription_actions(sub_id: int, is_active: bool = True) -> InlineKeyboardMarkup:
     builder = InlineKeyboardBuilder()
     
@@ -124,6 +175,7 @@ def subscription_actions(sub_id: int, is_active: bool = True) -> InlineKeyboardM
     return builder.as_markup()
 
 
+@cached_markup(maxsize=256)
 def confirm_delete(sub_id: int) -> InlineKeyboardMarkup:
     builder = InlineKeyboardBuilder()
     builder.row(
@@ -159,6 +211,7 @@ def trials_list(trials: list) -> InlineKeyboardMarkup:
     return builder.as_markup()
 
 
+@cached_markup(maxsize=256)
 def trial_actions(trial_id: int) -> InlineKeyboardMarkup:
     builder = InlineKeyboardBuilder()
     builder.row(InlineKeyboardButton(text="✅ Отменил — удалить", callback_data=f"del_trial:{trial_id}"))
@@ -167,6 +220,7 @@ def trial_actions(trial_id: int) -> InlineKeyboardMarkup:
     return builder.as_markup()
 
 
+@cached_markup(maxsize=None)
 def analytics_menu() -> InlineKeyboardMarkup:
     builder = InlineKeyboardBuilder()
     builder.row(InlineKeyboardButton(text="📊 По категориям", callback_data="analytics:cats"))
@@ -176,18 +230,34 @@ def analytics_menu() -> InlineKeyboardMarkup:
     return builder.as_markup()
 
 
+@cached_markup(maxsize=64)
 def settings_keyboard(notify_on: bool, notify_days: int) -> InlineKeyboardMarkup:
     builder = InlineKeyboardBuilder()
     
     status = "✅ Вкл" if notify_on else "❌ Выкл"
     builder.row(InlineKeyboardButton(text=f"🔔 Уведомления: {status}", callback_data="toggle_notify"))
     builder.row(InlineKeyboardButton(text=f"📅 За {notify_days} дн. до платежа", callback_data="set_days"))
-    builder.row(InlineKeyboardButton(text="📤 Экспорт в CSV", callback_data="export"))
+    builder.row(InlineKeyboardButton(text="📤 Экспорт", callback_data="export"))
     builder.row(InlineKeyboardButton(text="◀️ Назад", callback_data="back_main"))
     
     return builder.as_markup()
 
 
+@cached_markup(maxsize=None)
+def export_keyboard(formats: tuple) -> InlineKeyboardMarkup:
+    builder = InlineKeyboardBuilder()
+    
+    names = {"csv": "📄 CSV", "jsonl": "🧾 JSON Lines", "xlsx": "📊 Excel"}
+    for fmt in formats:
+        builder.button(text=names.get(fmt, fmt), callback_data=f"export:{fmt}")
+    
+    builder.adjust(3)
+    builder.row(InlineKeyboardButton(text="◀️ Назад", callback_data="settings"))
+    
+    return builder.as_markup()
+
+
+@cached_markup(maxsize=None)
 def notify_days_keyboard() -> InlineKeyboardMarkup:
     builder = InlineKeyboardBuilder()
     
@@ -0,0 +1,92 @@
+"""Задержка запросов во время онлайн-копии базы.
+
+Заполняет временную базу, гоняет типичную нагрузку (главный экран +
+правка подписки) без копии и во время копии — одним шагом и по
+STEP_PAGES страниц — и печатает p50 / p99 / max.
+
+    python scripts/bench_backup.py [пользователей] [подписок на пользователя]
+"""
+import asyncio
+import os
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database as db
+from services import backup
+
+USERS = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+SUBS_PER_USER = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+RUN_SECONDS = 3
+
+
+def populate():
+    conn = sqlite3.connect(db.DB_PATH)
+    conn.executemany(
+        "INSERT INTO users (user_id, first_name) VALUES (?, 'bench')",
+        [(user_id,) for user_id in range(1, USERS + 1)]
+    )
+    conn.executemany(
+        "INSERT INTO subscriptions (user_id, name, price, next_payment, billing_day) VALUES (?, ?, 100, '2030-01-01', 1)",
+        [(user_id, f"{'S' * 200}{i}") for user_id in range(1, USERS + 1) for i in range(SUBS_PER_USER)]
+    )
+    conn.commit()
+    conn.close()
+
+
+async def load(stop: asyncio.Event) -> list:
+    latencies = []
+    i = 0
+    while not stop.is_set():
+        i += 1
+        started = time.perf_counter()
+        await db.get_home_summary(i % USERS + 1)
+        await db.update_subscription(i * 7 % (USERS * SUBS_PER_USER) + 1, price=i % 500 + 1)
+        latencies.append((time.perf_counter() - started) * 1000)
+    return latencies
+
+
+def report(title: str, latencies: list):
+    latencies.sort()
+    print(
+        f"{title:<24} n={len(latencies):<6} p50={statistics.median(latencies):.2f}ms "
+        f"p99={latencies[int(len(latencies) * 0.99)]:.2f}ms max={latencies[-1]:.2f}ms"
+    )
+
+
+async def measure(title: str, during=None):
+    stop = asyncio.Event()
+    task = asyncio.create_task(load(stop))
+    started = time.perf_counter()
+    if during is not None:
+        await during()
+        title = f"{title} ({time.perf_counter() - started:.2f}s)"
+    await asyncio.sleep(max(0, RUN_SECONDS - (time.perf_counter() - started)))
+    stop.set()
+    report(title, await task)
+
+
+async def main():
+    directory = tempfile.mkdtemp()
+    db.DB_PATH = os.path.join(directory, "subtracker.db")
+    backup.BACKUP_DIR = os.path.join(directory, "backups")
+
+    await db.init_db()
+    populate()
+    print(f"DB {os.path.getsize(db.DB_PATH) / 2 ** 20:.1f} MB, {USERS} users")
+
+    await measure("idle")
+    step_pages = backup.STEP_PAGES
+    for pages in (-1, step_pages):
+        backup.STEP_PAGES = pages
+        await measure(f"backup pages={pages}", backup.run_backup)
+
+    await db.close_writer()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,39 @@
+"""Цена сборки инлайн-клавиатур: без кэша и из кэша.
+
+Для каждой клавиатуры печатает время одного вызова исходной функции
+(сборка + заморозка) и вызова через кэш.
+
+    python scripts/bench_keyboards.py [повторов]
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from keyboards import inline
+
+NUMBER = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+
+CASES = [
+    ("main_menu", inline.main_menu, ()),
+    ("services_keyboard(1)", inline.services_keyboard, (1,)),
+    ("subscription_actions", inline.subscription_actions, (42, True)),
+    ("settings_keyboard", inline.settings_keyboard, (True, 3)),
+    ("notify_days_keyboard", inline.notify_days_keyboard, ()),
+]
+
+
+def per_call(func, args) -> float:
+    return timeit.timeit(lambda: func(*args), number=NUMBER) / NUMBER * 1e6
+
+
+def main():
+    for title, cached, args in CASES:
+        uncached = per_call(cached.__wrapped__, args)
+        hit = per_call(cached, args)
+        print(f"{title:<24} {uncached:8.1f} us -> {hit:.2f} us")
+
+
+if __name__ == "__main__":
+    main()
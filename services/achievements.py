@@ -0,0 +1,93 @@
+import logging
+from typing import Callable, Dict, List
+
+import database as db
+from config import ACHIEVEMENTS
+from services.cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+# Правило: (снимок пользователя, событие) -> выполнено ли условие
+Rule = Callable[[dict, str], bool]
+
+RULES: Dict[str, Rule] = {
+    "first_sub": lambda s, e: s['subs'] >= 1,
+    "five_subs": lambda s, e: s['subs'] >= 5,
+    "ten_subs": lambda s, e: s['subs'] >= 10,
+    "first_delete": lambda s, e: e == "sub_deleted",
+    "saved_500": lambda s, e: s['total_saved'] >= 500,
+    "saved_1000": lambda s, e: s['total_saved'] >= 1000,
+    "duplicate_found": lambda s, e: e == "duplicate_found",
+    "trial_saved": lambda s, e: e == "trial_cancelled",
+    "week_streak": lambda s, e: s['streak'] >= 7,
+}
+
+# Какие правила проверять на событие
+EVENT_RULES = {
+    "sub_added": ["first_sub", "five_subs", "ten_subs"],
+    "sub_deleted": ["first_delete", "saved_500", "saved_1000"],
+    "trial_cancelled": ["trial_saved", "saved_500", "saved_1000"],
+    "duplicate_found": ["duplicate_found"],
+    "visit": ["week_streak"],
+}
+
+# Правила, которые можно проверить по одному снимку, без события
+STATE_RULES = ["first_sub", "five_subs", "ten_subs", "saved_500", "saved_1000", "week_streak"]
+
+# Снимок пользователя живёт, пока не изменилась версия его данных
+_snapshots = LRUCache(maxsize=10000, ttl=600)
+
+
+async def get_snapshot(user_id: int) -> dict:
+    version = db.get_data_version(user_id)
+    cached = _snapshots.get(user_id)
+    if cached and cached[0] == version:
+        return cached[1]
+
+    snapshot = await db.get_achievement_snapshot(user_id)
+    _snapshots.set(user_id, (version, snapshot))
+    return snapshot
+
+
+def evaluate(snapshot: dict, event: str, rule_ids: List[str]) -> List[str]:
+    return [
+        ach_id for ach_id in rule_ids
+        if ach_id not in snapshot['unlocked'] and RULES[ach_id](snapshot, event)
+    ]
+
+
+async def dispatch(user_id: int, event: str) -> List[str]:
+    """Обработать доменное событие; возвращает новые достижения"""
+    rule_ids = EVENT_RULES.get(event, [])
+    if not rule_ids:
+        return []
+
+    candidates = evaluate(await get_snapshot(user_id), event, rule_ids)
+    if not candidates:
+        return []
+
+    unlocked = await db.grant_achievements([(user_id, ach_id, ACHIEVEMENTS[ach_id]['xp']) for ach_id in candidates])
+    _snapshots.pop(user_id)
+    return [ach_id for _, ach_id in unlocked]
+
+
+def format_unlocked(ach_ids: List[str]) -> str:
+    return "".join(
+        f"\n🏆 Новое достижение: {ACHIEVEMENTS[a]['icon']} <b>{ACHIEVEMENTS[a]['title']}</b> (+{ACHIEVEMENTS[a]['xp']} XP)"
+        for a in ach_ids
+    )
+
+
+async def backfill_achievements():
+    """Выдать достижения по состоянию всем пользователям одной транзакцией"""
+    logger.info("🏆 Backfilling achievements...")
+
+    grants = []
+    for snapshot in await db.get_all_achievement_snapshots():
+        for ach_id in evaluate(snapshot, "", STATE_RULES):
+            grants.append((snapshot['user_id'], ach_id, ACHIEVEMENTS[ach_id]['xp']))
+
+    unlocked = await db.grant_achievements(grants) if grants else []
+    _snapshots.clear()
+
+    logger.info(f"✅ Backfilled {len(unlocked)} achievements")
@@ -0,0 +1,159 @@
+import asyncio
+import logging
+import os
+import shutil
+import time
+from datetime import datetime
+from typing import List, Optional
+
+import database as db
+from config import BACKUP_DIR, BACKUP_KEEP
+
+logger = logging.getLogger(__name__)
+
+# Страниц за шаг копирования и пауза между шагами: писатели и диск
+# получают окно между шагами
+STEP_PAGES = 256
+STEP_SLEEP = 0.005
+
+STAMP_FORMAT = "%Y%m%d-%H%M%S"
+
+
+class BackupError(Exception):
+    pass
+
+
+def list_backups() -> List[str]:
+    """Готовые копии, от старых к новым"""
+    if not os.path.isdir(BACKUP_DIR):
+        return []
+    return sorted(
+        os.path.join(BACKUP_DIR, name) for name in os.listdir(BACKUP_DIR)
+        if not name.endswith(".tmp") and os.path.isdir(os.path.join(BACKUP_DIR, name))
+    )
+
+
+def shard_file(directory: str, shard: int) -> str:
+    return os.path.join(directory, os.path.basename(db.shard_path(shard)))
+
+
+async def check_integrity(path: str):
+    async with db.connect(path) as conn:
+        cursor = await conn.execute("PRAGMA integrity_check")
+        result = [row[0] for row in await cursor.fetchall()]
+    if result != ["ok"]:
+        raise BackupError(f"{path}: {'; '.join(result[:5])}")
+
+
+async def backup_shard(shard: int, directory: str) -> int:
+    """Скопировать шард по STEP_PAGES страниц; возвращает число страниц.
+
+    Шаги идут в потоке соединения, event loop их не ждёт.
+    """
+    if not os.path.exists(db.shard_path(shard)):
+        raise BackupError(f"Database not found: {db.shard_path(shard)}")
+
+    path = shard_file(directory, shard)
+    pages = 0
+
+    def progress(status, remaining, total):
+        nonlocal pages
+        pages = total
+
+    async with db.connect(db.shard_path(shard)) as source, db.connect(path) as target:
+        # Открытая читающая транзакция держит снимок WAL на все шаги: чужие
+        # записи не начинают копирование заново, а писатели его не ждут
+        await source.execute("BEGIN")
+        await source.execute("SELECT COUNT(*) FROM sqlite_master")
+        await source.backup(target, pages=STEP_PAGES, progress=progress, sleep=STEP_SLEEP)
+        await source.rollback()
+        # Копия — один самодостаточный файл, без -wal
+        await target.execute("PRAGMA journal_mode = DELETE")
+
+    await check_integrity(path)
+    return pages
+
+
+def prune_backups():
+    """Оставить BACKUP_KEEP последних копий и убрать недописанные"""
+    for path in list_backups()[:-BACKUP_KEEP]:
+        shutil.rmtree(path, ignore_errors=True)
+    for name in os.listdir(BACKUP_DIR):
+        if name.endswith(".tmp"):
+            shutil.rmtree(os.path.join(BACKUP_DIR, name), ignore_errors=True)
+
+
+async def run_backup() -> Optional[str]:
+    """Онлайн-копия всех шардов в BACKUP_DIR/<время>; возвращает её путь"""
+    started = time.perf_counter()
+    name = datetime.now().strftime(STAMP_FORMAT)
+    directory = os.path.join(BACKUP_DIR, name)
+
+    # Копия появляется под своим именем, только если все шарды прошли проверку
+    tmp = f"{directory}.tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+
+    pages = 0
+    try:
+        for shard in db.all_shards():
+            pages += await backup_shard(shard, tmp)
+    except BackupError as e:
+        logger.error(f"❌ Backup {name} failed: {e}")
+        shutil.rmtree(tmp, ignore_errors=True)
+        return None
+    except Exception:
+        logger.exception(f"❌ Backup {name} failed")
+        shutil.rmtree(tmp, ignore_errors=True)
+        return None
+
+    os.replace(tmp, directory)
+    prune_backups()
+    logger.info(f"💾 Backup {name}: {pages} pages in {time.perf_counter() - started:.1f}s")
+    return directory
+
+
+async def restore_backup(name: str = "latest") -> str:
+    """Вернуть базу из копии (имя каталога или latest).
+
+    Процессы бота должны быть остановлены: открытые соединения
+    продолжили бы писать поверх восстановленных данных.
+    """
+    backups = list_backups()
+    if name == "latest":
+        if not backups:
+            raise BackupError(f"No backups in {BACKUP_DIR}")
+        directory = backups[-1]
+    else:
+        directory = name if os.path.isdir(name) else os.path.join(BACKUP_DIR, name)
+
+    files = {shard: shard_file(directory, shard) for shard in db.all_shards()}
+    missing = [path for path in files.values() if not os.path.exists(path)]
+    if missing:
+        raise BackupError(f"Backup is incomplete: {', '.join(missing)}")
+
+    # Сначала проверяем все шарды, чтобы не восстановить базу наполовину
+    for path in files.values():
+        await check_integrity(path)
+
+    for shard, path in files.items():
+        os.makedirs(os.path.dirname(db.shard_path(shard)) or ".", exist_ok=True)
+        # Через backup API: он корректно перезаписывает базу вместе с её WAL
+        async with db.connect(path) as source, db.connect(db.shard_path(shard)) as target:
+            await source.backup(target)
+            await target.execute("PRAGMA journal_mode = WAL")
+
+    logger.info(f"♻️ Restored {directory}")
+    return directory
+
+
+def run_command(command: str, args: List[str]) -> int:
+    """python bot.py backup | restore [имя копии|latest]"""
+    try:
+        if command == "backup":
+            return 0 if asyncio.run(run_backup()) else 1
+        asyncio.run(restore_backup(args[0] if args else "latest"))
+    except BackupError as e:
+        logger.error(f"❌ {e}")
+        return 1
+    return 0
@@ -0,0 +1,87 @@
+import logging
+import time
+from datetime import datetime
+from typing import Optional
+
+import database as db
+from config import FREE_SUBS_LIMIT
+from services.cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+# Запись живёт не дольше часа и не дольше окончания премиума
+MAX_TTL = 3600
+SWEEP_BATCH = 500
+
+# user_id -> (версия данных, premium_until или None, число активных подписок)
+_entitlements = LRUCache(maxsize=100000)
+
+
+def parse_until(value: Optional[str]) -> Optional[datetime]:
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value, "%Y-%m-%d %H:%M:%S")
+    except ValueError:
+        return None
+
+
+async def get_entitlement(user_id: int) -> dict:
+    version = db.get_data_version(user_id)
+    cached = _entitlements.get(user_id)
+    if cached is None or cached[0] != version:
+        row = await db.get_entitlement_row(user_id)
+        until = parse_until(row['premium_until']) if row and row['is_premium'] else None
+        cached = (version, until, row['subs'] if row else 0)
+
+        ttl = MAX_TTL
+        if until:
+            ttl = max(0, min(ttl, (until - datetime.now()).total_seconds()))
+        _entitlements.set(user_id, cached, ttl=ttl)
+
+    _, until, subs = cached
+    premium = until is not None and until > datetime.now()
+    return {
+        "premium": premium,
+        "premium_until": until.strftime("%Y-%m-%d %H:%M:%S") if premium else None,
+        "subs": subs,
+        "subs_limit": None if premium else FREE_SUBS_LIMIT,
+    }
+
+
+async def is_premium(user_id: int) -> bool:
+    return (await get_entitlement(user_id))['premium']
+
+
+async def subs_left(user_id: int) -> Optional[int]:
+    """Сколько ещё подписок можно добавить; None — без ограничений"""
+    entitlement = await get_entitlement(user_id)
+    if entitlement['premium']:
+        return None
+    return max(0, FREE_SUBS_LIMIT - entitlement['subs'])
+
+
+async def can_add_subscription(user_id: int) -> bool:
+    left = await subs_left(user_id)
+    return left is None or left > 0
+
+
+async def expire_premiums():
+    """Снять истёкший премиум пачками по индексу premium_until, шарды параллельно"""
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    started = time.perf_counter()
+    expired = sum(await db.gather_shards(expire_shard_premiums, now))
+
+    if expired:
+        logger.info(f"⏳ Expired premium for {expired} users in {time.perf_counter() - started:.2f}s")
+
+
+async def expire_shard_premiums(shard: int, now: str) -> int:
+    expired = 0
+    while batch := await db.expire_premium_batch(now, SWEEP_BATCH, shard):
+        for user_id in batch:
+            _entitlements.pop(user_id)
+        expired += len(batch)
+        if len(batch) < SWEEP_BATCH:
+            break
+    return expired
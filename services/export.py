@@ -0,0 +1,152 @@
+import asyncio
+import csv
+import io
+import json
+import os
+import tempfile
+from importlib.util import find_spec
+from typing import AsyncIterator, List, Tuple
+
+# openpyxl тяжёлый: проверяем наличие, а импортируем при первой выгрузке
+XLSX_ENABLED = find_spec("openpyxl") is not None
+
+FORMATS = {
+    "csv": {"media_type": "text/csv; charset=utf-8", "ext": "csv"},
+    "jsonl": {"media_type": "application/x-ndjson", "ext": "jsonl"},
+    "xlsx": {"media_type": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", "ext": "xlsx"},
+}
+
+CYCLES_RU = {"weekly": "Неделя", "monthly": "Месяц", "quarterly": "Квартал", "yearly": "Год"}
+
+# (поле, заголовок)
+FIELDS = [
+    ("name", "Название"),
+    ("price", "Цена"),
+    ("cycle", "Период"),
+    ("next_payment", "Следующий платёж"),
+    ("category", "Категория"),
+    ("is_active", "Статус"),
+]
+ADMIN_FIELDS = [("user_id", "Пользователь"), ("id", "ID")] + FIELDS
+
+CHUNK_SIZE = 64 * 1024
+# Строк XLSX на один проход в рабочем потоке
+XLSX_BATCH = 2000
+
+
+class ExportError(Exception):
+    pass
+
+
+def available_formats() -> List[str]:
+    return [fmt for fmt in FORMATS if fmt != "xlsx" or XLSX_ENABLED]
+
+
+def table_row(row: dict, fields) -> list:
+    values = []
+    for field, _ in fields:
+        value = row.get(field)
+        if field == "cycle":
+            value = CYCLES_RU.get(value, value)
+        elif field == "is_active":
+            value = "Активна" if value else "Приостановлена"
+        values.append(value)
+    return values
+
+
+async def iter_csv(rows: AsyncIterator[dict], fields) -> AsyncIterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    # BOM, чтобы Excel открыл UTF-8 без вопросов
+    buffer.write("\ufeff")
+    writer.writerow([title for _, title in fields])
+
+    async for row in rows:
+        writer.writerow(table_row(row, fields))
+        if buffer.tell() >= CHUNK_SIZE:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+
+    yield buffer.getvalue().encode("utf-8")
+
+
+async def iter_jsonl(rows: AsyncIterator[dict], fields) -> AsyncIterator[bytes]:
+    chunk = []
+    size = 0
+
+    async for row in rows:
+        line = json.dumps({field: row.get(field) for field, _ in fields}, ensure_ascii=False) + "\n"
+        chunk.append(line)
+        size += len(line)
+        if size >= CHUNK_SIZE:
+            yield "".join(chunk).encode("utf-8")
+            chunk, size = [], 0
+
+    yield "".join(chunk).encode("utf-8")
+
+
+def append_rows(sheet, batch: list):
+    for values in batch:
+        sheet.append(values)
+
+
+async def iter_xlsx(rows: AsyncIterator[dict], fields) -> AsyncIterator[bytes]:
+    """XLSX — zip-архив: строки пишутся во временный файл в режиме write_only.
+    
+    Работа openpyxl (сериализация строк и сжатие) идёт в рабочем потоке
+    пачками по XLSX_BATCH строк: выгрузка всей базы не держит event loop.
+    """
+    if not XLSX_ENABLED:
+        raise ExportError("openpyxl not installed")
+
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet("Подписки")
+    batch = [[title for _, title in fields]]
+
+    async for row in rows:
+        batch.append(table_row(row, fields))
+        if len(batch) >= XLSX_BATCH:
+            await asyncio.to_thread(append_rows, sheet, batch)
+            batch = []
+    await asyncio.to_thread(append_rows, sheet, batch)
+
+    fd, path = tempfile.mkstemp(suffix=".xlsx")
+    os.close(fd)
+    try:
+        await asyncio.to_thread(workbook.save, path)
+        with open(path, "rb") as f:
+            while chunk := f.read(CHUNK_SIZE):
+                yield chunk
+    finally:
+        os.remove(path)
+
+
+WRITERS = {"csv": iter_csv, "jsonl": iter_jsonl, "xlsx": iter_xlsx}
+
+
+def stream_export(rows: AsyncIterator[dict], fmt: str, admin: bool = False) -> AsyncIterator[bytes]:
+    if fmt not in available_formats():
+        raise ExportError(f"Unsupported format: {fmt}")
+    return WRITERS[fmt](rows, ADMIN_FIELDS if admin else FIELDS)
+
+
+async def export_to_file(rows: AsyncIterator[dict], fmt: str) -> Tuple[str, int]:
+    """Выгрузить во временный файл; возвращает путь и число строк"""
+    counted = 0
+
+    async def counting():
+        nonlocal counted
+        async for row in rows:
+            counted += 1
+            yield row
+
+    fd, path = tempfile.mkstemp(suffix=f".{FORMATS[fmt]['ext']}")
+    with os.fdopen(fd, "wb") as f:
+        async for chunk in stream_export(counting(), fmt):
+            f.write(chunk)
+
+    return path, counted
@@ -0,0 +1,223 @@
+import csv
+import io
+from datetime import date, datetime
+from typing import List, Optional, Tuple
+
+import database as db
+from config import CATEGORIES, SERVICES
+from services.entitlements import subs_left
+from services.schedule import advance
+from services.search import normalize, search_services
+
+MAX_IMPORT_ROWS = 10000
+
+# Заголовки нашего экспорта, англоязычные и типичные для банковских выписок
+COLUMN_ALIASES = {
+    "name": ["name", "название", "сервис", "подписка", "описание", "description",
+             "merchant", "получатель", "назначение платежа"],
+    "price": ["price", "цена", "сумма", "amount", "сумма операции", "сумма платежа", "сумма в валюте счета"],
+    "cycle": ["cycle", "период", "периодичность"],
+    "next_payment": ["next_payment", "следующий платёж", "следующий платеж", "дата", "date",
+                     "дата операции", "дата платежа"],
+    "category": ["category", "категория"],
+    "status": ["status", "статус", "is_active"],
+}
+
+CYCLE_ALIASES = {
+    "weekly": "weekly", "неделя": "weekly", "еженедельно": "weekly",
+    "monthly": "monthly", "месяц": "monthly", "ежемесячно": "monthly",
+    "quarterly": "quarterly", "квартал": "quarterly",
+    "yearly": "yearly", "год": "yearly", "ежегодно": "yearly",
+}
+
+DATE_FORMATS = ["%Y-%m-%d", "%d.%m.%Y", "%d.%m.%y", "%d/%m/%Y"]
+
+# Длинные названия проверяем первыми: "Яндекс Музыка" раньше "Яндекс"
+CATALOG = sorted(((normalize(name), name) for name in SERVICES), key=lambda x: -len(x[0]))
+
+
+def decode(data: bytes) -> str:
+    """Выписки российских банков часто приходят в cp1251"""
+    for encoding in ("utf-8-sig", "cp1251"):
+        try:
+            return data.decode(encoding)
+        except UnicodeDecodeError:
+            continue
+    return data.decode("utf-8", errors="replace")
+
+
+def map_columns(header: List[str]) -> dict:
+    columns = {}
+    for i, title in enumerate(header):
+        title = normalize(title)
+        for field, aliases in COLUMN_ALIASES.items():
+            if field not in columns and title in (normalize(a) for a in aliases):
+                columns[field] = i
+    return columns
+
+
+def parse_price(value: str) -> float:
+    cleaned = value.replace("\xa0", "").replace(" ", "").replace("₽", "")
+    
+    # Десятичный разделитель — последний из точки и запятой, прочие
+    # разделяют тысячи: "1,234.56", "1.234,56", "1,234,567". Одиночный
+    # разделитель перед ровно тремя цифрами — тоже тысячи: "12,500"
+    point = max(cleaned.rfind(","), cleaned.rfind("."))
+    if point >= 0:
+        whole, fraction = cleaned[:point], cleaned[point + 1:]
+        digits = whole.replace(",", "").replace(".", "")
+        if cleaned[point] in whole or (digits == whole and len(fraction) == 3):
+            cleaned = digits + fraction
+        else:
+            cleaned = f"{digits}.{fraction}"
+    
+    try:
+        # Списания в выписке отрицательные
+        price = abs(float(cleaned))
+    except ValueError:
+        raise ValueError(f"неверная сумма «{value}»")
+    if price <= 0 or price > 1_000_000:
+        raise ValueError(f"неверная сумма «{value}»")
+    return round(price, 2)
+
+
+def parse_date(value: str) -> date:
+    value = value.strip().split(" ")[0]
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, fmt).date()
+        except ValueError:
+            continue
+    raise ValueError(f"неверная дата «{value}»")
+
+
+def match_service(name: str) -> Optional[str]:
+    """Сопоставить строку выписки с каталогом сервисов"""
+    norm = normalize(name)
+
+    for catalog_norm, catalog_name in CATALOG:
+        if norm == catalog_norm:
+            return catalog_name
+
+    for catalog_norm, catalog_name in CATALOG:
+        if catalog_norm in norm:
+            return catalog_name
+
+    found = search_services(name, limit=1)
+    if found and normalize(found[0]['name']).startswith(norm):
+        return found[0]['name']
+
+    return None
+
+
+def parse_row(row: List[str], columns: dict, today: date) -> dict:
+    def cell(field):
+        i = columns.get(field)
+        return row[i].strip() if i is not None and i < len(row) else ""
+
+    name = cell("name")[:50]
+    if not name:
+        raise ValueError("нет названия")
+
+    price = parse_price(cell("price"))
+    cycle = CYCLE_ALIASES.get(normalize(cell("cycle")), "monthly")
+
+    next_payment = parse_date(cell("next_payment")) if cell("next_payment") else today
+    if next_payment < today:
+        # Дата из выписки — прошедшее списание, переносим на следующий период
+        next_payment = advance(next_payment, cycle, today)
+
+    service_name = match_service(name)
+    service = SERVICES.get(service_name, {})
+
+    category = cell("category")
+    if category not in CATEGORIES:
+        category = service.get("cat", "other")
+
+    return {
+        "name": service_name or name,
+        "price": price,
+        "cycle": cycle,
+        "next_payment": next_payment.strftime("%Y-%m-%d"),
+        "category": category,
+        "icon": service.get("icon", "📦"),
+        "is_active": 0 if normalize(cell("status")) in ("приостановлена", "0", "paused") else 1,
+    }
+
+
+def parse_csv(text: str) -> Tuple[List[dict], List[str]]:
+    """Разобрать CSV; возвращает валидные строки и ошибки"""
+    sample = text[:4096]
+    try:
+        dialect = csv.Sniffer().sniff(sample, delimiters=",;\t")
+    except csv.Error:
+        dialect = csv.excel
+
+    reader = csv.reader(io.StringIO(text), dialect)
+    header = next(reader, None)
+    if not header:
+        return [], ["Пустой файл"]
+
+    columns = map_columns(header)
+    if "name" not in columns or "price" not in columns:
+        return [], ["Не найдены колонки с названием и суммой"]
+
+    today = date.today()
+    rows, errors = [], []
+
+    for line, row in enumerate(reader, start=2):
+        if not any(cell.strip() for cell in row):
+            continue
+        if len(rows) >= MAX_IMPORT_ROWS:
+            errors.append(f"Больше {MAX_IMPORT_ROWS} строк, остальные пропущены")
+            break
+        try:
+            rows.append(parse_row(row, columns, today))
+        except ValueError as e:
+            errors.append(f"Строка {line}: {e}")
+
+    return rows, errors
+
+
+def dedupe(rows: List[dict], existing: set) -> Tuple[List[dict], int]:
+    """Одна подписка на название: повторные строки выписки и уже добавленные пропускаем"""
+    unique = {}
+    for row in rows:
+        key = row['name'].lower()
+        if key in existing:
+            continue
+        # Из повторяющихся списаний берём самое позднее
+        if key not in unique or row['next_payment'] > unique[key]['next_payment']:
+            unique[key] = row
+
+    return list(unique.values()), len(rows) - len(unique)
+
+
+async def import_subscriptions(user_id: int, data: bytes) -> dict:
+    rows, errors = parse_csv(decode(data))
+
+    existing = {s['name'].lower() for s in await db.get_subscriptions(user_id, active_only=False)}
+    rows, skipped = dedupe(rows, existing)
+    rows, over_limit = apply_limit(rows, await subs_left(user_id))
+
+    added = await db.bulk_add_subscriptions(user_id, rows) if rows else 0
+
+    return {
+        "added": added, "skipped": skipped, "over_limit": over_limit,
+        "errors": errors[:10], "error_count": len(errors),
+    }
+
+
+def apply_limit(rows: List[dict], left: Optional[int]) -> Tuple[List[dict], int]:
+    """Бесплатный лимит касается только активных подписок"""
+    if left is None:
+        return rows, 0
+
+    kept = []
+    for row in rows:
+        if row['is_active']:
+            if left <= 0:
+                continue
+            left -= 1
+        kept.append(row)
+    return kept, len(rows) - len(kept)
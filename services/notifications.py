@@ -1,99 +1,186 @@
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from datetime import datetime
+from datetime import date, datetime
+import asyncio
 import logging
 
 import database as db
+from config import BACKUP_KEEP, REPLICA_INTERVAL
+from services.population import refresh_population_stats
+from services.achievements import backfill_achievements
+from services.entitlements import expire_premiums
+from services.backup import run_backup
+from services.schedule import days_until
 
 logger = logging.getLogger(__name__)
 
+BATCH_SIZE = 200
+DRAIN_TIMEOUT = 10
 
-async def send_subscription_notifications(bot):
-    """Отправка уведомлений о платежах"""
-    logger.info("🔔 Checking subscription notifications...")
+# Остановка: прогоны дописывают текущее сообщение и выходят, сохранив курсор
+_stopping = asyncio.Event()
+_active_runs = set()
+
+# Идущие прогоны: (вид, шард) -> id прогона. Второй прогон того же вида
+# по шарду прошёл бы те же строки очереди и отправил их повторно
+_claimed = {}
+
+
+def subscription_text(notif: dict) -> str:
+    days = days_until(notif['due_date'])
+    days_text = {
+        0: "сегодня",
+        1: "завтра",
+        2: "через 2 дня",
+        3: "через 3 дня"
+    }.get(days, f"через {days} дней")
+    
+    return (
+        f"🔔 <b>Напоминание о платеже!</b>\n\n"
+        f"{notif['icon']} <b>{notif['name']}</b>\n"
+        f"💰 Сумма: <b>{int(notif['price'])}₽</b>\n"
+        f"📅 Списание: <b>{days_text}</b>\n\n"
+        f"Убедитесь, что на карте достаточно средств."
+    )
+
+
+def trial_text(trial: dict) -> str:
+    days = days_until(trial['due_date'])
+    days_text = "сегодня" if days == 0 else f"{days} дн."
+    
+    return (
+        f"⏱ <b>Пробный период заканчивается!</b>\n\n"
+        f"📦 <b>{trial['name']}</b>\n"
+        f"📅 Осталось: <b>{days_text}</b>\n"
+        f"💰 После триала: <b>{int(trial['price'])}₽/мес</b>\n\n"
+        f"Не забудьте отменить, если подписка не нужна!"
+    )
+
+
+RENDERERS = {"sub": subscription_text, "trial": trial_text}
+
+
+async def run_notifications(bot, kind: str, run: dict = None, shard: int = db.HOME_SHARD):
+    """Прогон рассылки по шарду с сохранением курсора после каждого сообщения"""
+    if _stopping.is_set():
+        return
     
-    for days in [1, 2, 3, 5, 7]:
-        notifications = await db.get_users_for_notification(days)
+    if run is not None:
+        shard = db.shard_of_id(run['id'])
+    
+    # Ключ занимается до первого await: рассылка по расписанию и продолжение
+    # после рестарта не пойдут по шарду одновременно
+    key = (kind, shard)
+    if key in _claimed:
+        if run is not None and run['id'] != _claimed[key]:
+            # Идущий прогон начал с начала очереди и разошлёт и эти строки
+            await db.finish_notification_run(run['id'], "abandoned")
+        logger.info(f"⏭ Notification run ({kind}) in shard {shard} is already in progress")
+        return
+    
+    _claimed[key] = run['id'] if run else None
+    task = asyncio.current_task()
+    _active_runs.add(task)
+    
+    try:
+        if run is None:
+            run = await db.start_notification_run(kind, shard)
+            _claimed[key] = run['id']
+        logger.info(f"🔔 Notification run {run['id']} ({kind}) from cursor {run['cursor']}")
         
-        for notif in notifications:
-            if notif.get('notify_days', 1) != days:
-                continue
-            
-            days_text = {
-                1: "завтра",
-                2: "через 2 дня",
-                3: "через 3 дня"
-            }.get(days, f"через {days} дней")
+        while not _stopping.is_set():
+            batch = await db.get_due_notifications(kind, after_id=run['cursor'], limit=BATCH_SIZE, shard=shard)
+            if not batch:
+                break
             
-            text = (
-                f"🔔 <b>Напоминание о платеже!</b>\n\n"
-                f"{notif['icon']} <b>{notif['name']}</b>\n"
-                f"💰 Сумма: <b>{int(notif['price'])}₽</b>\n"
-                f"📅 Списание: <b>{days_text}</b>\n\n"
-                f"Убедитесь, что на карте достаточно средств."
-            )
-            
-            try:
-                await bot.send_message(notif['user_id'], text, parse_mode="HTML")
-                await db.log_notification(notif['id'], notif['user_id'])
-                logger.info(f"Sent notification to {notif['user_id']}")
-            except Exception as e:
-                logger.error(f"Failed to send to {notif['user_id']}: {e}")
-    
-    logger.info("✅ Subscription notifications done")
+            for notif in batch:
+                if _stopping.is_set():
+                    break
+                
+                try:
+                    await bot.send_message(notif['user_id'], RENDERERS[kind](notif), parse_mode="HTML")
+                except Exception as e:
+                    logger.error(f"Failed to send {kind} to {notif['user_id']}: {e}")
+                    await db.skip_notification(run['id'], notif['queue_id'])
+                else:
+                    await db.complete_notification(run['id'], notif)
+                run['cursor'] = notif['queue_id']
+        
+        status = "interrupted" if _stopping.is_set() else "done"
+        await db.finish_notification_run(run['id'], status)
+        logger.info(f"✅ Notification run {run['id']} ({kind}) {status}")
+    finally:
+        _active_runs.discard(task)
+        _claimed.pop(key, None)
+
+
+async def send_subscription_notifications(bot):
+    """Отправка уведомлений о платежах, шарды параллельно"""
+    await asyncio.gather(*(run_notifications(bot, "sub", shard=shard) for shard in db.all_shards()))
 
 
 async def send_trial_notifications(bot):
-    """Отправка уведомлений о триалах"""
-    logger.info("⏱ Checking trial notifications...")
-    
-    trials = await db.get_expiring_trials(days=2)
-    
-    for trial in trials:
-        text = (
-            f"⏱ <b>Пробный период заканчивается!</b>\n\n"
-            f"📦 <b>{trial['name']}</b>\n"
-            f"📅 Осталось: <b>2 дня</b>\n"
-            f"💰 После триала: <b>{int(trial['price_after'])}₽/мес</b>\n\n"
-            f"Не забудьте отменить, если подписка не нужна!"
-        )
-        
-        try:
-            await bot.send_message(trial['user_id'], text, parse_mode="HTML")
-            await db.mark_trial_notified(trial['id'])
-            logger.info(f"Sent trial notification to {trial['user_id']}")
-        except Exception as e:
-            logger.error(f"Failed to send trial to {trial['user_id']}: {e}")
+    """Отправка уведомлений о триалах, шарды параллельно"""
+    await asyncio.gather(*(run_notifications(bot, "trial", shard=shard) for shard in db.all_shards()))
+
+
+async def resume_notification_runs(bot):
+    """Продолжить прогоны, прерванные рестартом; вчерашние уже неактуальны"""
+    today = date.today().strftime("%Y-%m-%d")
     
-    logger.info("✅ Trial notifications done")
+    for run in await db.get_unfinished_notification_runs():
+        if run['run_date'] == today:
+            await run_notifications(bot, run['kind'], run)
+        else:
+            await db.finish_notification_run(run['id'], "abandoned")
+
+
+async def drain_notifications(timeout: float = DRAIN_TIMEOUT):
+    """Остановить рассылку: дождаться, пока прогоны сохранят курсор"""
+    _stopping.set()
+    if _active_runs:
+        logger.info(f"⏳ Draining {len(_active_runs)} notification runs...")
+        await asyncio.wait(_active_runs, timeout=timeout)
 
 
 async def update_payment_dates():
     """Обновление просроченных дат платежей"""
     logger.info("🔄 Updating payment dates...")
     
-    import aiosqlite
+    updated = await db.roll_payment_dates()
     
-    async with aiosqlite.connect(db.DB_PATH) as conn:
-        conn.row_factory = aiosqlite.Row
-        today = datetime.now().strftime("%Y-%m-%d")
-        
-        cursor = await conn.execute("""
-            SELECT * FROM subscriptions 
-            WHERE is_active = 1 AND next_payment < ?
-        """, (today,))
-        
-        rows = await cursor.fetchall()
-        
-        for row in rows:
-            await db.update_next_payment(row['id'])
-    
-    logger.info(f"✅ Updated {len(rows)} payment dates")
+    logger.info(f"✅ Updated {updated} payment dates")
 
 
-def setup_scheduler(bot):
-    """Настройка планировщика"""
+def setup_scheduler(bot, shared: bool = True, stats: bool = True):
+    """Настройка планировщика.
+    
+    shared — общие задачи (рассылки, даты, премиум, достижения), ровно в одном процессе;
+    stats — популяционная статистика, нужна каждому процессу, который её показывает.
+    """
     scheduler = AsyncIOScheduler(timezone="Europe/Moscow")
     
+    if stats:
+        # Популяционная статистика в 03:00 и сразу при старте
+        scheduler.add_job(
+            refresh_population_stats,
+            'cron',
+            hour=3,
+            minute=0,
+            next_run_time=datetime.now(scheduler.timezone)
+        )
+    
+    if not shared:
+        return scheduler
+    
+    # Снимок для тяжёлых чтений — сразу при старте и дальше по интервалу
+    if REPLICA_INTERVAL:
+        scheduler.add_job(
+            db.refresh_replicas,
+            'interval',
+            seconds=REPLICA_INTERVAL,
+            next_run_time=datetime.now(scheduler.timezone)
+        )
+    
     # Уведомления в 10:00 и 18:00
     scheduler.add_job(
         send_subscription_notifications,
@@ -111,15 +198,22 @@ def setup_scheduler(bot):
         args=[bot]
     )
     
-    # Триалы в 10:05
+    # Триалы в 10:05 и 18:05: заканчивающиеся сегодня не пропадут до завтрашней чистки
     scheduler.add_job(
         send_trial_notifications,
         'cron',
-        hour=10,
+        hour='10,18',
         minute=5,
         args=[bot]
     )
     
+    # Прерванные рестартом прогоны — сразу при старте
+    scheduler.add_job(
+        resume_notification_runs,
+        next_run_time=datetime.now(scheduler.timezone),
+        args=[bot]
+    )
+    
     # Обновление дат в 00:05
     scheduler.add_job(
         update_payment_dates,
@@ -128,4 +222,28 @@ def setup_scheduler(bot):
         minute=5
     )
     
+    # Истёкший премиум — каждый час
+    scheduler.add_job(
+        expire_premiums,
+        'cron',
+        minute=15
+    )
+    
+    # Досчёт достижений в 03:30
+    scheduler.add_job(
+        backfill_achievements,
+        'cron',
+        hour=3,
+        minute=30
+    )
+    
+    # Копия базы в 04:00, после ночных задач
+    if BACKUP_KEEP:
+        scheduler.add_job(
+            run_backup,
+            'cron',
+            hour=4,
+            minute=0
+        )
+    
     return scheduler
\ No newline at end of file
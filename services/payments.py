@@ -0,0 +1,86 @@
+import asyncio
+import json
+import logging
+
+import database as db
+
+logger = logging.getLogger(__name__)
+
+PREMIUM_DAYS = 30
+MAX_ATTEMPTS = 8
+BATCH_SIZE = 50
+# Без вебхуков инбокс всё равно проверяется раз в POLL_INTERVAL секунд
+POLL_INTERVAL = 30
+# Вебхук будит обработчик только в своём процессе. Если api запущен
+# отдельно, обработчик узнаёт о событиях лишь опросом — тогда инбокс
+# проверяется чаще (запрос идёт по idx_payment_events_pending)
+REMOTE_POLL_INTERVAL = 2
+
+# Статус платежа по событию ЮКассы
+EVENT_STATUSES = {
+    "payment.succeeded": "succeeded",
+    "payment.canceled": "canceled",
+    "payment.waiting_for_capture": "waiting_for_capture",
+}
+
+_wakeup = asyncio.Event()
+
+
+async def receive_event(body: dict) -> bool:
+    """Сохранить событие в инбокс и разбудить обработчик"""
+    payment_id = (body.get("object") or {}).get("id")
+    event = body.get("event")
+    if not payment_id or not event:
+        raise ValueError("event and object.id are required")
+
+    stored = await db.store_payment_event(payment_id, event, json.dumps(body, ensure_ascii=False))
+    if stored:
+        _wakeup.set()
+    return stored
+
+
+async def apply_event(row: dict):
+    body = json.loads(row['payload'])
+    metadata = (body.get("object") or {}).get("metadata") or {}
+    user_id = metadata.get("user_id")
+
+    await db.apply_payment_event(
+        row['id'],
+        row['payment_id'],
+        EVENT_STATUSES.get(row['event']),
+        int(user_id) if user_id else None,
+        PREMIUM_DAYS if row['event'] == "payment.succeeded" else 0,
+    )
+
+
+async def process_payment_events() -> int:
+    """Обработать накопившиеся события; возвращает число обработанных"""
+    processed = 0
+    while rows := await db.get_pending_payment_events(BATCH_SIZE):
+        for row in rows:
+            try:
+                await apply_event(row)
+                processed += 1
+            except Exception as e:
+                attempts = row['attempts'] + 1
+                retry_in = 2 ** attempts * 5 if attempts < MAX_ATTEMPTS else None
+                logger.error(f"❌ Payment event {row['id']} ({row['event']}) failed, attempt {attempts}: {e}")
+                await db.fail_payment_event(row['id'], str(e), retry_in)
+        if len(rows) < BATCH_SIZE:
+            break
+    return processed
+
+
+async def run_payment_worker(poll_interval: float = POLL_INTERVAL):
+    """Фоновый обработчик инбокса ЮКассы"""
+    while True:
+        try:
+            await process_payment_events()
+        except Exception as e:
+            logger.error(f"❌ Payment worker error: {e}")
+
+        try:
+            await asyncio.wait_for(_wakeup.wait(), timeout=poll_interval)
+        except asyncio.TimeoutError:
+            pass
+        _wakeup.clear()
@@ -0,0 +1,172 @@
+import asyncio
+import logging
+from datetime import datetime
+from typing import Optional
+
+# numpy загружается при первом пересчёте, а не при старте
+np = None
+
+import database as db
+from config import CATEGORIES
+
+logger = logging.getLogger(__name__)
+
+# Коды периодов и множители приведения к месяцу
+CYCLE_CODES = {"weekly": 0, "monthly": 1, "quarterly": 2, "yearly": 3}
+CYCLE_FACTORS = (4.33, 1.0, 1 / 3, 1 / 12)
+
+CATEGORY_KEYS = list(CATEGORIES)
+CATEGORY_CODES = {cat: i for i, cat in enumerate(CATEGORY_KEYS)}
+
+PERCENTILES = (25, 50, 75, 90)
+HISTOGRAM_BINS = (0, 300, 500, 1000, 2000, 3000, 5000, 10000, float("inf"))
+
+# Меньше пользователей — сравнение не показываем
+MIN_POPULATION = 20
+
+
+class PopulationStats:
+    """Снимок расходов всех пользователей с поиском по user_id за O(1)"""
+
+    def __init__(self, user_ids, totals, cat_spend):
+        self.built_at = datetime.now()
+        self.users = len(user_ids)
+        self.index = {int(uid): i for i, uid in enumerate(user_ids)}
+
+        self.totals = totals
+        self.cat_spend = cat_spend
+
+        # Доля пользователей, которые тратят строго меньше (в процентах)
+        n = max(self.users, 1)
+        self.total_rank = np.searchsorted(np.sort(totals), totals, side="left") / n * 100
+        sorted_spend = np.sort(cat_spend, axis=0)
+        self.cat_rank = np.empty_like(cat_spend)
+        for j in range(cat_spend.shape[1]):
+            self.cat_rank[:, j] = np.searchsorted(sorted_spend[:, j], cat_spend[:, j], side="left") / n * 100
+
+        self.total_percentiles = dict(zip(PERCENTILES, np.percentile(totals, PERCENTILES).tolist())) if self.users else {}
+
+        payers = cat_spend > 0
+        self.category_payers = payers.sum(axis=0)
+        self.category_totals = cat_spend.sum(axis=0)
+        self.category_medians = np.array([
+            np.median(cat_spend[payers[:, j], j]) if self.category_payers[j] else 0.0
+            for j in range(cat_spend.shape[1])
+        ])
+
+        counts, _ = np.histogram(totals, bins=HISTOGRAM_BINS)
+        self.histogram = counts
+
+    def user_insight(self, user_id: int) -> Optional[dict]:
+        row = self.index.get(user_id)
+        if row is None or self.users < MIN_POPULATION:
+            return None
+
+        spend = self.cat_spend[row]
+        ranks = self.cat_rank[row]
+
+        top = None
+        if spend.any():
+            j = int(np.argmax(np.where(spend > 0, ranks, -1)))
+            top = {
+                "category": CATEGORY_KEYS[j],
+                "name": CATEGORIES[CATEGORY_KEYS[j]],
+                "spend": round(float(spend[j]), 2),
+                "percentile": int(ranks[j]),
+            }
+
+        return {
+            "total": round(float(self.totals[row]), 2),
+            "percentile": int(self.total_rank[row]),
+            "top_category": top,
+            "users": self.users,
+        }
+
+    def overview(self) -> dict:
+        categories = [
+            {
+                "category": cat,
+                "name": CATEGORIES[cat],
+                "payers": int(self.category_payers[j]),
+                "monthly": round(float(self.category_totals[j]), 2),
+                "median": round(float(self.category_medians[j]), 2),
+            }
+            for j, cat in enumerate(CATEGORY_KEYS)
+        ]
+        categories.sort(key=lambda c: c["monthly"], reverse=True)
+
+        labels = [
+            f"{int(lo)}+" if hi == float("inf") else f"{int(lo)}-{int(hi)}"
+            for lo, hi in zip(HISTOGRAM_BINS, HISTOGRAM_BINS[1:])
+        ]
+
+        return {
+            "built_at": self.built_at.strftime("%Y-%m-%d %H:%M:%S"),
+            "users": self.users,
+            "monthly_total": round(float(self.totals.sum()), 2),
+            "percentiles": {f"p{p}": round(v, 2) for p, v in self.total_percentiles.items()},
+            "histogram": dict(zip(labels, self.histogram.tolist())),
+            "categories": categories,
+        }
+
+
+def build_stats(rows) -> PopulationStats:
+    """Векторный расчёт по колонкам (user_id, price, cycle, category)"""
+    if rows:
+        user_col, price_col, cycle_col, cat_col = zip(*rows)
+    else:
+        user_col, price_col, cycle_col, cat_col = (), (), (), ()
+
+    user_ids = np.fromiter(user_col, dtype=np.int64, count=len(rows))
+    prices = np.fromiter(price_col, dtype=np.float64, count=len(rows))
+    cycles = np.fromiter((CYCLE_CODES.get(c, 1) for c in cycle_col), dtype=np.int8, count=len(rows))
+    other = CATEGORY_CODES["other"]
+    cats = np.fromiter((CATEGORY_CODES.get(c, other) for c in cat_col), dtype=np.int16, count=len(rows))
+
+    monthly = prices * np.asarray(CYCLE_FACTORS)[cycles]
+
+    users, user_idx = np.unique(user_ids, return_inverse=True)
+    n_users, n_cats = len(users), len(CATEGORY_KEYS)
+
+    totals = np.bincount(user_idx, weights=monthly, minlength=n_users)
+    cat_spend = np.bincount(
+        user_idx * n_cats + cats, weights=monthly, minlength=n_users * n_cats
+    ).reshape(n_users, n_cats)
+
+    return PopulationStats(users, totals, cat_spend)
+
+
+_stats: Optional[PopulationStats] = None
+
+
+def load_numpy() -> bool:
+    global np
+    if np is None:
+        try:
+            import numpy
+        except ImportError:
+            return False
+        np = numpy
+    return True
+
+
+def get_population() -> Optional[PopulationStats]:
+    return _stats
+
+
+def get_user_insight(user_id: int) -> Optional[dict]:
+    return _stats.user_insight(user_id) if _stats else None
+
+
+async def refresh_population_stats():
+    """Ночной пересчёт популяционной статистики"""
+    global _stats
+
+    if not load_numpy():
+        logger.warning("⚠️ numpy not installed, population stats disabled")
+        return
+
+    logger.info("📈 Building population stats...")
+    rows = await db.get_active_subscription_rows()
+    _stats = await asyncio.to_thread(build_stats, rows)
+    logger.info(f"✅ Population stats: {_stats.users} users, {len(rows)} subscriptions")
@@ -0,0 +1,114 @@
+from calendar import monthrange
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, List, Optional
+
+# Шаг периода в месяцах; недельный период считается в днях
+CYCLE_MONTHS = {"monthly": 1, "quarterly": 3, "yearly": 12}
+WEEK = 7
+
+
+def parse_date(value) -> date:
+    if isinstance(value, date):
+        return value
+    return datetime.strptime(value, "%Y-%m-%d").date()
+
+
+def days_until(value, today: Optional[date] = None) -> int:
+    return (parse_date(value) - (today or date.today())).days
+
+
+def add_months(start: date, months: int, anchor_day: Optional[int] = None) -> date:
+    """Сдвиг на N календарных месяцев с привязкой к дню списания"""
+    year, month = divmod(start.month - 1 + months, 12)
+    year += start.year
+    month += 1
+    day = min(anchor_day or start.day, monthrange(year, month)[1])
+    return date(year, month, day)
+
+
+def charge_date(start: date, cycle: str, k: int, anchor_day: Optional[int] = None) -> date:
+    """Дата k-го списания, начиная со start (k = 0)"""
+    if cycle == "weekly":
+        return start + timedelta(days=WEEK * k)
+    return add_months(start, CYCLE_MONTHS.get(cycle, 1) * k, anchor_day)
+
+
+def periods_until(start: date, cycle: str, target: date, anchor_day: Optional[int] = None) -> int:
+    """Минимальное k >= 0, при котором k-е списание не раньше target"""
+    if target <= start:
+        return 0
+
+    if cycle == "weekly":
+        return -(-(target - start).days // WEEK)
+
+    step = CYCLE_MONTHS.get(cycle, 1)
+    month_diff = (target.year - start.year) * 12 + target.month - start.month
+    k = month_diff // step
+    if charge_date(start, cycle, k, anchor_day) < target:
+        k += 1
+    return k
+
+
+def advance(start: date, cycle: str, today: date, anchor_day: Optional[int] = None) -> date:
+    """Следующее списание после start, не раньше today"""
+    k = max(1, periods_until(start, cycle, today, anchor_day))
+    return charge_date(start, cycle, k, anchor_day)
+
+
+def project(start: date, cycle: str, date_from: date, date_to: date,
+            anchor_day: Optional[int] = None) -> List[date]:
+    """Все списания в интервале [date_from, date_to]"""
+    first = periods_until(start, cycle, date_from, anchor_day)
+    last = periods_until(start, cycle, date_to + timedelta(days=1), anchor_day)
+    return [charge_date(start, cycle, k, anchor_day) for k in range(first, last)]
+
+
+def sub_charges(sub: dict, date_from: date, date_to: date) -> List[date]:
+    try:
+        start = parse_date(sub['next_payment'])
+    except (TypeError, ValueError):
+        return []
+    return project(start, sub.get('cycle') or "monthly", date_from, date_to, sub.get('billing_day'))
+
+
+def upcoming_charges(subs: Iterable[dict], days: int, today: Optional[date] = None) -> List[dict]:
+    """Каждое списание в ближайшие N дней, включая повторные"""
+    today = today or date.today()
+    end = today + timedelta(days=days)
+
+    charges = []
+    for sub in subs:
+        for day in sub_charges(sub, today, end):
+            charges.append({**sub, "next_payment": day.strftime("%Y-%m-%d")})
+
+    charges.sort(key=lambda c: c['next_payment'])
+    return charges
+
+
+def forecast_days(subs: Iterable[dict], days: int, today: Optional[date] = None) -> List[float]:
+    """Сумма списаний по дням на N дней вперёд"""
+    today = today or date.today()
+    totals = [0.0] * days
+
+    for sub in subs:
+        for day in sub_charges(sub, today, today + timedelta(days=days - 1)):
+            totals[(day - today).days] += sub['price']
+
+    return totals
+
+
+def forecast_months(subs: Iterable[dict], months: int, today: Optional[date] = None) -> List[Dict]:
+    """Сумма списаний по календарным месяцам, начиная с текущего"""
+    today = today or date.today()
+    first = today.replace(day=1)
+    end = add_months(first, months) - timedelta(days=1)
+    totals = [0.0] * months
+
+    for sub in subs:
+        for day in sub_charges(sub, today, end):
+            totals[(day.year - first.year) * 12 + day.month - first.month] += sub['price']
+
+    return [
+        {"month": add_months(first, i).strftime("%Y-%m"), "total": round(total, 2)}
+        for i, total in enumerate(totals)
+    ]
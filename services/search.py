@@ -0,0 +1,76 @@
+from typing import Dict, List, Set
+
+from config import SERVICES, CATEGORIES
+
+MAX_PREFIX = 12
+
+
+def normalize(text: str) -> str:
+    return text.lower().replace("ё", "е").strip()
+
+
+def trigrams(text: str) -> Set[str]:
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class ServiceIndex:
+    """Префиксный и триграммный индекс по каталогу сервисов"""
+
+    def __init__(self, services: Dict[str, dict]):
+        self.items: Dict[str, dict] = {}
+        self.prefixes: Dict[str, Set[str]] = {}
+        self.grams: Dict[str, Set[str]] = {}
+
+        for name, data in services.items():
+            self.items[name] = {
+                "name": name,
+                "icon": data.get("icon", "📦"),
+                "price": data.get("price", 0),
+                "category": data.get("cat", "other"),
+                "category_name": CATEGORIES.get(data.get("cat", "other"), ""),
+            }
+
+            norm = normalize(name)
+            # Префиксы всего названия и каждого слова: "yand", "музы"
+            words = [norm] + norm.split()
+            for word in words:
+                for i in range(1, min(len(word), MAX_PREFIX) + 1):
+                    self.prefixes.setdefault(word[:i], set()).add(name)
+
+            for gram in trigrams(norm):
+                self.grams.setdefault(gram, set()).add(name)
+
+    def search(self, query: str, limit: int = 10) -> List[dict]:
+        query = normalize(query)
+        if not query:
+            return list(self.items.values())[:limit]
+
+        # Точные префиксы выше опечаток
+        hits = self.prefixes.get(query[:MAX_PREFIX], set())
+        if len(query) > MAX_PREFIX:
+            hits = {n for n in hits if query in normalize(n)}
+
+        ranked = sorted(hits, key=lambda n: (not normalize(n).startswith(query), len(n), n))
+
+        if len(ranked) < limit and len(query) >= 3:
+            query_grams = trigrams(query)
+            scores: Dict[str, int] = {}
+            for gram in query_grams:
+                for name in self.grams.get(gram, ()):
+                    if name not in hits:
+                        scores[name] = scores.get(name, 0) + 1
+
+            threshold = max(2, len(query_grams) // 2)
+            fuzzy = [n for n, s in scores.items() if s >= threshold]
+            fuzzy.sort(key=lambda n: (-scores[n], len(n), n))
+            ranked += fuzzy
+
+        return [self.items[n] for n in ranked[:limit]]
+
+
+index = ServiceIndex(SERVICES)
+
+
+def search_services(query: str, limit: int = 10) -> List[dict]:
+    return index.search(query, limit)
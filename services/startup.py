@@ -0,0 +1,127 @@
+import asyncio
+import builtins
+import logging
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+from config import STARTUP_BUDGET
+
+logger = logging.getLogger(__name__)
+
+# Сколько самых медленных модулей показывать в отчёте
+TOP_IMPORTS = 15
+
+
+class ImportTimer:
+    """Время импорта каждого модуля через подмену builtins.__import__.
+    
+    Как у -X importtime: self — без вложенных импортов, cumulative — с ними.
+    Меряется только главный поток; повторные импорты не считаются.
+    """
+
+    def __init__(self):
+        self.times = {}
+        self._stack = []
+        self._thread = threading.get_ident()
+        self._original = None
+
+    def install(self):
+        if self._original is None:
+            self._original = builtins.__import__
+            builtins.__import__ = self._import
+
+    def uninstall(self):
+        if self._original is not None:
+            builtins.__import__ = self._original
+            self._original = None
+
+    def _import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        original = self._original or builtins.__import__
+        if level or name in sys.modules or threading.get_ident() != self._thread:
+            return original(name, globals, locals, fromlist, level)
+
+        self._stack.append(0.0)
+        started = time.perf_counter()
+        try:
+            return original(name, globals, locals, fromlist, level)
+        finally:
+            cumulative = time.perf_counter() - started
+            nested = self._stack.pop()
+            if self._stack:
+                self._stack[-1] += cumulative
+            self.times[name] = (cumulative - nested, cumulative)
+
+    def slowest(self, limit: int = TOP_IMPORTS) -> list:
+        return sorted(self.times.items(), key=lambda item: item[1][0], reverse=True)[:limit]
+
+
+class StartupProfile:
+    """Замеры холодного старта: импорты и шаги lifespan по порядку"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.steps = []
+        self.ready = asyncio.Event()
+        # Старт закончился — успешно или с ошибкой
+        self.finished = asyncio.Event()
+        self.ready_at = None
+        self.error = None
+        self.imports = ImportTimer()
+        self.imports.install()
+
+    @contextmanager
+    def step(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.steps.append((name, time.perf_counter() - started))
+
+    def record(self, name: str, started: float):
+        self.steps.append((name, time.perf_counter() - started))
+
+    def mark_ready(self):
+        self.ready_at = time.perf_counter() - self.started
+        self.imports.uninstall()
+        self.ready.set()
+        self.finished.set()
+        self.log_report()
+
+    def fail(self, error: Exception):
+        self.error = str(error)
+        self.imports.uninstall()
+        self.finished.set()
+
+    def report(self) -> dict:
+        elapsed = self.ready_at if self.ready_at is not None else time.perf_counter() - self.started
+        return {
+            "ready": self.ready.is_set(),
+            "error": self.error,
+            "elapsed_ms": round(elapsed * 1000),
+            "budget_ms": round(STARTUP_BUDGET * 1000),
+            "steps": [{"name": name, "ms": round(seconds * 1000)} for name, seconds in self.steps],
+            "imports": [
+                {"module": name, "self_ms": round(own * 1000, 1), "cumulative_ms": round(cumulative * 1000, 1)}
+                for name, (own, cumulative) in self.imports.slowest()
+            ],
+        }
+
+    def log_report(self):
+        lines = [f"{name:<28}{seconds * 1000:>8.0f} ms" for name, seconds in self.steps]
+        logger.info("⏱ Startup profile:\n" + "\n".join(lines))
+
+        lines = [
+            f"{name:<28}{own * 1000:>8.1f} ms{cumulative * 1000:>10.1f} ms"
+            for name, (own, cumulative) in self.imports.slowest()
+        ]
+        logger.info("⏱ Slowest imports (self, cumulative):\n" + "\n".join(lines))
+
+        if self.ready_at > STARTUP_BUDGET:
+            logger.warning(f"⚠️ Startup took {self.ready_at:.2f}s, budget {STARTUP_BUDGET:.2f}s")
+        else:
+            logger.info(f"✅ Ready in {self.ready_at:.2f}s (budget {STARTUP_BUDGET:.2f}s)")
+
+
+profile = StartupProfile()
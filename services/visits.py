@@ -0,0 +1,97 @@
+from datetime import date, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Бит i в истории посещений — день EPOCH + i
+EPOCH = date(2024, 1, 1)
+
+RETENTION_DAYS = (1, 7, 30)
+
+
+def day_index(day: Optional[date] = None) -> int:
+    return ((day or date.today()) - EPOCH).days
+
+
+def to_bits(blob: Optional[bytes]) -> int:
+    return int.from_bytes(blob, "little") if blob else 0
+
+
+def to_blob(bits: int) -> bytes:
+    return bits.to_bytes((bits.bit_length() + 7) // 8, "little")
+
+
+def mark_visit(blob: Optional[bytes], day: Optional[date] = None) -> bytes:
+    return to_blob(to_bits(blob) | 1 << day_index(day))
+
+
+def visited(bits: int, day: date) -> bool:
+    return bool(bits >> day_index(day) & 1)
+
+
+def streak(bits: int, today: Optional[date] = None) -> int:
+    """Дней подряд с посещением, заканчивая сегодня (или вчера, если сегодня ещё не заходил)"""
+    t = day_index(today)
+    if not bits >> t & 1:
+        t -= 1
+    if t < 0 or not bits >> t & 1:
+        return 0
+
+    # Старший ноль не выше t — там серия и обрывается
+    gaps = ~bits & ((1 << t + 1) - 1)
+    return t + 1 if not gaps else t - gaps.bit_length() + 1
+
+
+def active_days(bits: int, days: int, today: Optional[date] = None) -> int:
+    """Дней с посещением за последние N дней, включая сегодня"""
+    t = day_index(today)
+    start = max(t - days + 1, 0)
+    return (bits >> start & (1 << t - start + 1) - 1).bit_count()
+
+
+def first_day(bits: int) -> Optional[int]:
+    return (bits & -bits).bit_length() - 1 if bits else None
+
+
+def activity(blobs: Iterable[Optional[bytes]], today: Optional[date] = None) -> Dict[str, int]:
+    """DAU / WAU / MAU по историям всех пользователей"""
+    t = day_index(today)
+    result = {"dau": 0, "wau": 0, "mau": 0}
+    for blob in blobs:
+        bits = to_bits(blob)
+        if bits >> t & 1:
+            result["dau"] += 1
+        if bits >> max(t - 6, 0):
+            result["wau"] += 1
+        if bits >> max(t - 29, 0):
+            result["mau"] += 1
+    return result
+
+
+def retention(blobs: Iterable[Optional[bytes]], today: Optional[date] = None,
+              offsets: Tuple[int, ...] = RETENTION_DAYS) -> List[dict]:
+    """Возврат на N-й день по месячным когортам первого посещения"""
+    t = day_index(today)
+    cohorts = {}
+
+    for blob in blobs:
+        bits = to_bits(blob)
+        first = first_day(bits)
+        if first is None:
+            continue
+
+        month = (EPOCH + timedelta(days=first)).strftime("%Y-%m")
+        cohort = cohorts.setdefault(month, {"cohort": month, "users": 0, **{f"d{n}": [0, 0] for n in offsets}})
+        cohort["users"] += 1
+        for n in offsets:
+            # Учитываем только тех, для кого N-й день уже наступил
+            if first + n <= t:
+                cohort[f"d{n}"][1] += 1
+                cohort[f"d{n}"][0] += bits >> first + n & 1
+
+    result = []
+    for month in sorted(cohorts):
+        cohort = cohorts[month]
+        for n in offsets:
+            returned, eligible = cohort[f"d{n}"]
+            cohort[f"d{n}"] = round(returned / eligible * 100, 1) if eligible else None
+        result.append(cohort)
+    return result
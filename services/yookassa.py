@@ -0,0 +1,96 @@
+import asyncio
+import logging
+import uuid
+from typing import Optional
+
+import aiohttp
+
+from config import YOOKASSA_SHOP_ID, YOOKASSA_SECRET_KEY, YOOKASSA_API_URL
+
+logger = logging.getLogger(__name__)
+
+# Сетевые ошибки и эти статусы повторяем с тем же ключом идемпотентности
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class YooKassaError(Exception):
+    pass
+
+
+class YooKassaClient:
+    """Асинхронный клиент API ЮКассы с общим пулом соединений"""
+
+    def __init__(self, shop_id: str, secret_key: str, base_url: str = YOOKASSA_API_URL,
+                 timeout: float = 10, retries: int = 3, backoff: float = 0.5):
+        self.auth = aiohttp.BasicAuth(shop_id, secret_key)
+        self.base_url = base_url.rstrip("/")
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    def session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                auth=self.auth,
+                timeout=self.timeout,
+                connector=aiohttp.TCPConnector(limit=20),
+            )
+        return self._session
+
+    async def close(self):
+        if self._session and not self._session.closed:
+            await self._session.close()
+
+    async def request(self, method: str, path: str, payload: dict = None, idempotence_key: str = None) -> dict:
+        headers = {"Idempotence-Key": idempotence_key} if idempotence_key else {}
+        error = None
+
+        for attempt in range(self.retries):
+            if attempt:
+                await asyncio.sleep(self.backoff * 2 ** (attempt - 1))
+            try:
+                async with self.session().request(method, self.base_url + path, json=payload, headers=headers) as resp:
+                    if resp.status in RETRY_STATUSES:
+                        error = YooKassaError(f"HTTP {resp.status}")
+                        continue
+                    try:
+                        data = await resp.json(content_type=None)
+                    except ValueError:
+                        # Прокси и балансировщики отвечают HTML-страницей
+                        raise YooKassaError(f"HTTP {resp.status}: response is not JSON")
+                    if not isinstance(data, dict):
+                        raise YooKassaError(f"HTTP {resp.status}: unexpected response")
+                    if resp.status >= 400:
+                        raise YooKassaError(data.get("description") or f"HTTP {resp.status}")
+                    return data
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                error = YooKassaError(f"{type(e).__name__}: {e}")
+
+        logger.warning(f"⚠️ YooKassa {method} {path} failed after {self.retries} attempts: {error}")
+        raise error
+
+    async def create_payment(self, amount: float, description: str, return_url: str, metadata: dict) -> dict:
+        return await self.request("POST", "/payments", {
+            "amount": {"value": f"{amount:.2f}", "currency": "RUB"},
+            "confirmation": {"type": "redirect", "return_url": return_url},
+            "capture": True,
+            "description": description,
+            "metadata": metadata,
+        }, idempotence_key=str(uuid.uuid4()))
+
+
+_client: Optional[YooKassaClient] = None
+
+
+def get_client() -> Optional[YooKassaClient]:
+    """Общий клиент; None, если ЮКасса не настроена"""
+    global _client
+    if _client is None and YOOKASSA_SHOP_ID and YOOKASSA_SECRET_KEY:
+        _client = YooKassaClient(YOOKASSA_SHOP_ID, YOOKASSA_SECRET_KEY)
+    return _client
+
+
+async def close_client():
+    if _client:
+        await _client.close()
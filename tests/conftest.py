@@ -0,0 +1,19 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database as db
+from services.cache import LRUCache
+
+
+@pytest.fixture
+def fresh_db(tmp_path, monkeypatch):
+    """Пустая база во временном каталоге и чистые кэши модуля database"""
+    monkeypatch.setattr(db, "DB_PATH", str(tmp_path / "subtracker.db"))
+    monkeypatch.setattr(db, "_writers", {})
+    monkeypatch.setattr(db, "_known_users", LRUCache(maxsize=100000))
+    monkeypatch.setattr(db, "pending", db.WriteBehind())
+    return db
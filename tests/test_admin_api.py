@@ -0,0 +1,40 @@
+"""Доступ к /api/admin по токену"""
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+
+import bot
+
+
+@pytest.fixture
+def client(monkeypatch):
+    # Без boot(): запросы к /api не ждут окончания старта
+    ready = asyncio.Event()
+    ready.set()
+    monkeypatch.setattr(bot.profile, "ready", ready)
+    return TestClient(bot.app)
+
+
+def test_wrong_or_missing_token_is_forbidden(client, monkeypatch):
+    monkeypatch.setattr(bot, "ADMIN_TOKEN", "secret")
+    for headers in ({}, {"X-Admin-Token": "wrong"}, {"X-Admin-Token": ""}, {"X-Admin-Token": "secret-"}):
+        response = client.get("/api/admin/overview", headers=headers)
+        assert response.status_code == 403
+
+
+def test_empty_admin_token_disables_admin_api(client, monkeypatch):
+    for token in (None, ""):
+        monkeypatch.setattr(bot, "ADMIN_TOKEN", token)
+        response = client.get("/api/admin/overview", headers={"X-Admin-Token": ""})
+        assert response.status_code == 403
+        with pytest.raises(HTTPException):
+            bot.check_admin(token)
+
+
+def test_matching_token_passes(monkeypatch):
+    monkeypatch.setattr(bot, "ADMIN_TOKEN", "secret")
+    bot.check_admin("secret")
+    with pytest.raises(HTTPException):
+        bot.check_admin("Secret")
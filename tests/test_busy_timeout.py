@@ -0,0 +1,51 @@
+"""Соединения ждут блокировку другого процесса, а не падают с "database is locked\""""
+import asyncio
+import sqlite3
+import threading
+import time
+
+
+def test_connections_set_busy_timeout(fresh_db):
+    db = fresh_db
+
+    async def scenario():
+        await db.init_db()
+        writer = await db.get_writer().connect()
+        async with db.reader() as reader:
+            for conn in (writer, reader):
+                cursor = await conn.execute("PRAGMA busy_timeout")
+                assert (await cursor.fetchone())[0] == db.BUSY_TIMEOUT * 1000
+        await db.close_writer()
+
+    asyncio.run(scenario())
+
+
+def test_write_waits_for_another_process_lock(fresh_db):
+    db = fresh_db
+    asyncio.run(db.init_db())
+
+    # Другой процесс держит запись
+    locked = threading.Event()
+
+    def hold_lock():
+        conn = sqlite3.connect(db.DB_PATH)
+        conn.execute("BEGIN IMMEDIATE")
+        locked.set()
+        time.sleep(0.5)
+        conn.commit()
+        conn.close()
+
+    thread = threading.Thread(target=hold_lock)
+    thread.start()
+    locked.wait()
+
+    async def scenario():
+        started = time.perf_counter()
+        await db.ensure_user(7, first_name="Other")
+        waited = time.perf_counter() - started
+        assert (await db.get_user(7))['first_name'] == "Other"
+        await db.close_writer()
+        return waited
+
+    assert asyncio.run(scenario()) >= 0.3
+    thread.join()
@@ -0,0 +1,41 @@
+"""Число шардов записано в базе и сверяется при старте"""
+import asyncio
+import sqlite3
+
+import pytest
+
+
+def init_with(db, monkeypatch, shards: int):
+    monkeypatch.setattr(db, "SHARDS", shards)
+    monkeypatch.setattr(db, "_writers", {})
+    asyncio.run(db.init_db())
+
+
+def test_shard_count_is_recorded_and_checked(fresh_db, monkeypatch):
+    db = fresh_db
+    init_with(db, monkeypatch, 2)
+    conn = sqlite3.connect(db.shard_path(1))
+    assert conn.execute("SELECT value FROM shard_meta WHERE key = 'shards'").fetchone() == (2,)
+    conn.close()
+
+    for shards in (1, 3):
+        with pytest.raises(db.ShardCountMismatch):
+            init_with(db, monkeypatch, shards)
+
+    # Отказ не создаёт файлы новых шардов, прежнее значение стартует
+    assert not db.os.path.exists(db.shard_path(2))
+    init_with(db, monkeypatch, 2)
+
+
+def test_base_without_record_counts_shard_files(fresh_db, monkeypatch):
+    db = fresh_db
+    init_with(db, monkeypatch, 1)
+    # База, созданная до записи числа шардов
+    conn = sqlite3.connect(db.DB_PATH)
+    conn.execute("DROP TABLE shard_meta")
+    conn.commit()
+    conn.close()
+
+    with pytest.raises(db.ShardCountMismatch):
+        init_with(db, monkeypatch, 2)
+    init_with(db, monkeypatch, 1)
@@ -0,0 +1,52 @@
+"""Единица работы апдейта не держит писателя на время запросов к Telegram"""
+import asyncio
+import time
+from types import SimpleNamespace
+
+from handlers import subscriptions
+from handlers.middleware import UnitOfWorkMiddleware
+
+SLOW_CALL = 0.5
+
+
+def callback_query(data: str, user_id: int, calls: list):
+    async def slow_call(*args, **kwargs):
+        calls.append(time.perf_counter())
+        await asyncio.sleep(SLOW_CALL)
+
+    return SimpleNamespace(
+        data=data,
+        from_user=SimpleNamespace(id=user_id),
+        answer=slow_call,
+        message=SimpleNamespace(edit_text=slow_call),
+    )
+
+
+def test_writer_is_free_while_handler_awaits_telegram(fresh_db):
+    db = fresh_db
+
+    async def scenario():
+        await db.init_db()
+        await db.ensure_user(1)
+        await db.ensure_user(2)
+        sub_id = await db.add_subscription(1, "Netflix", 599, next_payment="2030-01-01")
+
+        calls = []
+        callback = callback_query(f"confirm_del:{sub_id}", 1, calls)
+        handler = asyncio.create_task(UnitOfWorkMiddleware()(
+            lambda event, data: subscriptions.confirm_delete_sub(event), callback, {}
+        ))
+        while not calls:
+            await asyncio.sleep(0.01)
+
+        # Хендлер ждёт Telegram: его записи уже зафиксированы, а писатель свободен
+        assert await db.get_subscription(sub_id) is None
+        started = time.perf_counter()
+        await db.update_user(2, notify_days=3)
+        assert time.perf_counter() - started < SLOW_CALL / 2
+
+        await handler
+        assert (await db.get_user(2))['notify_days'] == 3
+        await db.close_writer()
+
+    asyncio.run(scenario())
@@ -0,0 +1,109 @@
+"""Клиент ЮКассы против локальной подмены API на aiohttp.web"""
+import asyncio
+import os
+import sys
+
+import pytest
+from aiohttp import web
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.yookassa import YooKassaClient, YooKassaError
+
+
+async def with_stand_in(responses, check):
+    """Поднять подмену, которая отдаёт responses по очереди, и вызвать check(client, requests)"""
+    requests = []
+    queue = list(responses)
+
+    async def handler(request):
+        requests.append({
+            "auth": request.headers.get("Authorization"),
+            "key": request.headers.get("Idempotence-Key"),
+            "body": await request.json(),
+        })
+        delay, status, body, content_type = queue.pop(0)
+        await asyncio.sleep(delay)
+        return web.Response(status=status, text=body, content_type=content_type)
+
+    app = web.Application()
+    app.router.add_post("/v3/payments", handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+
+    client = YooKassaClient("shop", "secret", base_url=f"http://127.0.0.1:{port}/v3", backoff=0.01)
+    try:
+        await check(client, requests)
+    finally:
+        await client.close()
+        await runner.cleanup()
+
+
+def create(client):
+    return client.create_payment(399, "Поддержка", "https://t.me/bot", {"user_id": 1})
+
+
+def test_retry_keeps_idempotence_key_and_loop_responsive():
+    responses = [
+        (0, 503, "", "text/plain"),
+        (0.3, 200, '{"id": "pay-1", "status": "pending"}', "application/json"),
+    ]
+
+    async def check(client, requests):
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        task = asyncio.create_task(ticker())
+        payment = await create(client)
+        task.cancel()
+
+        assert payment["id"] == "pay-1"
+        assert len(requests) == 2
+        assert requests[0]["key"] == requests[1]["key"]
+        assert requests[0]["auth"].startswith("Basic ")
+        assert requests[0]["body"]["amount"] == {"value": "399.00", "currency": "RUB"}
+        # Медленный ответ не остановил event loop
+        assert ticks >= 10
+
+    asyncio.run(with_stand_in(responses, check))
+
+
+def test_api_error_description():
+    responses = [(0, 400, '{"type": "error", "description": "Invalid amount"}', "application/json")]
+
+    async def check(client, requests):
+        with pytest.raises(YooKassaError, match="Invalid amount"):
+            await create(client)
+        assert len(requests) == 1
+
+    asyncio.run(with_stand_in(responses, check))
+
+
+@pytest.mark.parametrize("status", [200, 403])
+def test_non_json_body_is_yookassa_error(status):
+    responses = [(0, status, "<html>Forbidden</html>", "text/html")]
+
+    async def check(client, requests):
+        with pytest.raises(YooKassaError, match="not JSON"):
+            await create(client)
+
+    asyncio.run(with_stand_in(responses, check))
+
+
+def test_gives_up_after_retries():
+    responses = [(0, 502, "", "text/plain")] * 3
+
+    async def check(client, requests):
+        with pytest.raises(YooKassaError, match="HTTP 502"):
+            await create(client)
+        assert len(requests) == 3
+
+    asyncio.run(with_stand_in(responses, check))